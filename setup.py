@@ -15,9 +15,11 @@ setup(
     version='1.0.2',
     author='Matthew Wakefield',
     author_email='matthew.wakefield@unimelb.edu.au',
-    packages=['xenomapper'],
+    packages=['xenomapper', 'xenomapper.benchmark'],
+    package_data={'xenomapper.benchmark': ['baseline.json']},
     include_package_data = True,
     install_requires=install_requires,
+    extras_require={'vectorised': ['numpy']},
     url='https://github.com/genomematt/xenomapper.git',
     license='GPLv3',
     entry_points={
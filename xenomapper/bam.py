@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+bam.py
+
+Pure python decoding of BGZF compressed BAM files for xenomapper.
+
+BAM records are decoded only as far as xenomapper needs to classify them
+(the read name, the flag and the numeric alignment score tags).  The full
+SAM representation of a record is only built if it is requested, which in
+practice means only for reads that are written to a SAM output file.
+
+Uses zlib from the standard library so samtools is not required.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import io
+import re
+import struct
+import zlib
+from collections import deque
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+BGZF_HEADER = struct.Struct('<4BI2BH')      #ID1 ID2 CM FLG MTIME XFL OS XLEN
+BGZF_HEADER_SIZE = BGZF_HEADER.size
+BAM_MAGIC = b'BAM\x01'
+BGZF_BLOCK_SIZE = 0xff00  #maximum uncompressed data per block as used by htslib
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+#Numeric tags extracted from each record without building a SAM line
+SCORE_TAGS = frozenset(('AS','XS','ZS','NM'))
+
+_CORE = struct.Struct('<iiBBHHHiiii')
+_CIGAR_OPS = 'MIDNSHP=X'
+_SEQ_CODES = '=ACMGRSVTWYHKDBN'
+_SEQ_PAIRS = [a+b for a in _SEQ_CODES for b in _SEQ_CODES]
+_QUAL_TABLE = bytes((x + 33) & 0xff for x in range(256))
+_AUX_SIZES = {'A':1, 'c':1, 'C':1, 's':2, 'S':2, 'i':4, 'I':4, 'f':4}
+_AUX_FORMATS = {'c':'<b', 'C':'<B', 's':'<h', 'S':'<H', 'i':'<i', 'I':'<I', 'f':'<f'}
+_CIGAR_CODES = {op:i for i,op in enumerate(_CIGAR_OPS)}
+_CIGAR_RE = re.compile(r'([0-9]+)([MIDNSHP=X])')
+_SEQ_NIBBLES = {base:i for i,base in enumerate(_SEQ_CODES)}
+_SEQ_NIBBLES.update({base.lower():i for i,base in enumerate(_SEQ_CODES)})
+_SEQ_BYTES = {a+b:(_SEQ_NIBBLES[a] << 4) | _SEQ_NIBBLES[b] for a in _SEQ_NIBBLES for b in _SEQ_NIBBLES}
+_UNQUAL_TABLE = bytes((x - 33) & 0xff for x in range(256))
+
+
+def is_bgzf(data):
+    """Return True if data starts with a BGZF block header (a gzip header
+    with a BC extra subfield).  At least the first 18 bytes are required."""
+    return len(data) >= BGZF_HEADER_SIZE + 6 and data[:4] == b'\x1f\x8b\x08\x04' and data[12:14] == b'BC'
+
+
+def decompress_block(data):
+    """Return the decompressed contents of the compressed data and gzip
+    footer of a BGZF block, checking the CRC and size"""
+    result = zlib.decompress(data[:-8], -15)
+    crc, isize = struct.unpack_from('<II', data, len(data) - 8)
+    if len(result) != isize or zlib.crc32(result) != crc:
+        raise ValueError('BGZF block failed CRC or size check')
+    return result
+
+
+class BgzfReader(io.RawIOBase):
+    """Sequential reader for BGZF (blocked gzip) compressed files.
+
+    Blocks can be decompressed ahead of the reader on the threads of an
+    optional concurrent.futures executor. zlib releases the GIL so
+    decompression runs in parallel with the calling thread.
+    BgzfReader is a raw binary stream, so wrapping it in an
+    io.BufferedReader provides readline, peek and iteration over lines.
+    Arguments:
+        fileobj     - a binary file or file like object in BGZF format
+        executor    - an optional concurrent.futures executor
+        max_pending - the maximum number of blocks decompressed ahead
+                      of the reader when using an executor. Default = 16
+    """
+    def __init__(self, fileobj, executor=None, max_pending=16):
+        self.fileobj = fileobj
+        self.executor = executor
+        self.max_pending = max_pending
+        self._buffer = b''
+        self._offset = 0
+        self._pending = deque()
+        pass
+
+    def read_compressed_block(self):
+        """Return the compressed data and gzip footer of the next BGZF block
+        or None at the end of the file."""
+        header = self.fileobj.read(BGZF_HEADER_SIZE)
+        if not header:
+            return None
+        if len(header) < BGZF_HEADER_SIZE:
+            raise ValueError('Truncated BGZF block header')
+        id1, id2, cm, flg, mtime, xfl, os_, xlen = BGZF_HEADER.unpack(header)
+        if (id1, id2, cm, flg) != (31, 139, 8, 4):
+            raise ValueError('Not a BGZF file: invalid block header')
+        extra = self.fileobj.read(xlen)
+        block_size = None
+        i = 0
+        while i + 4 <= len(extra):
+            subfield_length = struct.unpack_from('<H', extra, i+2)[0]
+            if extra[i:i+2] == b'BC' and subfield_length == 2:
+                block_size = struct.unpack_from('<H', extra, i+4)[0] + 1
+            i += 4 + subfield_length
+        if block_size is None:
+            raise ValueError('Not a BGZF file: no BC block size field in gzip header')
+        remainder = self.fileobj.read(block_size - BGZF_HEADER_SIZE - xlen)
+        if len(remainder) != block_size - BGZF_HEADER_SIZE - xlen:
+            raise ValueError('Truncated BGZF block')
+        return remainder
+
+    def read_block(self):
+        """Return the decompressed contents of the next BGZF block
+        or None at the end of the file. Empty blocks (such as the
+        BGZF end of file marker) return an empty bytes object."""
+        if not self.executor:
+            data = self.read_compressed_block()
+            return None if data is None else decompress_block(data)
+        while len(self._pending) < self.max_pending:
+            data = self.read_compressed_block()
+            if data is None:
+                break
+            self._pending.append(self.executor.submit(decompress_block, data))
+        if not self._pending:
+            return None
+        return self._pending.popleft().result()
+
+    def read(self, size):
+        """Return up to size bytes of decompressed data.
+        Fewer bytes are returned only at the end of the file."""
+        while len(self._buffer) - self._offset < size:
+            block = self.read_block()
+            if block is None:
+                break
+            self._buffer = self._buffer[self._offset:] + block
+            self._offset = 0
+        result = self._buffer[self._offset:self._offset+size]
+        self._offset += len(result)
+        return result
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        """Read decompressed data from at most one BGZF block into a
+        writable buffer and return the number of bytes read"""
+        while self._offset >= len(self._buffer):
+            block = self.read_block()
+            if block is None:
+                return 0
+            self._buffer = block
+            self._offset = 0
+        size = min(len(buffer), len(self._buffer) - self._offset)
+        buffer[:size] = self._buffer[self._offset:self._offset+size]
+        self._offset += size
+        return size
+
+
+def read_bam_header(bgzf):
+    """Read the header of a BAM file
+    Arguments:
+        bgzf       - a BgzfReader positioned at the start of a BAM file
+    Returns:
+        header     - a list of SAM header lines (without newlines)
+        references - a list of reference sequence names in BAM refID order
+    """
+    magic = bgzf.read(4)
+    if magic != BAM_MAGIC:
+        raise ValueError('Not a BAM file: invalid magic number {0}'.format(magic))
+    l_text = struct.unpack('<i', bgzf.read(4))[0]
+    text = bgzf.read(l_text).rstrip(b'\x00').decode('ascii')
+    n_ref = struct.unpack('<i', bgzf.read(4))[0]
+    references = []
+    lengths = []
+    for i in range(n_ref):
+        l_name = struct.unpack('<i', bgzf.read(4))[0]
+        references.append(bgzf.read(l_name).rstrip(b'\x00').decode('ascii'))
+        lengths.append(struct.unpack('<i', bgzf.read(4))[0])
+    header = [x for x in text.split('\n') if x]
+    if references and not [x for x in header if x.startswith('@SQ')]:
+        #as for samtools view -H add @SQ lines if the text header lacks them
+        sq_lines = ['@SQ\tSN:{0}\tLN:{1}'.format(name, length) for name, length in zip(references, lengths)]
+        if header and header[0].startswith('@HD'):
+            header = header[:1] + sq_lines + header[1:]
+        else:
+            header = sq_lines + header
+    return header, references
+
+
+def _skip_aux_value(data, i, value_type):
+    """Return the offset of the next aux field after a value of value_type at offset i"""
+    if value_type in _AUX_SIZES:
+        return i + _AUX_SIZES[value_type]
+    elif value_type == 'Z' or value_type == 'H':
+        return data.index(b'\x00', i) + 1
+    elif value_type == 'B':
+        subtype = chr(data[i])
+        count = struct.unpack_from('<i', data, i+1)[0]
+        return i + 5 + _AUX_SIZES[subtype] * count
+    raise ValueError('Unknown BAM aux field type {0}'.format(value_type)) #pragma: no cover
+
+
+def _score_tags(data, i, wanted=SCORE_TAGS):
+    """Extract the numeric tags in wanted from the aux fields of a BAM record
+    starting at offset i. Non numeric values (eg XS:A from spliced aligners)
+    are ignored."""
+    tags = {}
+    end = len(data)
+    while i < end:
+        tag = data[i:i+2].decode('ascii')
+        value_type = chr(data[i+2])
+        i += 3
+        if tag in wanted and value_type in _AUX_FORMATS:
+            if tag in tags:
+                raise ValueError('BAM record has multiple values of {0}'.format(tag)) #pragma: no cover
+            tags[tag] = float(struct.unpack_from(_AUX_FORMATS[value_type], data, i)[0])
+        i = _skip_aux_value(data, i, value_type)
+    return tags
+
+
+def _format_aux(data, i):
+    """Return a list of SAM formatted aux fields starting at offset i"""
+    fields = []
+    end = len(data)
+    while i < end:
+        tag = data[i:i+2].decode('ascii')
+        value_type = chr(data[i+2])
+        i += 3
+        next_i = _skip_aux_value(data, i, value_type)
+        if value_type == 'A':
+            fields.append('{0}:A:{1}'.format(tag, chr(data[i])))
+        elif value_type == 'f':
+            fields.append('{0}:f:{1:g}'.format(tag, struct.unpack_from('<f', data, i)[0]))
+        elif value_type in _AUX_FORMATS:
+            fields.append('{0}:i:{1}'.format(tag, struct.unpack_from(_AUX_FORMATS[value_type], data, i)[0]))
+        elif value_type == 'Z' or value_type == 'H':
+            fields.append('{0}:{1}:{2}'.format(tag, value_type, data[i:next_i-1].decode('ascii')))
+        else: #B array
+            subtype = chr(data[i])
+            count = struct.unpack_from('<i', data, i+1)[0]
+            values = struct.unpack_from('<{0}{1}'.format(count, _AUX_FORMATS[subtype][1]), data, i+5)
+            fields.append('{0}:B:{1}'.format(tag, ','.join([subtype,]+['{0:g}'.format(x) for x in values])))
+        i = next_i
+    return fields
+
+
+class BamRecord(object):
+    """A minimally decoded BAM alignment record
+
+    Only the read name and flag are decoded when the record is read and
+    the numeric score tags (AS, XS, ZS and NM) on first use, so unmapped
+    reads need not have their tags parsed.  The record behaves as a sequence
+    of SAM fields so it can be used where a list of SAM fields is expected,
+    but the SAM fields are only built on first use of an index other than 0.
+
+    Attributes:
+        qname      - the read name
+        flag       - the integer SAM flag
+        tags       - a dictionary of float values for SCORE_TAGS present
+        data       - the raw BAM record (excluding the block_size field)
+        references - list of reference names for converting refIDs
+    """
+    __slots__ = ('qname', 'flag', 'data', 'references', '_aux', '_tags', '_fields', '_profile', '_scores')
+
+    def __init__(self, data, references):
+        l_read_name = data[8]
+        n_cigar_op, self.flag, l_seq = struct.unpack_from('<HHi', data, 12)
+        self.qname = data[32:31+l_read_name].decode('ascii')
+        self.data = data
+        self.references = references
+        self._aux = 32 + l_read_name + 4*n_cigar_op + (l_seq+1)//2 + l_seq
+        self._tags = None
+        self._fields = None
+        self._profile = None
+        self._scores = None
+        pass
+
+    @property
+    def tags(self):
+        if self._tags is None:
+            self._tags = _score_tags(self.data, self._aux)
+        return self._tags
+
+    @property
+    def cigar(self):
+        """The cigar string"""
+        l_read_name = self.data[8]
+        n_cigar_op = struct.unpack_from('<H', self.data, 12)[0]
+        cigar_ops = struct.unpack_from('<{0}I'.format(n_cigar_op), self.data, 32 + l_read_name)
+        return ''.join(['{0}{1}'.format(x >> 4, _CIGAR_OPS[x & 0xf]) for x in cigar_ops]) or '*'
+
+    def get_tags(self, tags):
+        """Return a dictionary of float values for the numeric tags in tags
+        that are present, extracted in a single pass over the aux fields"""
+        if SCORE_TAGS.issuperset(tags):
+            return self.tags
+        return _score_tags(self.data, self._aux, frozenset(tags))
+
+    def get_tag(self, tag='AS'):
+        """Return the value of a numeric tag as a float or -inf if the tag is not present"""
+        if tag in SCORE_TAGS:
+            return self.tags.get(tag, float('-inf'))
+        tag_list = [x for x in self.sam_fields()[11:] if x[:3] == tag + ':']
+        if not tag_list:
+            return float('-inf')
+        return float(tag_list[0].split(':')[-1])
+
+    def sam_fields(self):
+        """Return the record as a list of SAM fields"""
+        if self._fields is None:
+            self._fields = self._decode()
+        return self._fields
+
+    def _decode(self):
+        data = self.data
+        refID, pos, l_read_name, mapq, bin_, n_cigar_op, flag, l_seq, next_refID, next_pos, tlen = _CORE.unpack_from(data, 0)
+        i = 32 + l_read_name
+        cigar_ops = struct.unpack_from('<{0}I'.format(n_cigar_op), data, i)
+        i += 4 * n_cigar_op
+        cigar = ''.join(['{0}{1}'.format(x >> 4, _CIGAR_OPS[x & 0xf]) for x in cigar_ops]) or '*'
+        seq_bytes = data[i:i+(l_seq+1)//2]
+        seq = ''.join([_SEQ_PAIRS[x] for x in seq_bytes])[:l_seq] or '*'
+        i += (l_seq+1)//2
+        qual_bytes = data[i:i+l_seq]
+        if not l_seq or qual_bytes[0] == 0xff:
+            qual = '*'
+        else:
+            qual = qual_bytes.translate(_QUAL_TABLE).decode('ascii')
+        i += l_seq
+        rname = self.references[refID] if refID >= 0 else '*'
+        if next_refID < 0:
+            rnext = '*'
+        elif next_refID == refID:
+            rnext = '='
+        else:
+            rnext = self.references[next_refID]
+        return [self.qname, str(flag), rname, str(pos+1), str(mapq), cigar,
+                rnext, str(next_pos+1), str(tlen), seq, qual] + _format_aux(data, i)
+
+    def __getitem__(self, index):
+        if index == 0:
+            return self.qname
+        return self.sam_fields()[index]
+
+    def __iter__(self):
+        return iter(self.sam_fields())
+
+    def __len__(self):
+        return len(self.sam_fields())
+
+    def __bool__(self):
+        return True #avoid decoding the SAM fields to test truth
+
+    def __repr__(self):
+        return 'BamRecord({0!r}, flag={1})'.format(self.qname, self.flag)
+
+
+def iter_bam_records(bgzf, references):
+    """Yield BamRecord objects from a BgzfReader positioned after the BAM header"""
+    buffer = b''
+    offset = 0
+    while True:
+        if len(buffer) - offset < 4:
+            block = bgzf.read(65536)
+            if not block:
+                if len(buffer) - offset:
+                    raise ValueError('Truncated BAM record')
+                return
+            buffer = buffer[offset:] + block
+            offset = 0
+            continue
+        block_size = struct.unpack_from('<i', buffer, offset)[0]
+        if len(buffer) - offset < 4 + block_size:
+            block = bgzf.read(max(65536, block_size))
+            if not block:
+                raise ValueError('Truncated BAM record')
+            buffer = buffer[offset:] + block
+            offset = 0
+            continue
+        yield BamRecord(buffer[offset+4:offset+4+block_size], references)
+        offset += 4 + block_size
+
+
+class BamReader(object):
+    """Sequential reader for a BAM file that need not be seekable.
+
+    The header is read when the reader is created and iterating over the
+    reader yields BamRecord objects from the same decompressed stream, so
+    BAM files can be read from pipes, FIFOs and process substitutions.
+
+    Arguments:
+        fileobj    - a binary file or file like object in BAM format
+        executor   - an optional concurrent.futures executor used to
+                     decompress blocks ahead of the reader
+    Attributes:
+        header     - a list of SAM header lines (without newlines)
+        references - a list of reference sequence names in BAM refID order
+    """
+    def __init__(self, fileobj, executor=None):
+        self.fileobj = fileobj
+        self.bgzf = BgzfReader(fileobj, executor=executor)
+        self.header, self.references = read_bam_header(self.bgzf)
+        pass
+
+    def __iter__(self):
+        return iter_bam_records(self.bgzf, self.references)
+
+
+def bam_records(fileobj):
+    """Yield BamRecord objects from a binary file or file like object in BAM format"""
+    for record in BamReader(fileobj):
+        yield record
+
+
+def compress_block(data, compresslevel=6):
+    """Return data compressed as a single BGZF block.
+    data must be no longer than BGZF_BLOCK_SIZE bytes."""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6) + \
+             struct.pack('<2sHH', b'BC', 2, len(cdata) + BGZF_HEADER_SIZE + 6 + 8 - 1)
+    return header + cdata + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+class BgzfWriter(object):
+    """Writer for BGZF (blocked gzip) compressed files.
+
+    Blocks are compressed on the threads of an optional
+    concurrent.futures executor and written to the file in order.
+    zlib releases the GIL so compression runs in parallel with
+    the calling thread. An executor can be shared between writers.
+    Arguments:
+        fileobj       - a binary file or file like object for output
+        executor      - an optional concurrent.futures executor
+        compresslevel - zlib compression level. Default = 6
+        max_pending   - the maximum number of blocks awaiting compression
+                        before writing blocks the caller. Default = 16
+    """
+    def __init__(self, fileobj, executor=None, compresslevel=6, max_pending=16):
+        self.fileobj = fileobj
+        self.executor = executor
+        self.compresslevel = compresslevel
+        self.max_pending = max_pending
+        self._buffer = bytearray()
+        self._pending = deque()
+        pass
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= BGZF_BLOCK_SIZE:
+            self._compress(bytes(self._buffer[:BGZF_BLOCK_SIZE]))
+            del self._buffer[:BGZF_BLOCK_SIZE]
+        pass
+
+    def _compress(self, data):
+        if not self.executor:
+            self.fileobj.write(compress_block(data, self.compresslevel))
+            return
+        self._pending.append(self.executor.submit(compress_block, data, self.compresslevel))
+        while len(self._pending) > self.max_pending:
+            self.fileobj.write(self._pending.popleft().result())
+        pass
+
+    def flush(self):
+        """Compress any buffered data and write all pending blocks"""
+        if self._buffer:
+            self._compress(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self.fileobj.write(self._pending.popleft().result())
+        self.fileobj.flush()
+        pass
+
+    def close(self):
+        """Flush all data and write the BGZF end of file marker.
+        The underlying file object is flushed but not closed."""
+        self.flush()
+        self.fileobj.write(BGZF_EOF)
+        self.fileobj.flush()
+        pass
+
+
+def _reg2bin(beg, end):
+    """Return the BAM bin for a zero based half open interval"""
+    end -= 1
+    if beg >> 14 == end >> 14: return ((1 << 15) - 1) // 7 + (beg >> 14)
+    if beg >> 17 == end >> 17: return ((1 << 12) - 1) // 7 + (beg >> 17)
+    if beg >> 20 == end >> 20: return ((1 << 9) - 1) // 7 + (beg >> 20)
+    if beg >> 23 == end >> 23: return ((1 << 6) - 1) // 7 + (beg >> 23)
+    if beg >> 26 == end >> 26: return ((1 << 3) - 1) // 7 + (beg >> 26)
+    return 0
+
+
+def _encode_aux(field):
+    """Return the BAM encoding of a SAM optional field"""
+    tag, value_type, value = field.split(':', 2)
+    tag = tag.encode('ascii')
+    if value_type == 'i':
+        value = int(value)
+        if value < 0:
+            for code in 'csi':
+                try:
+                    return tag + code.encode('ascii') + struct.pack(_AUX_FORMATS[code], value)
+                except struct.error:
+                    pass
+        for code in 'CSI':
+            try:
+                return tag + code.encode('ascii') + struct.pack(_AUX_FORMATS[code], value)
+            except struct.error:
+                pass
+        raise ValueError('Integer tag value out of range {0}'.format(field))
+    elif value_type == 'A':
+        return tag + b'A' + value.encode('ascii')[:1]
+    elif value_type == 'f':
+        return tag + b'f' + struct.pack('<f', float(value))
+    elif value_type == 'Z' or value_type == 'H':
+        return tag + value_type.encode('ascii') + value.encode('ascii') + b'\x00'
+    elif value_type == 'B':
+        subtype, *values = value.split(',')
+        convert = float if subtype == 'f' else int
+        return tag + b'B' + subtype.encode('ascii') + struct.pack('<i', len(values)) + \
+               struct.pack('<{0}{1}'.format(len(values), _AUX_FORMATS[subtype][1]), *[convert(x) for x in values])
+    raise ValueError('Unknown SAM optional field type {0}'.format(field))
+
+
+def encode_sam_fields(sam_fields, reference_ids):
+    """Return the BAM encoding of a SAM line (excluding the block_size field)
+    Arguments:
+        sam_fields    - list of elements from a SAM file line
+        reference_ids - dictionary of reference names to BAM refIDs
+                        Names not in the dictionary are encoded as -1
+    Returns:
+        bytes of the encoded BAM record
+    """
+    qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual = sam_fields[:11]
+    refID = reference_ids.get(rname, -1)
+    pos = int(pos) - 1
+    if rnext == '=':
+        next_refID = refID
+    else:
+        next_refID = reference_ids.get(rnext, -1)
+    cigar_ops = [(int(length) << 4) | _CIGAR_CODES[op] for length, op in _CIGAR_RE.findall(cigar)] if cigar != '*' else []
+    reference_length = sum([x >> 4 for x in cigar_ops if x & 0xf in (0, 2, 3, 7, 8)])
+    end = pos + reference_length if reference_length else pos + 1
+    bin_ = _reg2bin(pos, end) if pos >= 0 else 4680
+    if seq == '*':
+        seq = ''
+    l_seq = len(seq)
+    if l_seq % 2:
+        seq_bytes = bytes([_SEQ_BYTES[seq[i:i+2]] for i in range(0, l_seq - 1, 2)] + [_SEQ_NIBBLES[seq[-1]] << 4])
+    else:
+        seq_bytes = bytes([_SEQ_BYTES[seq[i:i+2]] for i in range(0, l_seq, 2)])
+    if qual == '*':
+        qual_bytes = b'\xff' * l_seq
+    else:
+        qual_bytes = qual.encode('ascii').translate(_UNQUAL_TABLE)
+    read_name = qname.encode('ascii') + b'\x00'
+    return _CORE.pack(refID, pos, len(read_name), int(mapq), bin_, len(cigar_ops), int(flag),
+                      l_seq, next_refID, int(pnext) - 1, int(tlen)) + \
+           read_name + struct.pack('<{0}I'.format(len(cigar_ops)), *cigar_ops) + \
+           seq_bytes + qual_bytes + b''.join([_encode_aux(x) for x in sam_fields[11:]])
+
+
+class BamWriter(object):
+    """Writer for BAM format output files.
+
+    Reads may be lists of SAM fields or BamRecord objects. BamRecords
+    are copied without re-encoding, with reference ids translated by
+    name where the record comes from a file with a different header.
+    Arguments:
+        fileobj       - a binary file or file like object for output
+        executor      - an optional concurrent.futures executor used
+                        for BGZF compression
+        compresslevel - zlib compression level. Default = 6
+    """
+    def __init__(self, fileobj, executor=None, compresslevel=6):
+        self.bgzf = BgzfWriter(fileobj, executor=executor, compresslevel=compresslevel)
+        self.references = []
+        self.reference_ids = {}
+        self._reference_maps = {}
+        pass
+
+    def set_references(self, header):
+        """Set the reference sequences from a list of SAM header lines without
+        writing the header (eg when appending to an existing BAM file).
+        Returns a list of the reference sequence lengths."""
+        self.references = []
+        lengths = []
+        for line in header:
+            if line.startswith('@SQ'):
+                fields = dict(x.split(':', 1) for x in line.split('\t')[1:] if ':' in x)
+                self.references.append(fields['SN'])
+                lengths.append(int(fields['LN']))
+        self.reference_ids = {name:i for i,name in enumerate(self.references)}
+        return lengths
+
+    def write_header(self, header):
+        """Write a list of SAM header lines as the BAM header"""
+        lengths = self.set_references(header)
+        text = ('\n'.join(header) + '\n').encode('ascii')
+        data = [BAM_MAGIC, struct.pack('<i', len(text)), text, struct.pack('<i', len(self.references))]
+        for name, length in zip(self.references, lengths):
+            name = name.encode('ascii') + b'\x00'
+            data.append(struct.pack('<i', len(name)) + name + struct.pack('<i', length))
+        self.bgzf.write(b''.join(data))
+        pass
+
+    def _reference_map(self, references):
+        """Return a list translating refIDs for a list of reference names
+        to refIDs in this file, or None if no translation is required"""
+        key = id(references)
+        if key not in self._reference_maps:
+            if references == self.references:
+                self._reference_maps[key] = (references, None)
+            else:
+                self._reference_maps[key] = (references, [self.reference_ids.get(x, -1) for x in references])
+        return self._reference_maps[key][1]
+
+    def write_read(self, read):
+        """Write a read that is either a BamRecord or a list of SAM fields"""
+        if isinstance(read, BamRecord):
+            data = read.data
+            reference_map = self._reference_map(read.references)
+            if reference_map:
+                data = bytearray(data)
+                refID = struct.unpack_from('<i', data, 0)[0]
+                next_refID = struct.unpack_from('<i', data, 20)[0]
+                struct.pack_into('<i', data, 0, reference_map[refID] if refID >= 0 else -1)
+                struct.pack_into('<i', data, 20, reference_map[next_refID] if next_refID >= 0 else -1)
+        else:
+            data = encode_sam_fields(read, self.reference_ids)
+        self.bgzf.write(struct.pack('<i', len(data)) + data)
+        pass
+
+    def flush(self):
+        """Compress and write all buffered reads, ending the current BGZF block"""
+        self.bgzf.flush()
+        pass
+
+    def close(self):
+        self.bgzf.close()
+        pass
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+xenomapper.benchmark
+
+Scalable benchmarks of the xenomapper main loops and mappability functions.
+
+    generate - synthetic matched primary and secondary SAM files with a
+               known category for every read, and genome, mapped read and
+               wiggle files for the mappability functions
+    harness  - times the benchmarks, records reads per second and peak
+               memory and compares them to a stored baseline
+
+Run with:
+
+    xenomapper benchmark generate --help
+    xenomapper benchmark run --help
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+generate.py
+
+Synthetic xenograft data for benchmarking xenomapper.
+
+generate_sam_pair writes a matched pair of primary and secondary SAM files
+with the reads in the same order in both files, as produced by mapping the
+same reads to two species.  Each read (or read pair) is drawn from a mix of
+the xenomapper categories and given alignments in each species that
+xenomapper will classify as that category, so the category counts returned
+by the generator are the counts expected from main_single_end,
+main_paired_end and conservative_main_paired_end with the default min_score.
+Both reads of a pair have the same category.
+
+The optional tags follow one of the tag profiles of xenomapper.profiles:
+
+    bowtie2 - AS and XS tags
+    hisat   - AS and ZS tags
+    cigar   - NM tags and cigar strings with insertions, deletions and
+              softclipping, without AS tags
+
+generate_genome and generate_mappability_sam write a random genome and the
+name sorted SAM file of its simulated reads mapped back to the genome for
+the mappability functions.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import random
+from bisect import bisect
+from collections import Counter, OrderedDict
+from xenomapper.profiles import cigar_score, parse_cigar
+from xenomapper.mappability import format_fasta
+from xenomapper.writers import OUTPUT_CATEGORIES
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+#proportions of each category in the generated reads
+CATEGORY_MIX = OrderedDict([('primary_specific', 0.45),
+                            ('secondary_specific', 0.25),
+                            ('primary_multi', 0.05),
+                            ('secondary_multi', 0.05),
+                            ('unresolved', 0.05),
+                            ('unassigned', 0.15),
+                            ])
+
+TAG_PROFILES = ('bowtie2', 'hisat', 'cigar')
+
+PRIMARY_CHROMOSOMES = (('1', 249250621), ('2', 243199373), ('X', 155270560))
+SECONDARY_CHROMOSOMES = (('1', 195471971), ('2', 182113224), ('X', 171031299))
+
+#4-mers indexed by a random byte, for fast generation of random sequence
+_KMERS = [a + b + c + d for a in 'ACGT' for b in 'ACGT' for c in 'ACGT' for d in 'ACGT']
+_QUALITIES = '?@ABCDEFGHI'
+
+
+def parse_mix(values):
+    """Return a category mix from a list of strings in the form
+    category=proportion. Categories that are not listed have a proportion of 0."""
+    mix = OrderedDict((category, 0.0) for category in OUTPUT_CATEGORIES)
+    for value in values:
+        category, separator, proportion = value.partition('=')
+        if category not in mix or not separator:
+            raise ValueError('Category mix must be given as category=proportion where category is one of '
+                             '{0}: {1}'.format(', '.join(OUTPUT_CATEGORIES), value))
+        mix[category] = float(proportion)
+    return mix
+
+
+def normalised_mix(mix):
+    """Return a category mix with proportions summing to 1"""
+    for category, proportion in mix.items():
+        if category not in OUTPUT_CATEGORIES or proportion < 0:
+            raise ValueError('Invalid category proportion {0}={1}'.format(category, proportion))
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError('The category mix must have at least one category with a proportion above 0')
+    return OrderedDict((category, proportion / total) for category, proportion in mix.items())
+
+
+def random_sequence(rng, length):
+    """Return a random DNA sequence of length bases"""
+    size = length // 4 + 1
+    data = rng.getrandbits(8 * size).to_bytes(size, 'little')
+    return ''.join([_KMERS[x] for x in data])[:length]
+
+
+def read_cigars(read_length):
+    """Return the cigar strings used for alignments of reads of read_length.
+    Most alignments are full length matches."""
+    half = read_length // 2
+    return ('{0}M'.format(read_length),
+            '{0}M'.format(read_length),
+            '{0}M'.format(read_length),
+            '{0}M'.format(read_length),
+            '3S{0}M'.format(read_length - 3),
+            '{0}M1I{1}M'.format(half, read_length - half - 1),
+            '{0}M2D{1}M'.format(half, read_length - half),
+            )
+
+
+def read_alignments(category, rng, cigars):
+    """Return a primary and secondary alignment for a read of a category.
+    Alignments are tuples of (mismatches, cigar, multi) or None for
+    unmapped reads. A worse alignment has more mismatches than the best
+    alignment with the same cigar and so always has a lower score.
+    Multimapping alignments have at least one mismatch, as a next best
+    score of 0 is treated as absent by get_mapping_state."""
+    if category == 'unassigned':
+        return None, None
+    multi = category.endswith('multi')
+    best = (rng.randint(1 if multi else 0, 3), cigars[rng.randrange(len(cigars))], multi)
+    if category == 'unresolved':
+        return best, best
+    if rng.random() < 0.25:
+        worse = None
+    else:
+        worse = (best[0] + rng.randint(1, 4), best[1], rng.random() < 0.1)
+    if category.startswith('primary'):
+        return best, worse
+    return worse, best
+
+
+def alignment_tags(alignment, profile, rng, paired=False):
+    """Return the optional fields of an alignment as written by the
+    aligner of a tag profile. The next best score equals the score of
+    multimapping alignments, and is lower or absent for unique alignments."""
+    if alignment is None:
+        if profile == 'cigar':
+            return []
+        return ['YT:Z:UP' if paired else 'YT:Z:UU']
+    mismatches, cigar, multi = alignment
+    score = cigar_score(cigar, mismatches)
+    if multi:
+        other = score
+    elif rng.random() < 0.5:
+        other = score - 6 * rng.randint(1, 5)
+    else:
+        other = None
+    gaps, gap_length, softclipped = parse_cigar(cigar)
+    if profile == 'cigar':
+        tags = ['XT:A:R' if multi else 'XT:A:U',
+                'NM:i:{0}'.format(mismatches),
+                'X0:i:{0}'.format(2 if multi else 1),
+                'XM:i:{0}'.format(mismatches),
+                'XO:i:{0}'.format(gaps),
+                'XG:i:{0}'.format(gap_length),
+                ]
+        if other is not None:
+            tags.append('XS:i:{0}'.format(other))
+        return tags
+    tags = ['AS:i:{0}'.format(score)]
+    if other is not None:
+        tags.append('{0}:i:{1}'.format('ZS' if profile == 'hisat' else 'XS', other))
+    tags.extend(['XN:i:0',
+                 'XM:i:{0}'.format(mismatches),
+                 'XO:i:{0}'.format(gaps),
+                 'XG:i:{0}'.format(gap_length),
+                 'NM:i:{0}'.format(mismatches),
+                 'YT:Z:CP' if paired else 'YT:Z:UU',
+                 ])
+    if profile == 'hisat':
+        tags.append('NH:i:{0}'.format(2 if multi else 1))
+    return tags
+
+
+def alignment_lines(name, alignment, chromosomes, seq, qual, profile, rng, paired=False):
+    """Return a list of the SAM lines (without newlines) of a read or read pair"""
+    tags = alignment_tags(alignment, profile, rng, paired=paired)
+    if alignment is None:
+        if not paired:
+            return ['\t'.join([name, '4', '*', '0', '0', '*', '*', '0', '0', seq, qual] + tags)]
+        return ['\t'.join([name, '77', '*', '0', '0', '*', '*', '0', '0', seq, qual] + tags),
+                '\t'.join([name, '141', '*', '0', '0', '*', '*', '0', '0', seq, qual] + tags)]
+    mismatches, cigar, multi = alignment
+    chrom, length = chromosomes[rng.randrange(len(chromosomes))]
+    pos = rng.randint(1, length - 1000)
+    mapq = '1' if multi else '42'
+    if not paired:
+        return ['\t'.join([name, '16' if rng.random() < 0.5 else '0', chrom, str(pos), mapq, cigar,
+                           '*', '0', '0', seq, qual] + tags)]
+    insert = rng.randint(2 * len(seq), 2 * len(seq) + 300)
+    mate_pos = pos + insert - len(seq)
+    return ['\t'.join([name, '99', chrom, str(pos), mapq, cigar, '=', str(mate_pos), str(insert),
+                       seq, qual] + tags),
+            '\t'.join([name, '147', chrom, str(mate_pos), mapq, cigar, '=', str(pos), str(-insert),
+                       seq, qual] + tags)]
+
+
+def sam_header(chromosomes, profile):
+    """Return the header lines of a generated SAM file"""
+    header = ['@HD\tVN:1.0\tSO:unsorted']
+    header.extend(['@SQ\tSN:{0}\tLN:{1}'.format(name, length) for name, length in chromosomes])
+    header.append('@PG\tID:{0}\tPN:{0}\tVN:benchmark\tCL:"xenomapper benchmark generate"'.format(profile))
+    return header
+
+
+def generate_sam_pair(primary, secondary, reads=1000000, read_length=100, paired=False, profile='bowtie2',
+                      mix=CATEGORY_MIX, seed=0, batch_size=10000):
+    """Write a matched pair of primary and secondary SAM files
+    Arguments:
+        primary, secondary - binary files for the SAM output
+        reads       - the number of reads. Paired files have reads // 2
+                      read pairs. Default 1000000
+        read_length - the length of each read. Default 100
+        paired      - if True write paired end reads. Default False
+        profile     - the tag profile of the aligner, one of bowtie2,
+                      hisat or cigar. Default bowtie2
+        mix         - a dictionary of the proportion of reads in each
+                      category. Default CATEGORY_MIX
+        seed        - the seed of the random number generator. Default 0
+        batch_size  - the number of reads written at a time
+    Returns:
+        category_counts - a Counter of the generated categories keyed by
+                    category, or by a tuple of the forward and reverse
+                    read categories if paired (as from the main loops)
+    """
+    if profile not in TAG_PROFILES:
+        raise ValueError('Unknown tag profile {0}. Profile must be one of {1}'.format(profile,
+                         ', '.join(TAG_PROFILES)))
+    if read_length < 10:
+        raise ValueError('Read length must be at least 10')
+    mix = normalised_mix(mix)
+    categories = list(mix)
+    cum_weights = []
+    for proportion in mix.values():
+        cum_weights.append(proportion + (cum_weights[-1] if cum_weights else 0.0))
+    last_category = len(categories) - 1
+    rng = random.Random(seed)
+    sequences = [random_sequence(rng, read_length) for x in range(1024)]
+    qualities = [''.join([rng.choice(_QUALITIES) for x in range(read_length)]) for y in range(64)]
+    cigars = read_cigars(read_length)
+
+    primary.write(('\n'.join(sam_header(PRIMARY_CHROMOSOMES, profile)) + '\n').encode('ascii'))
+    secondary.write(('\n'.join(sam_header(SECONDARY_CHROMOSOMES, profile)) + '\n').encode('ascii'))
+
+    category_counts = Counter()
+    templates = reads // 2 if paired else reads
+    for start in range(0, templates, batch_size):
+        lines1 = []
+        lines2 = []
+        for index in range(start, min(start + batch_size, templates)):
+            category = categories[min(bisect(cum_weights, rng.random()), last_category)]
+            name = 'read{0}'.format(index + 1)
+            seq = sequences[rng.randrange(1024)]
+            qual = qualities[rng.randrange(64)]
+            alignment1, alignment2 = read_alignments(category, rng, cigars)
+            lines1.extend(alignment_lines(name, alignment1, PRIMARY_CHROMOSOMES, seq, qual, profile, rng, paired))
+            lines2.extend(alignment_lines(name, alignment2, SECONDARY_CHROMOSOMES, seq, qual, profile, rng, paired))
+            category_counts[(category, category) if paired else category] += 1
+        primary.write(('\n'.join(lines1) + '\n').encode('ascii'))
+        secondary.write(('\n'.join(lines2) + '\n').encode('ascii'))
+    return category_counts
+
+
+def genome_chromosomes(genome_size):
+    """Return an OrderedDict of the sizes of the two chromosomes of a
+    generated genome of genome_size bases"""
+    return OrderedDict([('chr1', genome_size - genome_size // 2), ('chr2', genome_size // 2)])
+
+
+def generate_genome(fastafile, chromosome_sizes, seed=0):
+    """Write a random genome in fasta format
+    Arguments:
+        fastafile        - a text file for output
+        chromosome_sizes - a dictionary of chromosome sizes keyed by name
+        seed             - the seed of the random number generator. Default 0
+    """
+    rng = random.Random(seed)
+    for name, size in chromosome_sizes.items():
+        fastafile.write(format_fasta(name, random_sequence(rng, size)))
+    pass
+
+
+def generate_mappability_sam(samfile, chromosome_sizes, read_length=100, unique=0.9, seed=0):
+    """Write a name sorted SAM file of the reads simulated from a genome
+    (see mappability.simulate_reads) mapped back to the genome.
+    Arguments:
+        samfile          - a text file for output
+        chromosome_sizes - a dictionary of chromosome sizes keyed by name
+        read_length      - the length of the simulated reads. Default 100
+        unique           - the proportion of reads mapping uniquely to their
+                           true position (MAPQ 42). Other reads map to
+                           another position with MAPQ 1. Default 0.9
+        seed             - the seed of the random number generator. Default 0
+    Returns:
+        reads            - the number of reads written
+    """
+    rng = random.Random(seed)
+    sequences = [random_sequence(rng, read_length) for x in range(256)]
+    qual = 'I' * read_length
+    cigar = '{0}M'.format(read_length)
+    print('@HD\tVN:1.0\tSO:queryname', file=samfile)
+    for name, size in chromosome_sizes.items():
+        print('@SQ\tSN:{0}\tLN:{1}'.format(name, size), file=samfile)
+    reads = 0
+    for name, size in chromosome_sizes.items():
+        positions = size - read_length + 1
+        lines = []
+        for pos in range(1, positions + 1):
+            if rng.random() < unique:
+                mapped_pos, mapq = pos, '42'
+            else:
+                mapped_pos, mapq = rng.randint(1, positions), '1'
+            lines.append('{0}_{1}\t0\t{0}\t{2}\t{3}\t{4}\t*\t0\t0\t{5}\t{6}\tAS:i:0'.format(name, pos, mapped_pos,
+                         mapq, cigar, sequences[rng.randrange(256)], qual))
+        if lines:
+            samfile.write('\n'.join(lines) + '\n')
+        reads += max(positions, 0)
+    return reads
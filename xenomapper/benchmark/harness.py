@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+harness.py
+
+Benchmark harness for the xenomapper main loops and mappability functions.
+
+Each benchmark is run on data from xenomapper.benchmark.generate and timed
+with time.perf_counter (the best of --repeat runs), then run once more
+under tracemalloc to record the peak memory allocated by Python.  The
+category counts of the main loops are checked against the generated
+categories.  Results are reported as reads per second and peak memory and
+compared to a baseline report: by default the baseline stored with this
+package, or a report saved by an earlier run with --report.
+
+    xenomapper benchmark generate - write a matched pair of SAM files
+    xenomapper benchmark run      - run the benchmarks
+
+Generated data is kept in --data_dir (default a temporary directory) and
+reused by later runs with the same settings.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+import os
+import json
+import time
+import platform
+import tempfile
+import argparse, textwrap
+import tracemalloc
+from collections import OrderedDict
+from xenomapper.benchmark.generate import CATEGORY_MIX, TAG_PROFILES, parse_mix, normalised_mix, \
+                                          generate_sam_pair, genome_chromosomes, generate_genome, \
+                                          generate_mappability_sam
+from xenomapper.xenomapper import get_sam_header, getRawReadPairs, main_single_end, main_paired_end, \
+                                  conservative_main_paired_end, get_cigarbased_AS_tag, output_summary
+from xenomapper.mappability import simulate_reads, single_end_mappability_from_sam, \
+                                   mate_distribution_from_sam, paired_end_mappability
+from xenomapper.profiles import PROFILES
+from xenomapper.writers import OUTPUT_CATEGORIES, SamWriter
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+REPORT_FORMAT = 1
+
+BENCHMARKS = ('main_single_end',
+              'main_paired_end',
+              'conservative_main_paired_end',
+              'get_cigarbased_AS_tag',
+              'simulate_reads',
+              'single_end_mappability_from_sam',
+              'mate_distribution_from_sam',
+              'paired_end_mappability',
+              )
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def data_settings(reads=1000000, read_length=100, profile='bowtie2', mix=CATEGORY_MIX, seed=0,
+                  genome_size=200000):
+    """Return a dictionary of the settings of generated benchmark data"""
+    return OrderedDict([('reads', reads),
+                        ('read_length', read_length),
+                        ('profile', profile),
+                        ('mix', OrderedDict((k, round(v, 6)) for k, v in normalised_mix(mix).items())),
+                        ('seed', seed),
+                        ('genome_size', genome_size),
+                        ])
+
+
+def prepare_data(directory, settings):
+    """Generate the data for the benchmarks in a directory, unless data
+    with the same settings has already been generated there.
+    Arguments:
+        directory - the directory for the data files
+        settings  - a dictionary from data_settings
+    Returns:
+        data      - a dictionary of the file names and the expected
+                    category counts of the data
+    """
+    def path(name):
+        return os.path.join(directory, name)
+    data = {'single_primary':path('single_primary.sam'),
+            'single_secondary':path('single_secondary.sam'),
+            'paired_primary':path('paired_primary.sam'),
+            'paired_secondary':path('paired_secondary.sam'),
+            'cigar_primary':path('cigar_primary.sam'),
+            'genome':path('genome.fa'),
+            'mappability_sam':path('mappability.sam'),
+            'single_end_wiggle':path('single_end.wig'),
+            }
+    manifest = path('benchmark_data.json')
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            previous = json.load(f, object_pairs_hook=OrderedDict)
+        if previous['settings'] == json.loads(json.dumps(settings)):
+            data.update(previous['counts'])
+            return data
+    kw = {'reads':settings['reads'], 'read_length':settings['read_length'], 'profile':settings['profile'],
+          'mix':settings['mix'], 'seed':settings['seed']}
+    counts = {}
+    with open(data['single_primary'], 'wb') as sam1, open(data['single_secondary'], 'wb') as sam2:
+        counts['single_counts'] = sorted(generate_sam_pair(sam1, sam2, paired=False, **kw).items())
+    with open(data['paired_primary'], 'wb') as sam1, open(data['paired_secondary'], 'wb') as sam2:
+        counts['paired_counts'] = sorted(generate_sam_pair(sam1, sam2, paired=True, **kw).items())
+    kw['profile'] = 'cigar'
+    with open(data['cigar_primary'], 'wb') as sam1, open(os.devnull, 'wb') as sam2:
+        generate_sam_pair(sam1, sam2, paired=False, **kw)
+    chromosome_sizes = genome_chromosomes(settings['genome_size'])
+    with open(data['genome'], 'w') as f:
+        generate_genome(f, chromosome_sizes, seed=settings['seed'])
+    with open(data['mappability_sam'], 'w') as f:
+        generate_mappability_sam(f, chromosome_sizes, read_length=settings['read_length'], seed=settings['seed'])
+    with open(data['mappability_sam']) as samfile, open(data['single_end_wiggle'], 'w') as wiggle:
+        single_end_mappability_from_sam(samfile, outfile=wiggle)
+    with open(manifest, 'w') as f:
+        json.dump({'settings':settings, 'counts':counts}, f, indent=1)
+    data.update(counts)
+    return data
+
+
+def expected_counts(data, paired):
+    """Return the generated category counts of the single or paired end data"""
+    counts = data['paired_counts' if paired else 'single_counts']
+    return {tuple(key) if isinstance(key, list) else key:count for key, count in counts}
+
+
+def main_loop_benchmark(main_function, data, profile, paired):
+    """Return a function classifying the single or paired end data with
+    a main loop function, writing all categories to os.devnull"""
+    primary = data['paired_primary' if paired else 'single_primary']
+    secondary = data['paired_secondary' if paired else 'single_secondary']
+    expected = expected_counts(data, paired)
+    def run():
+        with open(primary, 'rb') as sam1, open(secondary, 'rb') as sam2, open(os.devnull, 'wb') as null:
+            writer = SamWriter(null)
+            get_sam_header(sam1)
+            get_sam_header(sam2)
+            counts = main_function(getRawReadPairs(sam1, sam2, skip_repeated_reads=not paired),
+                                   tag_func=PROFILES[profile], **{category:writer for category in OUTPUT_CATEGORIES})
+        if counts != expected:
+            raise RuntimeError('{0} classified the generated reads as {1} but they were generated as {2}'.format(
+                               main_function.__name__, dict(counts), expected))
+        return sum(counts.values()) * (2 if paired else 1)
+    return run
+
+
+def cigar_tag_benchmark(data):
+    """Return a function calculating get_cigarbased_AS_tag for each read of
+    the cigar profile data. The reads are split into fields before timing."""
+    with open(data['cigar_primary']) as samfile:
+        get_sam_header(samfile)
+        lines = [line.strip('\n').split('\t') for line in samfile]
+    def run():
+        for line in lines:
+            get_cigarbased_AS_tag(line)
+        return len(lines)
+    return run
+
+
+def mappability_benchmark(name, data, settings):
+    """Return a function running a mappability function on the genome,
+    mapped simulated reads or paired end data"""
+    chromosome_sizes = genome_chromosomes(settings['genome_size'])
+    positions = sum([max(size - settings['read_length'] + 1, 0) for size in chromosome_sizes.values()])
+    def run():
+        with open(os.devnull, 'w') as null:
+            if name == 'simulate_reads':
+                simulate_reads(open(data['genome']), readlength=settings['read_length'], outfile=null)
+                return positions
+            elif name == 'single_end_mappability_from_sam':
+                with open(data['mappability_sam']) as samfile:
+                    single_end_mappability_from_sam(samfile, outfile=null)
+                return positions
+            elif name == 'mate_distribution_from_sam':
+                with open(data['paired_primary']) as samfile:
+                    mate_distribution_from_sam(samfile, sample_size=0)
+                return settings['reads'] // 2 * 2
+            elif name == 'paired_end_mappability':
+                with open(data['paired_primary']) as samfile:
+                    mate_density = mate_distribution_from_sam(samfile)
+                with open(data['single_end_wiggle']) as wiggle:
+                    paired_end_mappability(wiggle, mate_density, outfile=null,
+                                           chromosome_sizes=OrderedDict(chromosome_sizes))
+                return positions
+        raise ValueError('Unknown benchmark {0}'.format(name)) #pragma: no cover
+    return run
+
+
+def get_benchmark(name, data, settings):
+    """Return a function that runs a benchmark and returns the number of reads processed"""
+    if name == 'main_single_end':
+        return main_loop_benchmark(main_single_end, data, settings['profile'], paired=False)
+    elif name == 'main_paired_end':
+        return main_loop_benchmark(main_paired_end, data, settings['profile'], paired=True)
+    elif name == 'conservative_main_paired_end':
+        return main_loop_benchmark(conservative_main_paired_end, data, settings['profile'], paired=True)
+    elif name == 'get_cigarbased_AS_tag':
+        return cigar_tag_benchmark(data)
+    elif name in BENCHMARKS:
+        return mappability_benchmark(name, data, settings)
+    raise ValueError('Unknown benchmark {0}. Benchmarks are {1}'.format(name, ', '.join(BENCHMARKS)))
+
+
+def time_benchmark(name, run, repeat=1, memory=True):
+    """Time a benchmark function and measure its peak memory
+    Arguments:
+        name   - the name of the benchmark
+        run    - a function returning the number of reads processed
+        repeat - the number of timed runs. The fastest run is reported.
+        memory - if True run once more under tracemalloc to measure the
+                 peak memory allocated by Python
+    Returns:
+        result - a dictionary of the name, reads, seconds, reads_per_second
+                 and peak_memory (None if not measured)
+    """
+    times = []
+    for x in range(max(repeat, 1)):
+        start = time.perf_counter()
+        reads = run()
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    seconds = min(times)
+    return OrderedDict([('name', name),
+                        ('reads', reads),
+                        ('seconds', round(seconds, 4)),
+                        ('reads_per_second', round(reads / seconds, 1) if seconds else 0.0),
+                        ('peak_memory', peak),
+                        ])
+
+
+def run_benchmarks(data_dir, settings, benchmarks=BENCHMARKS, repeat=1, memory=True, outfile=sys.stderr):
+    """Run benchmarks on generated data
+    Arguments:
+        data_dir   - the directory for the generated data
+        settings   - a dictionary from data_settings
+        benchmarks - the names of the benchmarks to run. Default all
+        repeat     - the number of timed runs of each benchmark
+        memory     - if True measure the peak memory of each benchmark
+        outfile    - a text file for progress messages or None
+    Returns:
+        report     - a dictionary of the settings, environment and results
+    """
+    if outfile:
+        print('Preparing benchmark data in {0}'.format(data_dir), file=outfile)
+    data = prepare_data(data_dir, settings)
+    results = []
+    for name in benchmarks:
+        run = get_benchmark(name, data, settings)
+        if outfile:
+            print('Running {0}'.format(name), file=outfile)
+        results.append(time_benchmark(name, run, repeat=repeat, memory=memory))
+    return OrderedDict([('format', REPORT_FORMAT),
+                        ('version', __version__),
+                        ('python', platform.python_version()),
+                        ('platform', platform.platform()),
+                        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                        ('settings', settings),
+                        ('results', results),
+                        ])
+
+
+def compare_to_baseline(report, baseline, tolerance=0.1):
+    """Compare the results of a benchmark report to a baseline report
+    Arguments:
+        report, baseline - benchmark reports as dictionaries
+        tolerance - the relative change in reads per second or peak memory
+                    accepted before a result is marked as a regression.
+                    Default 0.1
+    Returns:
+        a list of tuples of benchmark name, baseline reads per second,
+        reads per second, baseline peak memory, peak memory and status
+        ('faster', 'slower', 'more memory', 'ok', or 'new' if the benchmark
+        is not in the baseline)
+    """
+    baseline_results = {x['name']:x for x in baseline['results']}
+    rows = []
+    for result in report['results']:
+        old = baseline_results.get(result['name'])
+        if old is None:
+            rows.append((result['name'], None, result['reads_per_second'], None, result['peak_memory'], 'new'))
+            continue
+        if result['reads_per_second'] < old['reads_per_second'] * (1 - tolerance):
+            status = 'slower'
+        elif result['peak_memory'] and old['peak_memory'] and \
+             result['peak_memory'] > old['peak_memory'] * (1 + tolerance):
+            status = 'more memory'
+        elif result['reads_per_second'] > old['reads_per_second'] * (1 + tolerance):
+            status = 'faster'
+        else:
+            status = 'ok'
+        rows.append((result['name'], old['reads_per_second'], result['reads_per_second'],
+                     old['peak_memory'], result['peak_memory'], status))
+    return rows
+
+
+def output_benchmarks(report, baseline=None, tolerance=0.1, outfile=sys.stdout):
+    """Print a table of the results of a benchmark report and their
+    change from a baseline report.  Results are only given a status if
+    the baseline was run with the same settings, otherwise the baseline
+    numbers are printed without a status."""
+    settings = report['settings']
+    print('-'*80, file=outfile)
+    print('Benchmarks of xenomapper {0} ({1} reads of {2} bases, {3} tags, Python {4})\n'.format(report['version'],
+          settings['reads'], settings['read_length'], settings['profile'], report['python']), file=outfile)
+    rows = compare_to_baseline(report, baseline, tolerance) if baseline else \
+           [(x['name'], None, x['reads_per_second'], None, x['peak_memory'], '') for x in report['results']]
+    if baseline and baseline['settings'] != report['settings']:
+        print('Baseline from xenomapper {0} was run with different settings and is not compared: {1}\n'.format(
+              baseline['version'], json.dumps(baseline['settings'])), file=outfile)
+        rows = [x[:-1] + ('',) for x in rows]
+    def memory(value):
+        return '-' if value is None else '{0:.2f}'.format(value / 2**20)
+    def rate(value):
+        return '-' if value is None else '{0:.0f}'.format(value)
+    print('|  {0:35s}|  {1:>12s}  |  {2:>12s}  |  {3:>9s}  |  {4:>9s}  |  {5:11s}|'.format('Benchmark',
+          'Base reads/s', 'Reads/s', 'Base MB', 'Peak MB', 'Status'), file=outfile)
+    print('|:','-'*35,':|:','-'*14,':|:','-'*14,':|:','-'*11,':|:','-'*11,':|:','-'*11,':|',sep='', file=outfile)
+    for name, old_rate, new_rate, old_peak, new_peak, status in rows:
+        print('|  {0:35s}|  {1:>12s}  |  {2:>12s}  |  {3:>9s}  |  {4:>9s}  |  {5:11s}|'.format(name, rate(old_rate),
+              rate(new_rate), memory(old_peak), memory(new_peak), status), file=outfile)
+    print(file=outfile)
+    return rows
+
+
+def add_data_arguments(parser): #pragma: no cover
+    """Add the arguments describing generated data to an argparse parser"""
+    parser.add_argument('--reads',
+                        type=int,
+                        default=1000000,
+                        help='the number of reads (paired end data has half as many read pairs). Default = 1000000')
+    parser.add_argument('--read_length',
+                        type=int,
+                        default=100,
+                        help='the length of each read. Default = 100')
+    parser.add_argument('--profile',
+                        choices=TAG_PROFILES,
+                        default='bowtie2',
+                        help='the tags of the aligner: bowtie2 (AS and XS), hisat (AS and ZS) or cigar (NM and \
+                              cigar based scores). Default = bowtie2')
+    parser.add_argument('--mix',
+                        nargs='+',
+                        default=None,
+                        help='the proportion of reads in each category as category=proportion \
+                              eg --mix primary_specific=0.8 secondary_specific=0.2. \
+                              Default = {0}'.format(' '.join('{0}={1}'.format(*x) for x in CATEGORY_MIX.items())))
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='the seed of the random number generator. Default = 0')
+    pass
+
+
+def command_line_interface(argv=None): #pragma: no cover
+    parser = argparse.ArgumentParser(prog = "xenomapper benchmark",
+                    formatter_class=argparse.RawDescriptionHelpFormatter,
+                    description=textwrap.dedent("""\
+                    Generate synthetic xenograft data and benchmark the xenomapper main loops
+                    and mappability functions, reporting reads per second and peak memory
+                    compared to a baseline.
+                    """),
+                    )
+    subparsers = parser.add_subparsers(dest='command')
+    generate_parser = subparsers.add_parser('generate',
+                                            help='write a matched pair of primary and secondary SAM files')
+    generate_parser.add_argument('--primary_sam',
+                                 type=argparse.FileType('wb'),
+                                 required=True,
+                                 help='a file name for the SAM output of the primary species')
+    generate_parser.add_argument('--secondary_sam',
+                                 type=argparse.FileType('wb'),
+                                 required=True,
+                                 help='a file name for the SAM output of the secondary species')
+    generate_parser.add_argument('--paired',
+                                 action='store_true',
+                                 help='write paired end reads')
+    add_data_arguments(generate_parser)
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    add_data_arguments(run_parser)
+    run_parser.add_argument('--genome_size',
+                            type=int,
+                            default=200000,
+                            help='the size of the genome for the mappability benchmarks. Default = 200000')
+    run_parser.add_argument('--benchmarks',
+                            nargs='+',
+                            choices=BENCHMARKS,
+                            default=BENCHMARKS,
+                            help='the benchmarks to run. Default = all')
+    run_parser.add_argument('--data_dir',
+                            type=str,
+                            default=None,
+                            help='a directory for the generated data, which is reused by later runs with the \
+                                  same settings. Default = a temporary directory')
+    run_parser.add_argument('--repeat',
+                            type=int,
+                            default=1,
+                            help='the number of timed runs of each benchmark. The fastest is reported. Default = 1')
+    run_parser.add_argument('--no_memory',
+                            action='store_true',
+                            help='do not measure peak memory (which runs each benchmark again under tracemalloc)')
+    run_parser.add_argument('--report',
+                            type=str,
+                            default=None,
+                            help='a file name for a JSON report of the results, which can be used as a baseline')
+    run_parser.add_argument('--baseline',
+                            type=str,
+                            default=DEFAULT_BASELINE,
+                            help='a JSON report to compare the results to. Default = the baseline stored with \
+                                  xenomapper')
+    run_parser.add_argument('--tolerance',
+                            type=float,
+                            default=0.1,
+                            help='the relative change from the baseline accepted before a result is a \
+                                  regression. Default = 0.1')
+    run_parser.add_argument('--fail_on_regression',
+                            action='store_true',
+                            help='exit with status 1 if any benchmark is slower or uses more memory than the baseline. \
+                                  Never fails if the baseline was run with different settings')
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        sys.exit(1)
+    try:
+        args.mix = parse_mix(args.mix) if args.mix else CATEGORY_MIX
+        normalised_mix(args.mix)
+    except ValueError as error:
+        parser.error(str(error))
+    return args
+
+
+def run_generate(args): #pragma: no cover
+    counts = generate_sam_pair(args.primary_sam, args.secondary_sam, reads=args.reads, read_length=args.read_length,
+                               paired=args.paired, profile=args.profile, mix=args.mix, seed=args.seed)
+    args.primary_sam.close()
+    args.secondary_sam.close()
+    output_summary(counts)
+    return counts
+
+
+def run_harness(args): #pragma: no cover
+    settings = data_settings(reads=args.reads, read_length=args.read_length, profile=args.profile, mix=args.mix,
+                             seed=args.seed, genome_size=args.genome_size)
+    if args.data_dir:
+        os.makedirs(args.data_dir, exist_ok=True)
+        report = run_benchmarks(args.data_dir, settings, benchmarks=args.benchmarks, repeat=args.repeat,
+                                memory=not args.no_memory)
+    else:
+        with tempfile.TemporaryDirectory() as data_dir:
+            report = run_benchmarks(data_dir, settings, benchmarks=args.benchmarks, repeat=args.repeat,
+                                    memory=not args.no_memory)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=1)
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f, object_pairs_hook=OrderedDict)
+    rows = output_benchmarks(report, baseline=baseline, tolerance=args.tolerance)
+    if args.fail_on_regression and [x for x in rows if x[-1] in ('slower', 'more memory')]:
+        sys.exit(1)
+    return report
+
+
+def main(argv=None): #pragma: no cover
+    args = command_line_interface(argv)
+    if args.command == 'generate':
+        run_generate(args)
+    else:
+        run_harness(args)
+    pass
+
+
+if __name__ == '__main__': #pragma: no cover
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+checkpoint.py
+
+Checkpoint and resume of long classification runs.
+
+Read pairs are classified in batches of complete reads (or read pairs).
+After each batch the output files are flushed to disk and a checkpoint
+recording the offsets of the next read in each input file, the size of
+each output file and the category counts so far is written atomically.
+A run that is interrupted can be resumed from the last checkpoint by
+truncating the outputs to the recorded sizes and seeking the inputs to
+the recorded offsets, giving the same outputs and counts as a single run.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import os
+import json
+from collections import Counter
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+
+class Checkpoint(object):
+    """The state of a classification run after a batch of reads
+    Arguments:
+        settings        - a dictionary of the options of the run, which must
+                          be the same when resuming
+        input_offsets   - the byte offsets of the next read in each input file
+        output_sizes    - a dictionary of the size in bytes of each output file
+                          keyed by category
+        category_counts - the category counts of the reads classified so far
+    """
+    def __init__(self, settings, input_offsets=None, output_sizes=None, category_counts=None):
+        self.settings = settings
+        self.input_offsets = input_offsets
+        self.output_sizes = output_sizes or {}
+        self.category_counts = Counter(category_counts or {})
+        pass
+
+    def save(self, filename):
+        """Write the checkpoint to a JSON file, replacing any previous
+        checkpoint only once the new checkpoint is on disk"""
+        state = {'version':__version__,
+                 'settings':self.settings,
+                 'input_offsets':self.input_offsets,
+                 'output_sizes':self.output_sizes,
+                 #paired end counts are keyed by tuples which are not valid JSON keys
+                 'category_counts':[[key, count] for key, count in self.category_counts.items()],
+                 }
+        temporary = filename + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, filename)
+        pass
+
+    @classmethod
+    def load(cls, filename):
+        """Return a Checkpoint read from a JSON file"""
+        with open(filename) as f:
+            state = json.load(f)
+        counts = {tuple(key) if isinstance(key, list) else key:count for key, count in state['category_counts']}
+        return cls(state['settings'], state['input_offsets'], state['output_sizes'], counts)
+
+    def check_settings(self, settings):
+        """Raise ValueError if the options of a run differ from the checkpoint"""
+        if settings != self.settings:
+            differences = sorted(key for key in set(settings) | set(self.settings)
+                                 if settings.get(key) != self.settings.get(key))
+            raise ValueError('Cannot resume from a checkpoint made with different options: {0}'.format(
+                                                                                ', '.join(differences)))
+        pass
+
+
+def line_offset(samfile, line):
+    """Return the offset of the start of a SamLine that has just been read from samfile"""
+    end = samfile.tell()
+    start = end - len(line.raw)
+    if start > 0:
+        #SamLine adds a newline to the last line of a file without one
+        samfile.seek(start)
+        if samfile.read(1) == b'\n':
+            start += 1
+        samfile.seek(end)
+    return start
+
+
+def checkpoint_batches(readpairs, samfiles, interval=1000000, paired=False):
+    """Collect read pairs into batches of whole reads (or read pairs)
+    Arguments:
+        readpairs - an iterable of tuples of SamLines read from samfiles
+                    (eg from getRawReadPairs)
+        samfiles  - the seekable binary files read by readpairs
+        interval  - the number of read pairs in each batch. Default 1000000
+        paired    - if True consecutive reads with the same name are never
+                    split between batches
+    Yields:
+        tuples of a list of read pairs and a list of the offsets in each
+        file of the first read after the batch
+    """
+    batch = []
+    for readpair in readpairs:
+        if len(batch) >= interval and (not paired or readpair[0][0] != batch[-1][0][0]):
+            yield batch, [line_offset(f, line) for f, line in zip(samfiles, readpair)]
+            batch = []
+        batch.append(readpair)
+    yield batch, [f.tell() for f in samfiles]
+
+
+def sync_outputs(writers, files):
+    """Flush the writers and files of each category in files to disk and
+    return a dictionary of the file sizes keyed by category"""
+    sizes = {}
+    for category in sorted(files):
+        writers[category].flush()
+        files[category].flush()
+        os.fsync(files[category].fileno())
+        sizes[category] = files[category].tell()
+    return sizes
+
+
+def truncate_outputs(files, output_sizes):
+    """Truncate output files opened for reading and writing to the sizes
+    recorded in a checkpoint and position them for appending"""
+    for category, size in output_sizes.items():
+        f = files[category]
+        if f.seek(0, 2) < size:
+            raise ValueError('The {0} output file is smaller than in the checkpoint'.format(category))
+        f.truncate(size)
+        f.seek(size)
+    pass
+
+
+class HeaderRestorer(object):
+    """Writer object that sets the reference names of a BamWriter from a
+    header without writing it, for appending to an existing output file"""
+    def __init__(self, writer):
+        self.writer = writer
+        pass
+
+    def write_header(self, header):
+        if hasattr(self.writer, 'set_references'):
+            self.writer.set_references(header)
+        pass
+
+
+def checkpointed_main(main_function, readpairs, samfiles, writers, files, checkpoint, filename,
+                      interval=1000000, paired=False, **kw):
+    """Run a main loop function in batches, writing a checkpoint after each batch
+    Arguments:
+        main_function - a main loop function such as main_paired_end
+        readpairs     - an iterable of tuples of SamLines read from samfiles
+        samfiles      - the seekable binary input files, positioned at the
+                        offsets of the checkpoint when resuming
+        writers       - a dictionary of writer objects (or None) for each
+                        output category as for the main loop functions
+        files         - a dictionary of the seekable files of the writers
+        checkpoint    - a new Checkpoint or the Checkpoint being resumed
+        filename      - the checkpoint file
+        interval      - the number of read pairs between checkpoints
+        paired        - True for paired end reads
+        kw            - other arguments to main_function (eg min_score, tag_func)
+    Returns:
+        category_counts - the category counts of the whole run
+    """
+    category_counts = Counter(checkpoint.category_counts)
+    for batch, offsets in checkpoint_batches(readpairs, samfiles, interval, paired):
+        category_counts.update(main_function(batch, **dict(kw, **writers)))
+        checkpoint.output_sizes = sync_outputs(writers, files)
+        checkpoint.input_offsets = offsets
+        checkpoint.category_counts = category_counts
+        checkpoint.save(filename)
+    return category_counts
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+estimate.py
+
+Estimation of the proportion of reads in each category from a random
+sample of reads, for quality control without classifying every read.
+
+Reads (or read pairs) are sampled from two seekable SAM files by seeking
+to a random byte offset in the primary file and taking the first complete
+group of alignments with the same read name.  The same read is located in
+the secondary file by searching near an offset interpolated from the reads
+already found, as the files contain the same reads in the same order.
+Offsets are sampled uniformly, so each read is sampled with probability
+proportional to the length of the preceding read in the file, which is
+independent of the category of the sampled read.
+
+Sampling continues until the 95% confidence interval (Wilson score
+interval) of every category proportion is narrower than the requested
+precision.  Inputs that cannot be sampled (BAM, compressed SAM, pipes),
+and files with fewer reads than would be sampled, are classified in file
+order with the same stopping rule.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+import math
+import random
+import itertools
+from bisect import bisect_right
+from collections import Counter
+from xenomapper.sam import SamLine
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+Z_95 = 1.959964
+
+
+def wilson_interval(count, total, z=Z_95):
+    """Return the Wilson score confidence interval of a proportion
+    Arguments:
+        count - the number of observations in the category
+        total - the total number of observations
+        z     - the standard normal quantile of the interval. Default 95%
+    Returns:
+        a tuple of the lower and upper bound of the proportion
+    """
+    if not total:
+        return (0.0, 1.0)
+    p = count / total
+    denominator = 1 + z * z / total
+    centre = (p + z * z / (2 * total)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denominator
+    return (max(0.0, centre - half_width), min(1.0, centre + half_width))
+
+
+def sequential_groups(readpairs):
+    """Group read pairs from the main loop iterables into lists of the
+    read pairs with the same read name, in file order"""
+    for qname, group in itertools.groupby(readpairs, key=lambda readpair: readpair[0][0]):
+        yield list(group)
+
+
+class SamSampler(object):
+    """Random sampler of reads from two seekable plain SAM files that
+    contain the same reads in the same order.
+    Arguments:
+        sam1, sam2 - seekable binary SAM files positioned after the header
+                     (eg by get_sam_header)
+        paired     - if True all alignments with the same read name
+                     are sampled together, otherwise only the first
+        seed       - an optional seed for the random number generator
+    Attributes:
+        searched   - the number of bytes of the secondary file read while
+                     locating sampled reads
+        draws      - the number of reads sampled
+        exhausted  - True once bounded has sampled as many reads as the
+                     estimated number of reads in the file
+    Iterating yields an endless sequence of lists of read pairs (tuples
+    of SamLines) as for sequential_groups.
+    """
+    def __init__(self, sam1, sam2, paired=False, seed=None):
+        self.sam1 = sam1
+        self.sam2 = sam2
+        self.paired = paired
+        self.random = random.Random(seed)
+        self.searched = 0
+        self.draws = 0
+        self.exhausted = False
+        self._sampled_bytes = 0
+        self.start1 = sam1.tell()
+        self.start2 = sam2.tell()
+        self.end1 = sam1.seek(0, 2)
+        self.end2 = sam2.seek(0, 2)
+        #known offsets of the same read in each file for predicting offsets in sam2
+        self._offsets1 = [self.start1, self.end1]
+        self._offsets2 = [self.start2, self.end2]
+        pass
+
+    def _read_group(self, samfile, offset=None, paired=None):
+        """Return a list of SamLines with the same read name as the line at
+        offset (or the current line). Only the first is returned unless paired."""
+        if offset is not None:
+            samfile.seek(offset)
+        line = samfile.readline()
+        if not line.strip():
+            return []
+        group = [SamLine(line)]
+        key = group[0].qname.encode('ascii') + b'\t'
+        while self.paired if paired is None else paired:
+            offset = samfile.tell()
+            line = samfile.readline()
+            if not line.startswith(key):
+                samfile.seek(offset)
+                break
+            group.append(SamLine(line))
+        return group
+
+    def _random_group(self):
+        """Return the offset and alignments of a read group in sam1.
+        The first read group that starts after the read containing a random
+        offset is used, wrapping around to the first read in the file."""
+        self.sam1.seek(self.random.randrange(self.start1, self.end1))
+        self.sam1.readline() #partial line
+        self._read_group(self.sam1, paired=True) #may have started before the offset
+        offset = self.sam1.tell()
+        group = self._read_group(self.sam1, offset)
+        if not group:
+            offset = self.start1
+            group = self._read_group(self.sam1, offset)
+        return offset, group
+
+    def _predict(self, offset1):
+        """Return an offset in sam2 interpolated from the known offsets"""
+        i = bisect_right(self._offsets1, offset1)
+        i = min(max(i, 1), len(self._offsets1) - 1)
+        x0, x1 = self._offsets1[i-1], self._offsets1[i]
+        y0, y1 = self._offsets2[i-1], self._offsets2[i]
+        if x1 == x0:
+            return y0
+        return int(y0 + (y1 - y0) * (offset1 - x0) / (x1 - x0))
+
+    def find(self, qname, offset1):
+        """Return the offset in sam2 of the first alignment of read qname,
+        which is at offset1 in sam1"""
+        predicted = self._predict(offset1)
+        key = b'\n' + qname.encode('ascii') + b'\t'
+        window = 2**16
+        while True:
+            low = max(self.start2, predicted - window)
+            high = min(self.end2, predicted + window)
+            self.sam2.seek(low)
+            data = self.sam2.read(high - low)
+            self.searched += len(data)
+            if low == self.start2:
+                data = b'\n' + data
+                low -= 1
+            i = data.find(key)
+            #the previous line must be complete to know this is the first alignment of the read
+            if i >= 0 and (data.rfind(b'\n', 0, i) >= 0 or low < self.start2):
+                offset2 = low + i + 1
+                if abs(offset2 - predicted) > 2**12: #only keep offsets that improve the predictions
+                    index = bisect_right(self._offsets1, offset1)
+                    self._offsets1.insert(index, offset1)
+                    self._offsets2.insert(index, offset2)
+                return offset2
+            if low == self.start2 - 1 and high == self.end2:
+                raise ValueError('Read {0} was not found in the secondary file'.format(qname))
+            window *= 4
+
+    def __iter__(self):
+        while True:
+            offset1, group1 = self._random_group()
+            group2 = self._read_group(self.sam2, self.find(group1[0].qname, offset1))
+            if len(group1) != len(group2):
+                raise ValueError('Read {0} has {1} alignments in the primary file and {2} in the secondary file'.format(
+                                                                group1[0].qname, len(group1), len(group2)))
+            self.draws += 1
+            self._sampled_bytes += sum(len(x.raw) for x in group1)
+            yield list(zip(group1, group2))
+
+    def estimated_reads(self):
+        """Return the number of reads (or read pairs) in the primary file
+        estimated from its size and the mean length of the sampled reads"""
+        if not self.draws:
+            return float('inf')
+        return (self.end1 - self.start1) * self.draws / self._sampled_bytes
+
+    def bounded(self):
+        """Yield groups as for iteration until as many reads have been
+        sampled as the estimated number of reads in the file, when
+        sampling with replacement no longer improves on reading the whole
+        file, and set exhausted"""
+        for group in self:
+            yield group
+            if self.draws >= self.estimated_reads():
+                self.exhausted = True
+                return
+
+
+def estimate_category_counts(groups, main_function, precision=0.01, min_reads=1000, max_reads=1000000,
+                             check_every=100, max_groups=None, empty_groups=1000, **kw):
+    """Classify groups of read pairs until the confidence intervals of the
+    proportions of all categories are narrow enough
+    Arguments:
+        groups        - an iterable of lists of read pairs, each list
+                        being one read (or read pair) as for sequential_groups
+        main_function - a main loop function such as main_paired_end
+        precision     - the maximum half width of the 95% confidence
+                        interval of every category proportion. Default 0.01
+        min_reads     - the minimum number of reads classified. Default 1000
+        max_reads     - the maximum number of reads classified. Default 1000000
+        check_every   - the number of reads between tests of the intervals
+        max_groups    - the maximum number of groups classified, as groups
+                        may not be counted by main_function. Default max_reads
+        empty_groups  - the number of groups without any counts after which
+                        the groups are assumed not to match main_function
+                        (eg single end reads with main_paired_end). Default 1000
+        kw            - other arguments to main_function (eg min_score, tag_func)
+    Returns:
+        category_counts - the category counts of the sampled reads
+        converged       - True if the intervals reached the requested precision
+    """
+    if max_groups is None:
+        max_groups = max_reads
+    category_counts = Counter()
+    total = 0
+    n = 0
+    for n, group in enumerate(groups, 1):
+        counts = main_function(group, primary_specific=None, **kw)
+        category_counts.update(counts)
+        total += sum(counts.values())
+        if not total and n >= empty_groups:
+            break
+        if total >= max_reads or n >= max_groups:
+            break
+        if total >= min_reads and total % check_every == 0:
+            if max_half_width(category_counts) <= precision:
+                return category_counts, True
+    if n and not total:
+        raise ValueError('None of {0} reads were classified. Check that --paired matches the input files'.format(n))
+    return category_counts, max_half_width(category_counts) <= precision
+
+
+def max_half_width(category_counts):
+    """Return the largest half width of the confidence intervals of the category proportions"""
+    total = sum(category_counts.values())
+    widths = [wilson_interval(count, total) for count in category_counts.values()]
+    return max([(high - low) / 2 for low, high in widths] or [0.5])
+
+
+def output_estimate(category_counts, converged=True, sampled=True, complete=False, outfile=sys.stderr):
+    """Print the proportion and 95% confidence interval of each category.
+    complete indicates that every read in the files was classified."""
+    total = sum(category_counts.values())
+    if complete:
+        description = 'reads, the complete file'
+    elif sampled:
+        description = 'randomly sampled reads'
+    else:
+        description = 'reads in file order'
+    print('-'*80, file=outfile)
+    print('Estimated Category Proportions ({0} {1})\n'.format(total, description), file=outfile)
+    print('|       {0:45s}|     {1:10s}  | {2:10s} |    {3:15s}|'.format('Category','Count','Proportion','95% CI'),
+          file=outfile)
+    print('|:','-'*50,':|:','-'*15,':|:','-'*10,':|:','-'*17,':|',sep='', file=outfile)
+    for category in sorted(category_counts):
+        low, high = wilson_interval(category_counts[category], total)
+        print('|  {0:50s}|{1:15d}  | {2:10.4f} | {3:.4f} - {4:.4f}   |'.format(str(category),
+                category_counts[category], category_counts[category] / total, low, high), file=outfile)
+    if not converged:
+        print('\nWARNING: the requested precision was not reached', file=outfile)
+    print(file=outfile)
+    pass
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+join.py
+
+Order tolerant matching of reads between two alignment files.
+
+Aligners running with multiple threads write reads in the order they
+finish unless told to preserve the input order (eg bowtie2 --reorder),
+which is slow at high thread counts.  ReadPairJoiner reads both files in
+lockstep and keeps reads that have not yet been seen in the other file in
+a hash table keyed on the read name, yielding read pairs as soon as both
+sides have arrived.  If the unmatched reads exceed a memory limit they are
+spilled to temporary files partitioned by read name, which are joined
+once both files have been read.
+
+Consecutive alignments with the same read name are kept together, so the
+forward and reverse reads of a pair stay intact in paired mode.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+import pickle
+import tempfile
+import zlib
+from xenomapper.sam import SamLine
+from xenomapper.bam import BamRecord
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+
+def _record_size(record):
+    """Return the approximate size in bytes of a read"""
+    if isinstance(record, SamLine):
+        return len(record.raw)
+    elif isinstance(record, BamRecord):
+        return len(record.data)
+    return sum([len(x) for x in record])
+
+
+def group_reads(records, paired=False):
+    """Group consecutive alignments with the same read name
+    Arguments:
+        records - an iterable of SamLine or BamRecord objects or lists of
+                  sam fields
+        paired  - if True all alignments with the same name are kept,
+                  otherwise only the first (as for skip_repeated_reads)
+    Yields:
+        tuples of read name and a list of alignments
+    """
+    group = []
+    qname = None
+    for record in records:
+        if record[0] == qname:
+            if paired:
+                group.append(record)
+            continue
+        if group:
+            yield qname, group
+        qname = record[0]
+        group = [record]
+    if group:
+        yield qname, group
+
+
+class ReadPairJoiner(object):
+    """Iterable of read pairs from two alignment files that contain the same
+    reads in any order.
+    Arguments:
+        records1, records2 - iterables of SamLine or BamRecord objects or lists
+                       of sam fields from the primary and secondary species
+        paired       - True for paired end reads, which are yielded as
+                       consecutive pairs of forward and reverse reads
+        memory_limit - the approximate number of bytes of unmatched reads
+                       held in memory before spilling to disk. Default 1GB
+        spill_dir    - the directory for temporary spill files. Default
+                       is the system temporary directory
+        partitions   - the number of spill files for each input
+    Attributes (available after iteration):
+        peak_buffered - the largest number of unmatched reads held in memory
+        peak_bytes    - the largest size in bytes of unmatched reads in memory
+        spilled       - the number of reads written to spill files
+    Yields:
+        tuples of matching reads from each file as for getRawReadPairs
+    Raises:
+        ValueError if a read is only present in one file
+    """
+    def __init__(self, records1, records2, paired=False, memory_limit=2**30, spill_dir=None, partitions=64):
+        self.records1 = records1
+        self.records2 = records2
+        self.paired = paired
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        self.partitions = partitions
+        self.peak_buffered = 0
+        self.peak_bytes = 0
+        self.spilled = 0
+        self._spill_files = None
+        self._references = [None, None]
+        pass
+
+    def _pairs(self, group1, group2):
+        if len(group1) != len(group2):
+            raise ValueError('Read {0} has {1} alignments in the primary file and {2} in the secondary file'.format(
+                                                                group1[0][0], len(group1), len(group2)))
+        return zip(group1, group2)
+
+    def __iter__(self):
+        buffers = [{}, {}]
+        sizes = [0, 0]
+        counts = [0, 0]
+        streams = [group_reads(self.records1, self.paired), group_reads(self.records2, self.paired)]
+        active = [True, True]
+        while active[0] or active[1]:
+            for side in (0, 1):
+                if not active[side]:
+                    continue
+                try:
+                    qname, group = next(streams[side])
+                except StopIteration:
+                    active[side] = False
+                    continue
+                other = buffers[1 - side]
+                if qname in other:
+                    other_group, other_size = other.pop(qname)
+                    sizes[1 - side] -= other_size
+                    counts[1 - side] -= len(other_group)
+                    if side == 0:
+                        yield from self._pairs(group, other_group)
+                    else:
+                        yield from self._pairs(other_group, group)
+                    continue
+                size = sum([_record_size(x) for x in group])
+                buffers[side][qname] = (group, size)
+                sizes[side] += size
+                counts[side] += len(group)
+                self.peak_buffered = max(self.peak_buffered, counts[0] + counts[1])
+                self.peak_bytes = max(self.peak_bytes, sizes[0] + sizes[1])
+                if sizes[0] + sizes[1] > self.memory_limit:
+                    self._spill(buffers)
+                    sizes = [0, 0]
+                    counts = [0, 0]
+        if self._spill_files is None:
+            self._check_unmatched(buffers[0], buffers[1])
+            return
+        self._spill(buffers)
+        for partition1, partition2 in zip(*self._spill_files):
+            unmatched = {qname:group for qname, group in self._read_spill(partition1, 0)}
+            unmatched2 = {}
+            for qname, group in self._read_spill(partition2, 1):
+                if qname in unmatched:
+                    yield from self._pairs(unmatched.pop(qname), group)
+                else:
+                    unmatched2[qname] = group
+            self._check_unmatched(unmatched, unmatched2)
+            partition1.close()
+            partition2.close()
+        pass
+
+    def _check_unmatched(self, unmatched1, unmatched2):
+        if unmatched1 or unmatched2:
+            example = next(iter(unmatched1 or unmatched2))
+            raise ValueError('{0} reads in the primary file and {1} reads in the secondary file were not found in the other file (eg {2})'.format(
+                                                            len(unmatched1), len(unmatched2), example))
+        pass
+
+    def _spill(self, buffers):
+        """Write all unmatched reads to the spill files and empty the buffers"""
+        if self._spill_files is None:
+            self._spill_files = [[tempfile.TemporaryFile(dir=self.spill_dir) for i in range(self.partitions)]
+                                                                                       for side in (0, 1)]
+        for side in (0, 1):
+            files = self._spill_files[side]
+            for qname, (group, size) in buffers[side].items():
+                if isinstance(group[0], BamRecord):
+                    self._references[side] = group[0].references
+                    state = [x.data for x in group]
+                elif isinstance(group[0], SamLine):
+                    state = [x.raw for x in group]
+                else:
+                    state = group
+                pickle.dump((qname, state), files[zlib.crc32(qname.encode('ascii')) % self.partitions],
+                            protocol=pickle.HIGHEST_PROTOCOL)
+                self.spilled += len(group)
+            buffers[side].clear()
+        pass
+
+    def _read_spill(self, spill_file, side):
+        """Yield read names and groups of reads from a spill file"""
+        spill_file.seek(0)
+        references = self._references[side]
+        while True:
+            try:
+                qname, state = pickle.load(spill_file)
+            except EOFError:
+                return
+            if isinstance(state[0], bytes):
+                if references is not None:
+                    yield qname, [BamRecord(x, references) for x in state]
+                else:
+                    yield qname, [SamLine(x) for x in state]
+            else:
+                yield qname, state
+
+
+def output_join_summary(joiner, outfile=sys.stderr):
+    """Print the peak buffer size of a ReadPairJoiner"""
+    print('Read pair join buffer: peak {0} unmatched reads ({1:.1f} MB) in memory, {2} reads spilled to disk\n'.format(
+              joiner.peak_buffered, joiner.peak_bytes / 2**20, joiner.spilled), file=outfile)
+    pass
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+manifest.py
+
+Read category manifests and extraction of categories from the inputs.
+
+A classification run can record a manifest (--manifest) of the category
+of every read in input order, as one byte per read (or read of a pair)
+after a short JSON header of the settings of the run.  The code of the
+second read of a pair is the category of the pair and the first read is
+UNPAIRED.  Pairs discarded by a pairing policy are DISCARDED.  For
+uncompressed SAM inputs a sparse index of the byte offsets in each input
+of a read every --manifest_interval reads (at the start of a pair) follows
+the codes.
+
+The extract subcommand writes the reads of any category from the
+original inputs, seeking to the indexed blocks that contain reads of the
+category instead of classifying the whole files again:
+
+    xenomapper extract --manifest sample.manifest --unresolved sample_unresolved.sam
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+import json
+import mmap
+import struct
+import argparse, textwrap
+from itertools import islice
+from collections import Counter
+from xenomapper.writers import OUTPUT_CATEGORIES, write_read
+from xenomapper.policies import MAPPING_STATES, STATE_CODES, DISCARD, LIBERAL, BOTH_READS, WRITTEN_READS
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+MAGIC = b'XMMANIF1'
+_HEADER_LENGTH = struct.Struct('<I')
+#row, offset1, offset2
+INDEX_ENTRY = struct.Struct('<QQQ')
+#number of rows, number of index entries
+_TRAILER = struct.Struct('<QQ')
+
+#Codes are indexes into OUTPUT_CATEGORIES or one of these
+DISCARDED = 254
+UNPAIRED = 255
+
+
+class ManifestWriter(object):
+    """Record the category of every read pair of a classification run
+    Arguments:
+        outfile  - a binary file for the manifest
+        settings - a dictionary of the settings of the run, kept in
+                   the header of the manifest
+        samfiles - the binary SAM files read by the read pairs.  The index
+                   is only recorded if both files can be seeked.
+                   Default None records no index
+        interval - the minimum number of reads between index entries.
+                   Default 10000
+    """
+    def __init__(self, outfile, settings, samfiles=None, interval=10000):
+        self.outfile = outfile
+        self.samfiles = samfiles if samfiles and all(f.seekable() for f in samfiles) else None
+        self.interval = interval
+        self.rows = 0
+        self.index = []
+        header = json.dumps(dict(settings, version=__version__, interval=interval,
+                                 indexed=self.samfiles is not None)).encode('utf-8')
+        outfile.write(MAGIC + _HEADER_LENGTH.pack(len(header)) + header)
+        pass
+
+    def record(self, readpairs, scores, min_score=float('-inf'), paired=False, policy=LIBERAL):
+        """Yield the read pairs of an iterable, recording the category of each.
+        Arguments:
+            readpairs - an iterable of tuples of reads, as for the main
+                        loop functions
+            scores    - a function returning a tuple of the best and next
+                        best score of a read (eg from get_score_function)
+            min_score, paired, policy - the classification options of the run
+        """
+        from xenomapper.xenomapper import get_mapping_state
+        n = len(MAPPING_STATES)
+        pair_codes = [DISCARDED if x == DISCARD else x for x in policy.table]
+        codes = bytearray()
+        previous = None
+        next_index = 0
+        for line1, line2 in readpairs:
+            AS1, XS1 = scores(line1)
+            AS2, XS2 = scores(line2)
+            state = STATE_CODES[get_mapping_state(AS1, XS1, AS2, XS2, min_score)]
+            qname = line1[0]
+            mate = paired and previous is not None and previous[0] == qname
+            if self.samfiles and self.rows >= next_index and not mate:
+                self.index.append((self.rows, self.samfiles[0].tell() - len(line1.raw),
+                                   self.samfiles[1].tell() - len(line2.raw)))
+                next_index = self.rows + self.interval
+            if not paired:
+                codes.append(state)
+            elif mate:
+                codes.append(pair_codes[previous[1] * n + state])
+            else:
+                codes.append(UNPAIRED)
+            previous = (qname, state)
+            self.rows += 1
+            if len(codes) >= 65536:
+                self.outfile.write(codes)
+                codes = bytearray()
+            yield line1, line2
+        self.outfile.write(codes)
+        pass
+
+    def close(self):
+        """Write the index and close the manifest"""
+        self.outfile.write(b''.join(INDEX_ENTRY.pack(*x) for x in self.index))
+        self.outfile.write(_TRAILER.pack(self.rows, len(self.index)) + MAGIC)
+        self.outfile.close()
+        pass
+
+
+class Manifest(object):
+    """A manifest written by a ManifestWriter
+    Arguments:
+        filename - the manifest file
+    Attributes:
+        settings - the settings of the run that recorded the manifest
+        codes    - a memory mapped bytes like object of the code of each read
+        index    - a list of tuples of the row and offsets in each input of
+                   the indexed reads
+    """
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{0} is not a xenomapper manifest'.format(filename))
+            length, = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+            self.settings = json.loads(f.read(length).decode('utf-8'))
+            start = len(MAGIC) + _HEADER_LENGTH.size + length
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        trailer = len(self._map) - _TRAILER.size - len(MAGIC)
+        if trailer < start or self._map[-len(MAGIC):] != MAGIC:
+            raise ValueError('{0} is incomplete'.format(filename))
+        rows, entries = _TRAILER.unpack_from(self._map, trailer)
+        self.codes = memoryview(self._map)[start:start + rows]
+        index_start = start + rows
+        self.index = [INDEX_ENTRY.unpack_from(self._map, index_start + i * INDEX_ENTRY.size)
+                      for i in range(entries)]
+        pass
+
+    def __len__(self):
+        return len(self.codes)
+
+    def category_counts(self):
+        """Return a Counter of the number of reads (or pairs) in each category"""
+        counts = Counter(bytes(self.codes))
+        return Counter({('discard' if code == DISCARDED else OUTPUT_CATEGORIES[code]):count
+                        for code, count in counts.items() if code != UNPAIRED})
+
+    def blocks(self):
+        """Yield tuples of the first row, the row after the last and the
+        offsets in each input of the indexed blocks of reads"""
+        for i, (row, offset1, offset2) in enumerate(self.index):
+            end = self.index[i+1][0] if i + 1 < len(self.index) else len(self)
+            yield row, end, offset1, offset2
+        pass
+
+    def close(self):
+        self.codes.release()
+        self._map.close()
+        pass
+
+
+def extract(manifest, samfiles, outputs):
+    """Write the reads of categories from the inputs of a manifest.
+    Only the indexed blocks containing reads of the categories are read
+    if the manifest has an index, otherwise the inputs are read from the
+    current position (after the headers).
+    Arguments:
+        manifest - a Manifest
+        samfiles - the binary SAM input files of the run that recorded the
+                   manifest (seekable if the manifest is indexed)
+        outputs  - a dictionary of writer objects (or None) keyed by category
+    Returns:
+        category_counts - a Counter of the number of reads (or pairs)
+                   extracted for each category
+    """
+    from xenomapper.xenomapper import getRawReadPairs
+    paired = manifest.settings['paired']
+    wanted = {OUTPUT_CATEGORIES.index(category):outfile for category, outfile in outputs.items() if outfile}
+    category_counts = Counter()
+    codes = manifest.codes
+    if manifest.index:
+        blocks = manifest.blocks()
+    else:
+        blocks = [(0, len(manifest), None, None)]
+    for start, end, offset1, offset2 in blocks:
+        block = bytes(codes[start:end])
+        if not any(bytes((code,)) in block for code in wanted):
+            continue
+        if offset1 is not None:
+            samfiles[0].seek(offset1)
+            samfiles[1].seek(offset2)
+        readpairs = getRawReadPairs(samfiles[0], samfiles[1], skip_repeated_reads=not paired)
+        previous = None
+        rows = 0
+        for code, (line1, line2) in zip(block, islice(readpairs, end - start)):
+            rows += 1
+            outfile = wanted.get(code)
+            if outfile:
+                category_counts[OUTPUT_CATEGORIES[code]] += 1
+                written = WRITTEN_READS[code]
+                for side in ((0, 1) if written == BOTH_READS else (written,)):
+                    if paired:
+                        write_read(outfile, previous[side])
+                    write_read(outfile, (line1, line2)[side])
+            previous = (line1, line2)
+        if rows != end - start:
+            raise ValueError('The inputs have fewer reads than the manifest')
+    return category_counts
+
+
+def command_line_interface(argv=None): #pragma: no cover
+    from xenomapper.xenomapper import add_output_arguments, add_format_arguments
+    parser = argparse.ArgumentParser(prog = "xenomapper extract",
+                    formatter_class=argparse.RawDescriptionHelpFormatter,
+                    description=textwrap.dedent("""\
+                    Write the reads of one or more categories from the inputs
+                    of an earlier xenomapper run using its manifest (written
+                    with --manifest), without classifying the reads again.
+
+                    Name an output for each category to extract, eg
+                        xenomapper extract --manifest sample.manifest --unresolved unresolved.sam
+                    """),
+                    )
+    parser.add_argument('--manifest',
+                        required=True,
+                        help='a manifest written by xenomapper --manifest')
+    parser.add_argument('--primary_sam',
+                        type=argparse.FileType('rb'),
+                        default=None,
+                        help='the primary SAM file of the original run. '
+                             'Default is the file name recorded in the manifest')
+    parser.add_argument('--secondary_sam',
+                        type=argparse.FileType('rb'),
+                        default=None,
+                        help='the secondary SAM file of the original run. '
+                             'Default is the file name recorded in the manifest')
+    add_output_arguments(parser)
+    add_format_arguments(parser)
+    parser.set_defaults(primary_specific=None)
+    args = parser.parse_args(argv)
+    if not [category for category in OUTPUT_CATEGORIES if getattr(args, category)]:
+        parser.error('name an output file for at least one category')
+    if args.split_fastq and not args.fastq_output:
+        parser.error('--split_fastq requires --fastq_output')
+    return args
+
+
+def run_extract(args): #pragma: no cover
+    """Extract the categories named in args and print a summary of the
+    number of reads extracted to stderr"""
+    from xenomapper.xenomapper import process_headers, open_outputs, close_outputs, output_summary
+    from xenomapper.sam import open_sam
+    manifest = Manifest(args.manifest)
+    samfiles = [args.primary_sam or open(manifest.settings['inputs'][0], 'rb'),
+                args.secondary_sam or open(manifest.settings['inputs'][1], 'rb')]
+    if not manifest.index:
+        #without an index the inputs are read from the start, so compressed files can be used
+        samfiles = [open_sam(f) for f in samfiles]
+    open_outputs(args)
+    process_headers(samfiles[0], samfiles[1], **{category:getattr(args, category) for category in OUTPUT_CATEGORIES})
+    category_counts = extract(manifest, samfiles, {category:getattr(args, category) for category in OUTPUT_CATEGORIES})
+    close_outputs(args)
+    for samfile in samfiles:
+        samfile.close()
+    manifest.close()
+    output_summary(category_counts=category_counts)
+    return category_counts
+
+
+def main(argv=None): #pragma: no cover
+    args = command_line_interface(argv)
+    try:
+        run_extract(args)
+    except ValueError as error:
+        print('ERROR: {0}'.format(error), file=sys.stderr)
+        sys.exit(1)
+    pass
+
+
+if __name__ == '__main__': #pragma: no cover
+    main()
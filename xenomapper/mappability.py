@@ -24,6 +24,7 @@ import argparse
 from statistics import *
 from collections import Counter
 from xenomapper.xenomapper import get_sam_header
+from xenomapper.profiling import add_profile_arguments, profile_call
 
 __author__ = "Matthew Wakefield"
 __copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
@@ -301,6 +302,7 @@ def command_line_interface(): #pragma: no cover
     parser.add_argument('--sam_for_sizes',
                         type=argparse.FileType('rt'),
                         help='a sam file for calculating insert sizes')
+    add_profile_arguments(parser, 'xenomappability_profile.json')
     parser.add_argument('--version',
                         action='store_true',
                         help='print version information and exit')
@@ -314,9 +316,7 @@ def command_line_interface(): #pragma: no cover
         sys.exit(1)
     return args
 
-def main(args=None): #pragma: no cover
-    if not args:
-        args = command_line_interface()
+def run_mappability(args): #pragma: no cover
     if args.fasta:
         simulate_reads(fastafile=args.fasta, readlength=args.readlength)
     elif args.mapped_test_data:
@@ -328,6 +328,16 @@ def main(args=None): #pragma: no cover
         paired_end_mappability(wiggle=args.single_end_wiggle, mate_density=mate_density)
     pass
 
+def main(args=None): #pragma: no cover
+    if not args:
+        args = command_line_interface()
+    if getattr(args, 'profile', None):
+        profile_call(run_mappability, args, program='xenomappability', report_file=args.profile,
+                     top=args.profile_top)
+    else:
+        run_mappability(args)
+    pass
+
 
 if __name__ == '__main__': # pragma: no cover
     main()
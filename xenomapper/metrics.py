@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+metrics.py
+
+Live throughput and stage timing reports for long classification runs.
+
+When enabled the input files, the iterable of read pairs, the tag profile
+and the output writers are wrapped by objects that count bytes and time
+each stage, and a report is printed at regular intervals:
+
+    parsing        - reading and splitting the input (and matching reads
+                     with --unordered)
+    tags           - extracting the scores from the tags of each read
+    classification - get_mapping_state and the rest of the main loop
+    writing        - formatting, compressing and queueing output reads
+
+Reports are written to stderr as one line each, or to a file as JSON
+lines.  Nothing is wrapped when metrics are disabled.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+import json
+import time
+from time import perf_counter
+from collections import Counter
+from xenomapper.profiles import TagProfile
+from xenomapper.parallel import batch_readpairs
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+#the parsing, tags and writing stages are timed for one in every SAMPLE_EVERY reads
+SAMPLE_EVERY = 8
+
+
+class MeteredReader(object):
+    """A binary file like object that counts the bytes read from a file.
+    Other attributes (eg peek, seek, tell) are those of the file."""
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.bytes_read = 0
+        pass
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def read1(self, size=-1):
+        data = self.fileobj.read1(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        size = self.fileobj.readinto(buffer)
+        self.bytes_read += size or 0
+        return size
+
+    def readline(self, size=-1):
+        line = self.fileobj.readline(size)
+        self.bytes_read += len(line)
+        return line
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+class TimedProfile(TagProfile):
+    """A TagProfile that estimates the seconds taken to extract scores
+    with another profile by timing one in every sample_every reads"""
+    def __init__(self, profile, sample_every=SAMPLE_EVERY):
+        TagProfile.__init__(self, profile.score_tag, profile.other_tag)
+        self.profile = profile
+        self.sample_every = sample_every
+        self.seconds = 0.0
+        self._calls = 0
+        pass
+
+    def scores(self, sam_line):
+        self._calls += 1
+        if self._calls % self.sample_every:
+            return self.profile.scores(sam_line)
+        start = perf_counter()
+        result = self.profile.scores(sam_line)
+        self.seconds += (perf_counter() - start) * self.sample_every
+        return result
+
+    def __repr__(self):
+        return repr(self.profile)
+
+
+class TimedWriter(object):
+    """A writer object that estimates the seconds taken to write reads
+    with another writer by timing one in every sample_every reads"""
+    def __init__(self, writer, sample_every=SAMPLE_EVERY):
+        self.writer = writer
+        self.sample_every = sample_every
+        self.seconds = 0.0
+        self._calls = 0
+        pass
+
+    def write_read(self, line):
+        self._calls += 1
+        if self._calls % self.sample_every:
+            self.writer.write_read(line)
+            return
+        start = perf_counter()
+        self.writer.write_read(line)
+        self.seconds += (perf_counter() - start) * self.sample_every
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+
+class Metrics(object):
+    """Collection and periodic reporting of throughput, stage timings and
+    running category counts
+    Arguments:
+        outfile    - a text file for reports. Default sys.stderr
+        json_lines - if True each report is written as a line of JSON,
+                     otherwise as a line of text
+        interval   - the minimum number of seconds between reports. Default 10
+    Attributes:
+        inputs          - a dictionary of the input files (or MeteredReaders)
+                          keyed by input name
+        records         - the number of read pairs read from the inputs
+        reads           - the number of reads (or read pairs) classified
+        category_counts - the category counts of the reads classified
+    """
+    def __init__(self, outfile=sys.stderr, json_lines=False, interval=10.0):
+        self.outfile = outfile
+        self.json_lines = json_lines
+        self.interval = interval
+        self.inputs = {}
+        self.records = 0
+        self.reads = 0
+        self.category_counts = Counter()
+        self.parsing = 0.0
+        self.classification = 0.0
+        self._timed = [] #TimedProfiles and TimedWriters
+        self.start = self._last_time = perf_counter()
+        self._last_records = 0
+        pass
+
+    def meter_input(self, name, fileobj):
+        """Return a file object for reading an input file with the bytes read
+        counted. The position of seekable files is used, so these are not wrapped."""
+        if not fileobj.seekable():
+            fileobj = MeteredReader(fileobj)
+        self.inputs[name] = fileobj
+        return fileobj
+
+    def timed_readpairs(self, readpairs, check_every=4096):
+        """Yield the read pairs of an iterable, estimating the time of the
+        parsing stage and reporting when the interval has passed"""
+        iterator = iter(readpairs)
+        while True:
+            if (self.records + 1) % SAMPLE_EVERY:
+                readpair = next(iterator, None)
+            else:
+                start = perf_counter()
+                readpair = next(iterator, None)
+                self.parsing += (perf_counter() - start) * SAMPLE_EVERY
+            if readpair is None:
+                return
+            self.records += 1
+            if not self.records % check_every:
+                self.report_if_due()
+            yield readpair
+
+    def timed_profile(self, profile):
+        """Return a TimedProfile timing the tags stage of a TagProfile"""
+        self._timed.append(TimedProfile(profile))
+        return self._timed[-1]
+
+    def timed_outputs(self, outputs):
+        """Return a dictionary of outputs with each writer wrapped by a
+        TimedWriter timing the writing stage"""
+        outputs = {category:TimedWriter(writer) if writer else None for category, writer in outputs.items()}
+        self._timed.extend([writer for writer in outputs.values() if writer])
+        return outputs
+
+    @property
+    def timings(self):
+        """A dictionary of the seconds spent in each stage"""
+        return {'parsing':self.parsing,
+                'tags':sum([x.seconds for x in self._timed if isinstance(x, TimedProfile)]),
+                'classification':self.classification,
+                'writing':sum([x.seconds for x in self._timed if isinstance(x, TimedWriter)]),
+                }
+
+    def _other_seconds(self):
+        return self.parsing + sum([x.seconds for x in self._timed])
+
+    def timed_main(self, main_function):
+        """Return a main loop function that times the classification stage
+        and adds to the running category counts"""
+        def timed_main_function(readpairs, **kw):
+            other = self._other_seconds()
+            start = perf_counter()
+            category_counts = main_function(readpairs, **kw)
+            elapsed = perf_counter() - start
+            self.classification += elapsed - (self._other_seconds() - other)
+            self.category_counts.update(category_counts)
+            self.reads += sum(category_counts.values())
+            return category_counts
+        return timed_main_function
+
+    def bytes_read(self):
+        """Return a dictionary of the bytes read from each input"""
+        return {name:f.bytes_read if isinstance(f, MeteredReader) else f.tell() for name, f in self.inputs.items()}
+
+    def state(self):
+        """Return a dictionary of the current metrics"""
+        now = perf_counter()
+        elapsed = now - self.start
+        interval = now - self._last_time
+        return {'time':time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'elapsed':round(elapsed, 3),
+                'records':self.records,
+                'records_per_second':round(self.records / elapsed, 1) if elapsed else 0.0,
+                'interval_records_per_second':round((self.records - self._last_records) / interval, 1)
+                                              if interval else 0.0,
+                'reads':self.reads,
+                'inputs':{name:{'bytes':size,
+                                'bytes_per_second':round(size / elapsed, 1) if elapsed else 0.0}
+                          for name, size in self.bytes_read().items()},
+                'timings':{stage:round(seconds, 3) for stage, seconds in self.timings.items()},
+                'category_counts':{'/'.join(key) if isinstance(key, tuple) else key:count
+                                   for key, count in sorted(self.category_counts.items())},
+                }
+
+    def report(self):
+        """Write a report of the current metrics"""
+        state = self.state()
+        if self.json_lines:
+            print(json.dumps(state), file=self.outfile)
+        else:
+            inputs = ' '.join('{0} {1:.1f} MB ({2:.1f} MB/s)'.format(name, x['bytes'] / 2**20,
+                                                                     x['bytes_per_second'] / 2**20)
+                              for name, x in state['inputs'].items())
+            timings = ' '.join('{0} {1:.1f}s'.format(stage, seconds) for stage, seconds in state['timings'].items())
+            counts = ' '.join('{0} {1}'.format(category, count) for category, count in state['category_counts'].items())
+            print('[metrics] {0:.1f}s | {1} records ({2:.0f}/s, now {3:.0f}/s) | {4} | {5} | {6}'.format(
+                  state['elapsed'], state['records'], state['records_per_second'],
+                  state['interval_records_per_second'], inputs, timings, counts), file=self.outfile)
+        self.outfile.flush()
+        self._last_time = perf_counter()
+        self._last_records = self.records
+        pass
+
+    def report_if_due(self):
+        """Write a report if at least interval seconds have passed since the last report"""
+        if perf_counter() - self._last_time >= self.interval:
+            self.report()
+        pass
+
+
+def metered_main(main_function, readpairs, metrics, batch_size=10000, paired=False, **kw):
+    """Run a main loop function on batches of read pairs so that the
+    running category counts of a Metrics object are updated as reads are
+    classified
+    Arguments:
+        main_function - a main loop function such as main_paired_end
+        readpairs     - an iterable of read pairs from Metrics.timed_readpairs
+        metrics       - a Metrics object
+        batch_size    - the number of read pairs in each batch. Default 10000
+        paired        - if True reads of a pair are never split between batches
+        kw            - other arguments to main_function (eg min_score, tag_func,
+                        output writers)
+    Returns:
+        category_counts - the category counts of all reads
+    """
+    timed_main_function = metrics.timed_main(main_function)
+    category_counts = Counter()
+    for batch in batch_readpairs(readpairs, batch_size=batch_size, paired=paired):
+        category_counts.update(timed_main_function(batch, **kw))
+    return category_counts
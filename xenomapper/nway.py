@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+nway.py
+
+Classification of reads aligned to more than two species in a single pass.
+
+The alignments of the same reads to N reference genomes are read in
+lockstep and each read (or read pair) is assigned to the species with the
+best unique score, to the multimapping category of that species, or to the
+unresolved (best score shared by more than one species) or unassigned (no
+score above min_score) categories.  With two species the classification is
+identical to xenomapper and the categories of species named primary and
+secondary have the same names.
+
+Each category is written to its own output file and the counts of the
+forward and reverse read categories can be written as a tab separated
+count matrix.
+
+Usage:
+    xenomapper nway --sam human.sam mouse.sam virus.sam \\
+                    --names human mouse virus --output_prefix sample
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+import os
+import argparse, textwrap
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from xenomapper.sam import sam_lines, open_sam
+from xenomapper.bam import BamReader, BamWriter
+from xenomapper.join import group_reads
+from xenomapper.writers import SamWriter, BackgroundWriter, write_header, write_read
+from xenomapper.xenomapper import get_sam_header, get_bam_header, add_pg_tag, get_tag, get_score_function, \
+                                  get_tag_profile, output_summary, output_cigar_cache_summary, \
+                                  add_classification_arguments, add_format_arguments
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+
+def nway_categories(names):
+    """Return a tuple of the category names for reads mapped to the species in names.
+    The categories are in priority order: the specific category of each species,
+    the multi category of each species, 'unresolved' and 'unassigned'.
+    The mapping states returned by get_nway_mapping_state index this tuple."""
+    return tuple('{0}_specific'.format(x) for x in names) + \
+           tuple('{0}_multi'.format(x) for x in names) + ('unresolved', 'unassigned')
+
+
+def get_nway_mapping_state(scores, min_score=float('-inf')):
+    """Determine the mapping state based on scores in each of N species.
+    Scores can be negative but better matches must have higher scores
+    Arguments:
+        scores    - a sequence of tuples of the score of the best match (AS)
+                    and of the other match (XS) in each species
+        min_score - the score that matches must exceed in order to be
+                    considered valid matches. Note scores equalling this
+                    value will also be considered not to match.
+                    Default = -inf
+    Returns
+        state - an integer index into nway_categories: the species index
+                for a specific read, N + the species index for a multimapping
+                read, 2N for unresolved and 2N + 1 for unassigned.
+    """
+    n = len(scores)
+    best = max([AS for AS, XS in scores])
+    if best <= min_score:              #low quality mapping in all species
+        return 2 * n + 1
+    species = [i for i, (AS, XS) in enumerate(scores) if AS == best]
+    if len(species) > 1:               #maps equally well in more than one species
+        return 2 * n
+    AS, XS = scores[species[0]]
+    if not XS or AS > XS:              #maps uniquely in the best species
+        return species[0]
+    return n + species[0]              #multimaps in the best species
+
+
+def get_nway_pair_state(forward_state, reverse_state, n, conservative=False):
+    """Return the mapping state of a read pair from the states of each read.
+    Liberal pairing assigns the highest priority state of the two reads.
+    Conservative pairing deems the pair unassigned if either read is
+    unassigned, and unresolved if either read is unresolved or the reads
+    are assigned to different species.
+    Arguments:
+        forward_state, reverse_state - states from get_nway_mapping_state
+        n            - the number of species
+        conservative - Boolean flag for conservative pairing. Default = False
+    """
+    if not conservative:
+        return min(forward_state, reverse_state)
+    if forward_state == 2 * n + 1 or reverse_state == 2 * n + 1:
+        return 2 * n + 1
+    if forward_state == 2 * n or reverse_state == 2 * n or forward_state % n != reverse_state % n:
+        return 2 * n
+    return min(forward_state, reverse_state)
+
+
+def getReadSets(inputs, skip_repeated_reads=False):
+    """Read alignments of the same reads to N species in lockstep
+        Arguments:
+        inputs  - a sequence of iterables of SamLine or BamRecord objects
+                  (eg from sam_lines or a BamReader) containing the same
+                  reads in the same order mapped in different species
+        skip_repeated_reads - if True only the first alignment of each
+                  read name is used (for single end reads)
+        Yields:   a tuple of the equivalent read from each input
+    """
+    iterators = [iter(x) for x in inputs]
+    if skip_repeated_reads:
+        iterators = [(group[0] for qname, group in group_reads(x)) for x in iterators]
+    for lines in zip(*iterators):
+        qname = lines[0][0]
+        for line in lines[1:]:
+            assert line[0] == qname
+        yield lines
+    pass
+
+
+def _write_state(outfile, state, reads, n):
+    """Write the reads of each species (a list of tuples of reads) for a mapping state"""
+    if state < 2 * n:
+        for line in reads[state % n]:
+            write_read(outfile, line)
+    elif state == 2 * n:
+        for species_reads in reads:
+            for line in species_reads:
+                write_read(outfile, line)
+    else:
+        for line in reads[0]:
+            write_read(outfile, line)
+    pass
+
+
+def nway_main_single_end(readsets, names, outputs=None, min_score=float('-inf'), tag_func=get_tag):
+    """Main loop for processing single end reads mapped to N species
+    Arguments:
+        readsets  - an iterable of tuples of the equivalent read in each species
+        names     - the names of the species
+        outputs   - a dictionary keyed by category (see nway_categories) of ascii
+                    file or file like objects or writer objects for outputs.
+                    Categories without an output are counted but not written.
+        min_score - the score that matches must exceed in order to be
+                    considered valid matches. Default = -inf
+        tag_func  - a TagProfile (see xenomapper.profiles) or a function
+                    that takes a list of sam fields and a tag identifier
+                    (at least 'AS' and 'XS') returns a numeric value for that tag
+    Returns:
+        category_counts - a dictionary keyed by category containing
+                    occurance counts
+    """
+    n = len(names)
+    categories = nway_categories(names)
+    outputs = outputs or {}
+    outfiles = [outputs.get(x) for x in categories]
+    scores = get_score_function(tag_func)
+
+    state_counts = Counter()
+    for lines in readsets:
+        state = get_nway_mapping_state([scores(x) for x in lines], min_score)
+        state_counts[state] += 1
+        if outfiles[state]:
+            _write_state(outfiles[state], state, [(x,) for x in lines], n)
+    return Counter({categories[state]:count for state, count in state_counts.items()})
+
+
+def nway_main_paired_end(readsets, names, outputs=None, min_score=float('-inf'), tag_func=get_tag, conservative=False):
+    """Main loop for processing paired end reads mapped to N species.
+    Pairs are assigned with the liberal rules of main_paired_end or the
+    conservative rules of conservative_main_paired_end (see get_nway_pair_state).
+    Paired end reads must be sequential in the sam or bam file,
+    occur only once and be in the same order in all files.
+    Arguments:
+        readsets  - an iterable of tuples of the equivalent read in each species
+        names     - the names of the species
+        outputs   - a dictionary keyed by category (see nway_categories) of ascii
+                    file or file like objects or writer objects for outputs
+        min_score - the score that matches must exceed in order to be
+                    considered valid matches. Default = -inf
+        tag_func  - a TagProfile or a tag function as for nway_main_single_end
+        conservative - Boolean flag for conservative pairing. Default = False
+    Returns:
+        category_counts - a dictionary keyed by a tuple of forward
+                    and reverse read category containing
+                    occurance counts
+    """
+    n = len(names)
+    categories = nway_categories(names)
+    outputs = outputs or {}
+    outfiles = [outputs.get(x) for x in categories]
+    scores = get_score_function(tag_func)
+
+    state_counts = Counter()
+    previous_lines = None
+    for lines in readsets:
+        #Test to see if lines are the pair of previous_lines - if not skip ahead to next readset
+        if not previous_lines or not previous_lines[0][0] == lines[0][0]:
+            previous_lines = lines
+            continue
+
+        forward_state = get_nway_mapping_state([scores(x) for x in previous_lines], min_score)
+        reverse_state = get_nway_mapping_state([scores(x) for x in lines], min_score)
+        state_counts[(forward_state, reverse_state)] += 1
+
+        state = get_nway_pair_state(forward_state, reverse_state, n, conservative)
+        if outfiles[state]:
+            _write_state(outfiles[state], state, list(zip(previous_lines, lines)), n)
+
+        previous_lines = lines
+
+    return Counter({(categories[forward], categories[reverse]):count
+                    for (forward, reverse), count in state_counts.items()})
+
+
+def write_count_matrix(category_counts, names, outfile=sys.stdout, paired=False):
+    """Write category counts as a tab separated table.
+    Paired end counts are written as a matrix with a row for each forward
+    read category and a column for each reverse read category.
+    Arguments:
+        category_counts - counts from nway_main_single_end or nway_main_paired_end
+        names    - the names of the species
+        outfile  - a text file or file like object. Default = sys.stdout
+        paired   - Boolean flag for paired end counts. Default = False
+    """
+    categories = nway_categories(names)
+    if paired:
+        print('forward\\reverse', *categories, sep='\t', file=outfile)
+        for forward in categories:
+            print(forward, *[category_counts.get((forward, reverse), 0) for reverse in categories],
+                  sep='\t', file=outfile)
+    else:
+        print('category', 'count', sep='\t', file=outfile)
+        for category in categories:
+            print(category, category_counts.get(category, 0), sep='\t', file=outfile)
+    pass
+
+
+def open_nway_outputs(names, headers, prefix, bam=False, executor=None, write_buffer=0, write_queue=4): #pragma: no cover
+    """Open an output file named prefix_category.sam (or .bam) for each
+    category and write the headers of each species.
+    If write_buffer (in bytes) is set each file is written by a BackgroundWriter.
+    Returns:
+        outputs - a dictionary of SamWriters or BamWriters keyed by category
+        files   - a list of the output files in the order they should be closed
+    """
+    categories = nway_categories(names)
+    n = len(names)
+    outputs = {}
+    files = []
+    for state, category in enumerate(categories):
+        outfile = open('{0}_{1}.{2}'.format(prefix, category, 'bam' if bam else 'sam'), 'wb')
+        if write_buffer:
+            buffered = BackgroundWriter(outfile, buffer_size=write_buffer, max_pending=write_queue)
+            files.extend([buffered, outfile])
+            outfile = buffered
+        else:
+            files.append(outfile)
+        outputs[category] = BamWriter(outfile, executor=executor) if bam else SamWriter(outfile)
+        if state < n:
+            header = add_pg_tag(headers[state], comment='species specific reads')
+        elif state < 2 * n:
+            header = add_pg_tag(headers[state - n], comment='species specific multimapping reads')
+        elif state == 2 * n: #This will not be the correct header - Look into merging headers
+            header = add_pg_tag(headers[0], comment='reads that could not be resolved')
+        else:
+            header = add_pg_tag(headers[0], comment='reads that could not be assigned')
+        write_header(outputs[category], header)
+    return outputs, files
+
+
+def run_nway(args): #pragma: no cover
+    """Classify the reads of the input files in args, write the outputs
+    and count matrix and print a summary of the category counts to stderr.
+    args is an argparse namespace with the options of command_line_interface
+    Returns:
+        category_counts - the category counts of the main loop function
+    """
+    tag_func = get_tag_profile(args)
+    executor = None
+    if args.io_threads > 1:
+        executor = ThreadPoolExecutor(max_workers=args.io_threads)
+    if args.sam:
+        samfiles = [open_sam(x, executor=executor) for x in args.sam]
+        headers = [get_sam_header(x) for x in samfiles]
+        inputs = [sam_lines(x) for x in samfiles]
+    else:
+        inputs = [BamReader(x, executor=executor) for x in args.bam]
+        headers = [get_bam_header(x) for x in inputs]
+
+    outputs, files = {}, []
+    if args.output_prefix:
+        outputs, files = open_nway_outputs(args.names, headers, args.output_prefix, bam=args.bam_output,
+                                           executor=executor, write_buffer=int(args.write_buffer * 2**20),
+                                           write_queue=args.write_queue)
+
+    readsets = getReadSets(inputs, skip_repeated_reads=not args.paired)
+    if args.paired:
+        category_counts = nway_main_paired_end(readsets, args.names, outputs=outputs, min_score=args.min_score,
+                                               tag_func=tag_func, conservative=args.conservative)
+    else:
+        category_counts = nway_main_single_end(readsets, args.names, outputs=outputs, min_score=args.min_score,
+                                               tag_func=tag_func)
+
+    for outfile in outputs.values():
+        outfile.close()
+    for outfile in files:
+        outfile.close()
+    if executor:
+        executor.shutdown()
+    if args.count_matrix:
+        write_count_matrix(category_counts, args.names, outfile=args.count_matrix, paired=args.paired)
+        args.count_matrix.close()
+    output_summary(category_counts=category_counts)
+    if args.cigar_scores:
+        output_cigar_cache_summary(tag_func.scorer)
+    return category_counts
+
+
+def command_line_interface(argv=None): #pragma: no cover
+    parser = argparse.ArgumentParser(prog = "xenomapper nway",
+                    formatter_class=argparse.RawDescriptionHelpFormatter,
+                    description=textwrap.dedent("""\
+                    Classify reads aligned to more than two species in a single pass.
+
+                    Each read (or read pair) is assigned to the species with the best
+                    unique score (SPECIES_specific), the species with the best score
+                    where the read multimaps (SPECIES_multi), unresolved where more
+                    than one species has the best score, or unassigned.
+
+                    Reads must be in the same order in all input files.
+                    """),
+                    epilog = textwrap.dedent("""\
+                    Example:
+                        xenomapper nway --paired --sam human.sam mouse.sam virus.sam \\
+                            --names human mouse virus --output_prefix sample \\
+                            --count_matrix sample_counts.tsv
+                    """),
+                    )
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument('--sam',
+                        type=argparse.FileType('rb'),
+                        nargs='+',
+                        default=None,
+                        help='SAM format mapping output files for each species')
+    inputs.add_argument('--bam',
+                        type=argparse.FileType('rb'),
+                        nargs='+',
+                        default=None,
+                        help='BAM format mapping output files for each species')
+    parser.add_argument('--names',
+                        nargs='+',
+                        default=None,
+                        help='a name for each species used in category names. Default is the input file names')
+    parser.add_argument('--output_prefix',
+                        default=None,
+                        help='write reads to files named PREFIX_CATEGORY.sam (or .bam) for every category')
+    parser.add_argument('--count_matrix',
+                        type=argparse.FileType('w'),
+                        default=None,
+                        help='a file for a tab separated table of counts of forward (rows) and reverse (columns) read categories')
+    add_classification_arguments(parser)
+    add_format_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.pair_policy:
+        parser.error('--pair_policy is not supported by xenomapper nway')
+    if args.fastq_output:
+        parser.error('--fastq_output is not supported by xenomapper nway')
+    files = args.sam or args.bam
+    if len(files) < 2:
+        parser.error('at least two input files are required')
+    if args.names is None:
+        args.names = [os.path.splitext(os.path.basename(x.name))[0] for x in files]
+    if len(args.names) != len(files) or len(set(args.names)) != len(args.names):
+        parser.error('--names must give a different name for each input file')
+    return args
+
+
+def main(argv=None): #pragma: no cover
+    args = command_line_interface(argv)
+    run_nway(args)
+    pass
+
+
+if __name__ == '__main__': #pragma: no cover
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+parallel.py
+
+Multi-core classification of read pairs for xenomapper.
+
+Read pairs are collected into batches that are classified in a pool of
+worker processes by the same main loop functions used for single threaded
+processing.  Workers return the batch positions of the reads assigned to
+each output category rather than the reads themselves, and the reads are
+written in the original input order as batches complete.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from xenomapper.writers import OUTPUT_CATEGORIES, write_read
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+
+def batch_readpairs(readpairs, batch_size=10000, paired=False):
+    """Collect read pairs into lists for batch processing
+    Arguments:
+        readpairs  - an iterable of tuples of lists of sam fields
+        batch_size - the number of read pairs in each batch.
+        paired     - if True batches are extended so that consecutive
+                     reads with the same name (the forward and reverse
+                     reads of a pair) are never split between batches
+    Yields:
+        lists of read pairs
+    """
+    batch = []
+    for readpair in readpairs:
+        if len(batch) >= batch_size and \
+                (not paired or readpair[0][0] != batch[-1][0][0]):
+            yield batch
+            batch = []
+        batch.append(readpair)
+    if batch:
+        yield batch
+
+
+class _PositionCollector(object):
+    """Writer object that records the batch position of each read written.
+    Positions are encoded as 2 * index + 0 for primary or 1 for secondary"""
+    def __init__(self, positions):
+        self.positions = positions
+        self.written = []
+        pass
+
+    def write_read(self, line):
+        self.written.append(self.positions[id(line)])
+        pass
+
+
+def classify_batch(main_function, batch, categories, min_score=float('-inf'), tag_func=None):
+    """Classify a batch of read pairs with a main loop function
+    Arguments:
+        main_function - main_single_end, main_paired_end or
+                        conservative_main_paired_end
+        batch         - a list of tuples of lists of sam fields
+        categories    - the output categories to report positions for
+        min_score, tag_func - as for main_function. If tag_func is None
+                        the main_function default is used
+    Returns:
+        category_counts - the counts returned by main_function
+        written         - a dictionary keyed by category of lists of
+                          positions (2 * batch index + 0 for primary and
+                          1 for secondary) of reads written to that category
+    """
+    positions = {}
+    for i, (line1, line2) in enumerate(batch):
+        positions[id(line1)] = 2 * i
+        positions[id(line2)] = 2 * i + 1
+    collectors = {category:_PositionCollector(positions) for category in categories}
+    kwargs = {category:collectors.get(category) for category in OUTPUT_CATEGORIES}
+    if tag_func:
+        kwargs['tag_func'] = tag_func
+    category_counts = main_function(batch, min_score=min_score, **kwargs)
+    return category_counts, {category:collectors[category].written for category in categories}
+
+
+def parallel_main(main_function, readpairs,
+                  threads=2,
+                  batch_size=10000,
+                  paired=False,
+                  primary_specific=sys.stdout,
+                  secondary_specific=None,
+                  primary_multi=None,
+                  secondary_multi=None,
+                  unassigned=None,
+                  unresolved=None,
+                  min_score=float('-inf'),
+                  tag_func=None):
+    """Run a main loop function over batches of read pairs in a pool
+    of worker processes, writing output in the original input order.
+    Arguments:
+        main_function - main_single_end, main_paired_end or
+                        conservative_main_paired_end
+        readpairs     - an iterable of tuples of lists of sam fields
+        threads       - the number of worker processes
+        batch_size    - the number of read pairs in each batch
+        paired        - True for paired end main loop functions so that
+                        read pairs are not split between batches
+        primary_specific, secondary_specific, primary_multi,
+        secondary_multi, unassigned, unresolved
+                      - ascii file or file like objects or writer objects
+                        (such as a BamWriter) for outputs
+        min_score, tag_func - as for main_function. tag_func must be
+                        a module level function that can be pickled.
+    Returns:
+        category_counts - the merged category counts of all batches
+    """
+    outputs = {category:outfile for category, outfile in
+                    zip(OUTPUT_CATEGORIES, (primary_specific, secondary_specific, primary_multi,
+                                            secondary_multi, unassigned, unresolved))
+                    if outfile}
+    categories = list(outputs)
+    category_counts = Counter()
+
+    def write_batch(batch, future):
+        batch_counts, written = future.result()
+        category_counts.update(batch_counts)
+        for category in categories:
+            outfile = outputs[category]
+            for position in written[category]:
+                write_read(outfile, batch[position >> 1][position & 1])
+        pass
+
+    with ProcessPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        for batch in batch_readpairs(readpairs, batch_size=batch_size, paired=paired):
+            pending.append((batch, executor.submit(classify_batch, main_function, batch,
+                                                   categories, min_score, tag_func)))
+            while len(pending) > 2 * threads:
+                write_batch(*pending.popleft())
+        while pending:
+            write_batch(*pending.popleft())
+    return category_counts
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+pipeline.py
+
+Run the primary and secondary species alignments and classify the reads
+as they are produced.
+
+The two aligner command lines are started concurrently and their SAM
+output is read directly from their stdout pipes by the same machinery
+used for SAM files, so intermediate alignment files are never written.
+The stderr of each aligner is forwarded with a prefix identifying the
+species and the exit status of both aligners is checked when
+classification is complete.
+
+Usage:
+    xenomapper pipeline --primary_command 'bowtie2 -x human -U reads.fq' \\
+                        --secondary_command 'bowtie2 -x mouse -U reads.fq'
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+import argparse, textwrap
+import shlex
+import subprocess
+import threading
+from collections import deque
+from xenomapper.xenomapper import add_output_arguments, add_processing_arguments, run_xenomapper
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+
+class AlignerError(RuntimeError):
+    """An aligner failed or its output could not be classified"""
+    pass
+
+
+class AlignerProcess(object):
+    """An aligner running in a subprocess and writing SAM format to stdout
+    Arguments:
+        command - the aligner command line as a string (split with shlex)
+                  or a list of arguments
+        name    - a name for the aligner used to prefix its stderr
+        log     - a text file or file like object that the aligner stderr
+                  is forwarded to, or None to discard. Default = sys.stderr
+        tail    - the number of lines of stderr kept for error reports
+    Attributes:
+        stdout  - the binary stdout pipe of the aligner
+    """
+    def __init__(self, command, name, log=sys.stderr, tail=20):
+        self.command = command
+        self.name = name
+        if isinstance(command, str):
+            command = shlex.split(command)
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.stdout = self.process.stdout
+        self.stderr_tail = deque(maxlen=tail)
+        self._stderr_thread = threading.Thread(target=self._supervise_stderr, args=(log,), daemon=True)
+        self._stderr_thread.start()
+        pass
+
+    def _supervise_stderr(self, log):
+        for line in self.process.stderr:
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            self.stderr_tail.append(line)
+            if log:
+                print('[{0}] {1}'.format(self.name, line), file=log, flush=True)
+        pass
+
+    def failed(self, timeout=0):
+        """Return True if the aligner exits with a non zero status within timeout seconds"""
+        try:
+            return self.process.wait(timeout=timeout) != 0
+        except subprocess.TimeoutExpired:
+            return False
+
+    def error_message(self):
+        """Return a description of the aligner exit status and the end of its stderr"""
+        return '{0} aligner {1!r} exited with status {2}\n{3}'.format(self.name, self.command,
+                                    self.process.returncode, '\n'.join(self.stderr_tail)).rstrip('\n')
+
+    def stop(self):
+        """Stop the aligner if it is running and wait for it to exit"""
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.stdout.close()
+        self.process.wait()
+        self._stderr_thread.join()
+        pass
+
+
+def run_pipeline(args, log=sys.stderr):
+    """Run the aligner commands in args and classify their output with
+    run_xenomapper
+    Arguments:
+        args - an argparse namespace with the options of command_line_interface
+        log  - the file that aligner stderr is forwarded to. Default = sys.stderr
+    Returns:
+        category_counts - the category counts of the main loop function
+    Raises:
+        AlignerError if either aligner fails
+    """
+    aligners = [AlignerProcess(args.primary_command, 'primary', log=log)]
+    try:
+        aligners.append(AlignerProcess(args.secondary_command, 'secondary', log=log))
+        args.primary_sam = aligners[0].stdout
+        args.secondary_sam = aligners[1].stdout
+        args.primary_bam = args.secondary_bam = None
+        category_counts = run_xenomapper(args)
+    except Exception as error:
+        #an aligner that failed will usually be the cause of errors reading its output
+        failed = [aligner for aligner in aligners if aligner.failed(timeout=1)]
+        for aligner in aligners:
+            aligner.stop()
+        if failed:
+            raise AlignerError(failed[0].error_message()) from error
+        raise
+    #aligners with unread output are stopped and so will not exit successfully
+    unread = [aligner for aligner in aligners if aligner.stdout.read(1)]
+    for aligner in aligners:
+        aligner.stop()
+    for aligner in aligners:
+        if aligner not in unread and aligner.process.returncode != 0:
+            raise AlignerError(aligner.error_message())
+    if unread:
+        raise AlignerError('{0} aligner {1!r} produced reads that were not matched by the other aligner'.format(
+                                                                            unread[0].name, unread[0].command))
+    return category_counts
+
+
+def command_line_interface(argv=None): #pragma: no cover
+    parser = argparse.ArgumentParser(prog = "xenomapper pipeline",
+                    formatter_class=argparse.RawDescriptionHelpFormatter,
+                    description=textwrap.dedent("""\
+                    Run the alignments of reads to the primary and secondary species
+                    and classify the reads as the alignments are produced.
+
+                    Each aligner command must write SAM format to stdout and the
+                    reads must be in the same order in both species.  When using
+                    Bowtie2 with the -p option you must also use --reorder.
+
+                    The stderr of each aligner is forwarded with a [primary] or
+                    [secondary] prefix.  If either aligner fails xenomapper exits
+                    with an error.
+                    """),
+                    epilog = textwrap.dedent("""\
+                    Example:
+                        xenomapper pipeline --paired \\
+                            --primary_command 'bowtie2 --reorder -p 8 -x human -1 r1.fq -2 r2.fq' \\
+                            --secondary_command 'bowtie2 --reorder -p 8 -x mouse -1 r1.fq -2 r2.fq' \\
+                            --primary_specific human_specific.sam
+                    """),
+                    )
+    parser.add_argument('--primary_command',
+                        required=True,
+                        help='the aligner command line for the primary species of interest')
+    parser.add_argument('--secondary_command',
+                        required=True,
+                        help='the aligner command line for the secondary or contaminating species')
+    parser.add_argument('--aligner_log',
+                        type=argparse.FileType('w'),
+                        default=sys.stderr,
+                        help='a file for the stderr output of the aligners. Default = stderr')
+    add_output_arguments(parser)
+    add_processing_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None): #pragma: no cover
+    args = command_line_interface(argv)
+    try:
+        run_pipeline(args, log=args.aligner_log)
+    except AlignerError as error:
+        print('ERROR: {0}'.format(error), file=sys.stderr)
+        sys.exit(1)
+    pass
+
+
+if __name__ == '__main__': #pragma: no cover
+    main()
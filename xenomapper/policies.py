@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+policies.py
+
+Table driven pairing policies for paired end reads in xenomapper.
+
+The six mapping states of get_mapping_state are encoded as small
+integers that index MAPPING_STATES.  A PairPolicy holds a table of 36
+entries, indexed by 6 * forward state + reverse state, giving the output
+category of a read pair (or DISCARD).  Assigning a pair is a single table
+lookup, so every policy has the same per read cost and all policies share
+one classification loop (policy_main_paired_end).
+
+Policies are written as rules, one per line, of a forward state, a
+reverse state and the output category of pairs with those states:
+
+    # forward          reverse            output
+    unassigned         *                  unassigned
+    *                  unassigned         unassigned
+    primary_specific   secondary_multi    unresolved
+    primary_specific,primary_multi  *     primary_specific
+    *                  *                  discard
+
+A state of * matches any state and several states can be separated by
+commas.  The first rule that matches a pair is used and every
+combination of states must be matched by a rule.  An output of discard
+counts the pair without writing it to any output.  The built in liberal
+and conservative policies (LIBERAL_RULES and CONSERVATIVE_RULES) are
+written in the same format.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+from collections import Counter
+from xenomapper.writers import OUTPUT_CATEGORIES
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+#Integer state codes are indexes into MAPPING_STATES
+MAPPING_STATES = OUTPUT_CATEGORIES
+PRIMARY_SPECIFIC, SECONDARY_SPECIFIC, PRIMARY_MULTI, SECONDARY_MULTI, UNASSIGNED, UNRESOLVED = range(len(MAPPING_STATES))
+STATE_CODES = {state:i for i,state in enumerate(MAPPING_STATES)}
+
+#The output of pairs that are counted but not written
+DISCARD = -1
+
+#Reads written to each output category: the primary reads, the secondary reads or both
+PRIMARY_READS, SECONDARY_READS, BOTH_READS = range(3)
+WRITTEN_READS = (PRIMARY_READS, SECONDARY_READS, PRIMARY_READS, SECONDARY_READS, PRIMARY_READS, BOTH_READS)
+
+LIBERAL_RULES = """\
+# Discordant pairs are assigned to the highest priority category of either read
+# forward           reverse             output
+primary_specific    *                   primary_specific
+*                   primary_specific    primary_specific
+secondary_specific  *                   secondary_specific
+*                   secondary_specific  secondary_specific
+primary_multi       *                   primary_multi
+*                   primary_multi       primary_multi
+secondary_multi     *                   secondary_multi
+*                   secondary_multi     secondary_multi
+unresolved          *                   unresolved
+*                   unresolved          unresolved
+unassigned          unassigned          unassigned
+"""
+
+CONSERVATIVE_RULES = """\
+# Pairs with an unassigned read are unassigned, pairs discordant for species are unresolved
+# forward                         reverse                           output
+unassigned                        *                                 unassigned
+*                                 unassigned                        unassigned
+unresolved                        *                                 unresolved
+*                                 unresolved                        unresolved
+primary_specific,primary_multi    secondary_specific,secondary_multi  unresolved
+secondary_specific,secondary_multi  primary_specific,primary_multi    unresolved
+primary_specific                  *                                 primary_specific
+*                                 primary_specific                  primary_specific
+secondary_specific                *                                 secondary_specific
+*                                 secondary_specific                secondary_specific
+primary_multi                     *                                 primary_multi
+secondary_multi                   *                                 secondary_multi
+"""
+
+
+def _parse_states(field, line_number):
+    """Return the state codes matched by a comma separated field of a rule"""
+    if field == '*':
+        return range(len(MAPPING_STATES))
+    codes = []
+    for state in field.split(','):
+        if state not in STATE_CODES:
+            raise ValueError('Unknown mapping state {0!r} on line {1} of pair policy'.format(state, line_number))
+        codes.append(STATE_CODES[state])
+    return codes
+
+
+class PairPolicy(object):
+    """A pairing policy assigning read pairs to an output category from
+    the mapping states of the forward and reverse reads.
+    Arguments:
+        name  - a name for the policy used in messages and checkpoints
+        table - a sequence of 36 output state codes (or DISCARD) indexed
+                by 6 * forward state code + reverse state code
+    """
+    def __init__(self, name, table):
+        if len(table) != len(MAPPING_STATES) ** 2:
+            raise ValueError('A pair policy table must have {0} entries'.format(len(MAPPING_STATES) ** 2))
+        if [x for x in table if x != DISCARD and x not in range(len(MAPPING_STATES))]:
+            raise ValueError('Pair policy table entries must be output state codes or DISCARD')
+        self.name = name
+        self.table = tuple(table)
+        pass
+
+    @classmethod
+    def parse(cls, lines, name='custom'):
+        """Create a policy from rules of a forward state, reverse state and output.
+        Arguments:
+            lines - an iterable of rule lines (eg an open file)
+            name  - a name for the policy. Default 'custom'
+        Raises a ValueError if a rule is malformed or a combination of
+        states is not matched by any rule."""
+        n = len(MAPPING_STATES)
+        table = [None] * n * n
+        for line_number, line in enumerate(lines, start=1):
+            fields = line.split('#')[0].split()
+            if not fields:
+                continue
+            if len(fields) != 3:
+                raise ValueError('Line {0} of pair policy is not a forward state, reverse state and output: {1!r}'.format(
+                                 line_number, line.rstrip()))
+            forward, reverse, output = fields
+            if output == 'discard':
+                output = DISCARD
+            elif output in STATE_CODES:
+                output = STATE_CODES[output]
+            else:
+                raise ValueError('Unknown output {0!r} on line {1} of pair policy'.format(output, line_number))
+            for f in _parse_states(forward, line_number):
+                for r in _parse_states(reverse, line_number):
+                    if table[f * n + r] is None: #the first matching rule is used
+                        table[f * n + r] = output
+        missing = [(MAPPING_STATES[i // n], MAPPING_STATES[i % n]) for i,x in enumerate(table) if x is None]
+        if missing:
+            raise ValueError('Pair policy has no rule for {0} pairs of states including {1} {2}'.format(
+                             len(missing), *missing[0]))
+        return cls(name, table)
+
+    @classmethod
+    def load(cls, filename):
+        """Create a policy from a file of rules named after the file"""
+        with open(filename) as f:
+            return cls.parse(f, name=filename)
+
+    def output_state(self, forward_state, reverse_state):
+        """Return the output category name (or 'discard') of a pair of state names"""
+        output = self.table[STATE_CODES[forward_state] * len(MAPPING_STATES) + STATE_CODES[reverse_state]]
+        return 'discard' if output == DISCARD else MAPPING_STATES[output]
+
+    def actions(self, outputs):
+        """Return a list indexed like the table of tuples of the writer
+        and the reads written (PRIMARY_READS, SECONDARY_READS or
+        BOTH_READS) for each pair of states.
+        Arguments:
+            outputs - a sequence of writers (or None) in the order of MAPPING_STATES
+        The writer is None for discarded pairs and categories without an output."""
+        return [(None, None) if x == DISCARD else (outputs[x], WRITTEN_READS[x]) for x in self.table]
+
+    def rules(self):
+        """Return the policy as rule text that parse accepts"""
+        n = len(MAPPING_STATES)
+        return ''.join('{0:20}{1:20}{2}\n'.format(MAPPING_STATES[i // n], MAPPING_STATES[i % n],
+                                                  'discard' if x == DISCARD else MAPPING_STATES[x])
+                       for i,x in enumerate(self.table))
+
+    def __eq__(self, other):
+        return isinstance(other, PairPolicy) and self.table == other.table
+
+    def __hash__(self):
+        return hash(self.table)
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, self.name)
+
+
+def pair_counts(counts):
+    """Return a Counter keyed by tuples of forward and reverse state names
+    from a sequence of counts indexed like the table of a PairPolicy"""
+    n = len(MAPPING_STATES)
+    return Counter({(MAPPING_STATES[i // n], MAPPING_STATES[i % n]):x for i,x in enumerate(counts) if x})
+
+
+LIBERAL = PairPolicy.parse(LIBERAL_RULES.splitlines(), name='liberal')
+CONSERVATIVE = PairPolicy.parse(CONSERVATIVE_RULES.splitlines(), name='conservative')
+
+POLICIES = {'liberal':LIBERAL, 'conservative':CONSERVATIVE}
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+profiles.py
+
+Aligner tag profiles for extracting alignment scores in xenomapper.
+
+A profile describes which optional SAM tags hold the score of the best
+alignment (AS) and of the next best alignment (XS) for an aligner.
+The scores(line) method of a profile returns both scores from a single
+pass over the optional fields of a read using exact tag name matching,
+and returns -inf for both without parsing any tags if the read is
+unmapped (FLAG 0x4).  The scores of SamLine and BamRecord reads are kept
+on the read, so the tags of each read are parsed once per profile.
+
+Profiles are provided for bowtie2, HISAT (which stores the next best
+score in ZS) and for aligners without an AS tag (scores calculated from
+the cigar line and NM tag by a CigarScorer, which caches the penalties
+of recently seen cigar strings).  Profiles for other aligners can be created
+with TagProfile(score_tag, other_tag).  Profiles can also be called as
+tag_func(sam_line, tag) for compatibility with get_tag.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+from collections import OrderedDict
+from xenomapper.sam import SamLine
+from xenomapper.bam import BamRecord
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+UNMAPPED = 0x4
+
+_NUMERIC_TYPES = (':i:', ':f:')
+_DIGITS = {str(x):x for x in range(10)}
+
+
+def parse_cigar(cigar):
+    """Return a tuple of the number of insertions and deletions, their
+    total length and the number of softclipped bases in a cigar string.
+    Operations other than I, D and S (and a cigar of *) are ignored."""
+    gaps = gap_length = softclipped = 0
+    length = 0
+    for char in cigar:
+        digit = _DIGITS.get(char)
+        if digit is not None:
+            length = length * 10 + digit
+            continue
+        if char == 'I' or char == 'D':
+            gaps += 1
+            gap_length += length
+        elif char == 'S':
+            softclipped += length
+        length = 0
+    return gaps, gap_length, softclipped
+
+
+def cigar_score(cigar, mismatches):
+    """Return a score equivalent to a rescaled AS tag from a cigar string
+    and the number of mismatches (the NM tag).
+    Score is rescaled such that a perfect match for the full
+    length of the read acchieves a score of 0.0.
+    Penalties are: mismatch -6, gap open -5, gap extend -3,
+                   softclipped -2 (equiv to +2 match rescaled)
+    """
+    gaps, gap_length, softclipped = parse_cigar(cigar)
+    return (-6 * mismatches) + (-5 * gaps) + (-3 * gap_length) + (-2 * softclipped)
+
+
+class CigarScorer(object):
+    """Calculates cigar based scores as for cigar_score with configurable
+    penalties.  The gap open, gap extend and softclip penalty components of
+    each cigar string are kept in a least recently used cache of at most
+    cache_size cigar strings, and cache hits and misses are counted.
+    Arguments:
+        mismatch, gap_open, gap_extend, softclip - penalties (as negative
+                     numbers) for each mismatch, insertion or deletion,
+                     inserted or deleted base and softclipped base
+        cache_size - the maximum number of cigar strings cached. Default 4096
+    """
+    def __init__(self, mismatch=-6, gap_open=-5, gap_extend=-3, softclip=-2, cache_size=4096):
+        self.mismatch = mismatch
+        self.gap_open = gap_open
+        self.gap_extend = gap_extend
+        self.softclip = softclip
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        pass
+
+    def components(self, cigar):
+        """Return a tuple of the gap open, gap extend and softclip penalties of a cigar string"""
+        cache = self._cache
+        try:
+            value = cache[cigar]
+        except KeyError:
+            self.misses += 1
+            gaps, gap_length, softclipped = parse_cigar(cigar)
+            value = (self.gap_open * gaps, self.gap_extend * gap_length, self.softclip * softclipped)
+            cache[cigar] = value
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+            return value
+        self.hits += 1
+        cache.move_to_end(cigar)
+        return value
+
+    def score(self, cigar, mismatches):
+        """Return the score of an alignment from its cigar string and number of mismatches"""
+        gap_open, gap_extend, softclip = self.components(cigar)
+        return self.mismatch * mismatches + gap_open + gap_extend + softclip
+
+    def __repr__(self):
+        return '{0}({1!r}, {2!r}, {3!r}, {4!r})'.format(type(self).__name__, self.mismatch,
+                                                      self.gap_open, self.gap_extend, self.softclip)
+
+
+def _flag(sam_line):
+    """Return the integer flag of a read, or 0 if a list of sam fields has no valid flag"""
+    if isinstance(sam_line, (SamLine, BamRecord)):
+        return sam_line.flag
+    try:
+        return int(sam_line[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def get_tags(sam_line, tags):
+    """Return a dictionary of float values for the numeric tags in tags
+    present in a read, extracted in a single pass with exact tag name matching
+    Arguments:
+        sam_line  - list of elements from a SAM file line or a SamLine
+                    or BamRecord
+        tags      - a collection of tag names
+    """
+    if isinstance(sam_line, (SamLine, BamRecord)):
+        return sam_line.get_tags(tags)
+    values = {}
+    for field in sam_line[11:]:
+        tag = field[:2]
+        if tag in tags and field[2:5] in _NUMERIC_TYPES:
+            if tag in values:
+                raise ValueError('SAM line has multiple values of {0}: {1}'.format(tag,sam_line)) #pragma: no cover
+            values[tag] = float(field[5:])
+    return values
+
+
+class TagProfile(object):
+    """Score extraction for an aligner that stores the score of the best
+    alignment and of the next best alignment in optional tags.
+    Arguments:
+        score_tag - the tag holding the score of the best alignment. Default AS
+        other_tag - the tag holding the score of the next best alignment. Default XS
+    """
+    def __init__(self, score_tag='AS', other_tag='XS'):
+        self.score_tag = score_tag
+        self.other_tag = other_tag
+        self.tags = frozenset((score_tag, other_tag))
+        pass
+
+    def scores(self, sam_line):
+        """Return a tuple of the best and next best scores of a read as floats.
+        Missing scores and the scores of unmapped reads are -inf.
+        The scores of SamLine and BamRecord reads are kept on the read, so
+        later calls with the same read and profile do not parse the tags again."""
+        try:
+            if sam_line._profile is self:
+                return sam_line._scores
+        except AttributeError: #a list of sam fields
+            return self.extract_scores(sam_line)
+        scores = sam_line._scores = self.extract_scores(sam_line)
+        sam_line._profile = self
+        return scores
+
+    def extract_scores(self, sam_line):
+        """Return a tuple of the best and next best scores of a read
+        extracted from its tags without using the scores kept on the read"""
+        if _flag(sam_line) & UNMAPPED:
+            return (float('-inf'), float('-inf'))
+        values = get_tags(sam_line, self.tags)
+        return (values.get(self.score_tag, float('-inf')), values.get(self.other_tag, float('-inf')))
+
+    def __call__(self, sam_line, tag='AS'):
+        """Return the score for an AS or XS tag or the value of any other tag
+        so a profile can be used as the tag_func of the main loop functions"""
+        if tag == 'AS':
+            return self.scores(sam_line)[0]
+        elif tag == 'XS':
+            return self.scores(sam_line)[1]
+        return get_tags(sam_line, (tag,)).get(tag, float('-inf'))
+
+    def __repr__(self):
+        return '{0}({1!r}, {2!r})'.format(type(self).__name__, self.score_tag, self.other_tag)
+
+
+class CigarProfile(TagProfile):
+    """Score extraction for aligners that do not support the AS tag.
+    The best score is calculated from the cigar line and the number of
+    mismatches in the NM tag by a CigarScorer.  Reads without an NM tag
+    (multimappers with some aligners) have a score of -inf.
+    Arguments:
+        other_tag - the tag holding the score of the next best alignment. Default XS
+        scorer    - a CigarScorer. Default CigarScorer() with the penalties
+                    of cigar_score
+    """
+    def __init__(self, other_tag='XS', scorer=None):
+        TagProfile.__init__(self, 'NM', other_tag)
+        self.scorer = scorer if scorer is not None else CigarScorer()
+        pass
+
+    def extract_scores(self, sam_line):
+        if _flag(sam_line) & UNMAPPED:
+            return (float('-inf'), float('-inf'))
+        values = get_tags(sam_line, self.tags)
+        other = values.get(self.other_tag, float('-inf'))
+        if 'NM' not in values:
+            return (float('-inf'), other) #either a multimapper or unmapped
+        cigar = sam_line.cigar if isinstance(sam_line, (SamLine, BamRecord)) else sam_line[5]
+        return (self.scorer.score(cigar, int(values['NM'])), other)
+
+    def __repr__(self):
+        return '{0}({1!r}, scorer={2!r})'.format(type(self).__name__, self.other_tag, self.scorer)
+
+
+BOWTIE2 = TagProfile('AS', 'XS')
+HISAT = TagProfile('AS', 'ZS')
+CIGAR = CigarProfile('XS')
+
+PROFILES = {'bowtie2':BOWTIE2, 'hisat':HISAT, 'cigar':CIGAR}
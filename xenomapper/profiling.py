@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+profiling.py
+
+Profiling of xenomapper and xenomappability runs with the --profile option.
+
+The run is profiled with cProfile and the peak memory allocated by Python
+is tracked with tracemalloc.  A JSON report of the functions with the most
+cumulative time, the peak memory and the largest allocation sites is
+written to a file and a compact table is printed to stderr.  Functions are
+identified by file and function name without line numbers, so reports from
+different releases can be compared with:
+
+    xenomapper compare_profiles old_profile.json new_profile.json
+
+Only the main process is profiled.  Work done in the worker processes of
+--threads is not included in the report.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+import os
+import json
+import time
+import platform
+import argparse, textwrap
+import cProfile
+import pstats
+import tracemalloc
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+REPORT_FORMAT = 1
+
+
+def function_name(filename, funcname):
+    """Return a name for a profiled function that does not depend on line
+    numbers or the installation directory, eg xenomapper/sam.py:get_tags"""
+    if filename == '~': #built in functions
+        return funcname
+    parts = os.path.normpath(filename).split(os.sep)
+    directories = parts[:-1]
+    if 'xenomapper' in directories:
+        index = len(directories) - 1 - directories[::-1].index('xenomapper')
+        return '{0}:{1}'.format('/'.join(parts[index:]), funcname)
+    return '{0}:{1}'.format(parts[-1], funcname)
+
+
+def function_stats(profiler):
+    """Return a list of dictionaries of the calls and times of each function
+    of a cProfile.Profile, sorted by cumulative time.  Functions with the same
+    name (eg in different classes of a file) are combined."""
+    stats = pstats.Stats(profiler).stats
+    functions = {}
+    for (filename, lineno, funcname), (primitive_calls, calls, tottime, cumtime, callers) in stats.items():
+        name = function_name(filename, funcname)
+        row = functions.setdefault(name, {'function':name, 'calls':0, 'tottime':0.0, 'cumtime':0.0})
+        row['calls'] += calls
+        row['tottime'] += tottime
+        row['cumtime'] += cumtime
+    rows = sorted(functions.values(), key=lambda x: (-x['cumtime'], x['function']))
+    for row in rows:
+        row['tottime'] = round(row['tottime'], 6)
+        row['cumtime'] = round(row['cumtime'], 6)
+    return rows
+
+
+def allocation_stats(snapshot, top=10):
+    """Return a list of dictionaries of the size and number of the memory
+    blocks allocated at the largest allocation sites of a tracemalloc snapshot"""
+    rows = []
+    for stat in snapshot.statistics('lineno')[:top]:
+        frame = stat.traceback[0]
+        rows.append({'location':'{0}:{1}'.format(function_name(frame.filename, '').rstrip(':'), frame.lineno),
+                     'size':stat.size,
+                     'count':stat.count})
+    return rows
+
+
+def profile_call(function, *args, program='xenomapper', report_file=None, top=30, outfile=sys.stderr, **kw):
+    """Call a function under cProfile and tracemalloc and report the
+    functions with the most cumulative time and the peak memory
+    Arguments:
+        function    - the function to profile, eg run_xenomapper
+        args, kw    - the arguments of function
+        program     - the program name recorded in the report
+        report_file - a file name for the JSON report. Default no report file
+        top         - the number of functions in the report. Default 30
+        outfile     - a text file for the summary table. Default sys.stderr
+    Returns:
+        the return value of function
+    """
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        result = profiler.runcall(function, *args, **kw)
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+    report = {'format':REPORT_FORMAT,
+              'program':program,
+              'version':__version__,
+              'python':platform.python_version(),
+              'platform':platform.platform(),
+              'argv':sys.argv[1:],
+              'wall_seconds':round(wall, 3),
+              'cpu_seconds':round(cpu, 3),
+              'peak_memory':peak,
+              'memory_at_exit':current,
+              'functions':function_stats(profiler)[:top],
+              'allocations_at_exit':allocation_stats(snapshot),
+              }
+    if report_file:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=1)
+    output_profile(report, outfile=outfile)
+    return result
+
+
+def output_profile(report, outfile=sys.stderr):
+    """Print the functions and peak memory of a profile report"""
+    print('-'*80, file=outfile)
+    print('Profile of {0} {1} ({2:.1f}s wall, {3:.1f}s cpu, {4:.1f} MB peak memory)\n'.format(
+          report['program'], report['version'], report['wall_seconds'], report['cpu_seconds'],
+          report['peak_memory'] / 2**20), file=outfile)
+    print('|       {0:55s}|  {1:>10s}  |  {2:>9s}  |  {3:>9s}  |'.format('Function','Calls','Total s','Cumul s'),
+          file=outfile)
+    print('|:','-'*60,':|:','-'*12,':|:','-'*11,':|:','-'*11,':|',sep='', file=outfile)
+    for row in report['functions']:
+        print('|  {0:60s}|  {1:10d}  |  {2:9.3f}  |  {3:9.3f}  |'.format(row['function'][-60:], row['calls'],
+              row['tottime'], row['cumtime']), file=outfile)
+    print(file=outfile)
+    pass
+
+
+def compare_reports(old, new):
+    """Compare two profile reports
+    Arguments:
+        old, new - profile reports as dictionaries (eg loaded from JSON)
+    Returns:
+        a list of tuples of function name, old cumulative time and new
+        cumulative time (None if not in a report), sorted by the largest
+        change in time first
+    """
+    old_times = {x['function']:x['cumtime'] for x in old['functions']}
+    new_times = {x['function']:x['cumtime'] for x in new['functions']}
+    rows = [(name, old_times.get(name), new_times.get(name)) for name in set(old_times) | set(new_times)]
+    return sorted(rows, key=lambda x: (-abs((x[2] or 0.0) - (x[1] or 0.0)), x[0]))
+
+
+def output_comparison(old, new, outfile=sys.stdout):
+    """Print a table comparing the time and memory of two profile reports"""
+    def change(a, b):
+        return '{0:+.1%}'.format((b - a) / a) if a and b is not None else ''
+    print('{0:58s} {1:>12s} {2:>12s} {3:>9s}'.format('', old['version'], new['version'], 'change'), file=outfile)
+    for key in ('wall_seconds', 'cpu_seconds'):
+        print('{0:58s} {1:12.3f} {2:12.3f} {3:>9s}'.format(key, old[key], new[key], change(old[key], new[key])),
+              file=outfile)
+    print('{0:58s} {1:12.1f} {2:12.1f} {3:>9s}'.format('peak_memory (MB)', old['peak_memory'] / 2**20,
+          new['peak_memory'] / 2**20, change(old['peak_memory'], new['peak_memory'])), file=outfile)
+    print(file=outfile)
+    for name, old_time, new_time in compare_reports(old, new):
+        print('{0:58s} {1:>12s} {2:>12s} {3:>9s}'.format(name[-58:],
+              '-' if old_time is None else '{0:.3f}'.format(old_time),
+              '-' if new_time is None else '{0:.3f}'.format(new_time),
+              change(old_time, new_time)), file=outfile)
+    pass
+
+
+def add_profile_arguments(parser, default_report): #pragma: no cover
+    """Add the --profile arguments to an argparse parser"""
+    parser.add_argument('--profile',
+                        nargs='?',
+                        const=default_report,
+                        default=None,
+                        help='profile the run and write a JSON report of the functions with the most cumulative \
+                              time and the peak memory to this file. Default = {0}'.format(default_report))
+    parser.add_argument('--profile_top',
+                        type=int,
+                        default=30,
+                        help='the number of functions in the --profile report. Default = 30')
+    pass
+
+
+def command_line_interface(argv=None): #pragma: no cover
+    parser = argparse.ArgumentParser(prog = "xenomapper compare_profiles",
+                    formatter_class=argparse.RawDescriptionHelpFormatter,
+                    description=textwrap.dedent("""\
+                    Compare the run time, peak memory and cumulative time of each function
+                    of two reports written with --profile (eg from different releases).
+                    """),
+                    )
+    parser.add_argument('old',
+                        type=argparse.FileType('r'),
+                        help='a profile report')
+    parser.add_argument('new',
+                        type=argparse.FileType('r'),
+                        help='a profile report to compare to the old report')
+    return parser.parse_args(argv)
+
+
+def main(argv=None): #pragma: no cover
+    args = command_line_interface(argv)
+    output_comparison(json.load(args.old), json.load(args.new))
+    pass
+
+
+if __name__ == '__main__': #pragma: no cover
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+sam.py
+
+Bytes based SAM records for xenomapper.
+
+Lines are read from binary SAM files and kept as the original bytes.
+Only the read name is decoded when the line is read and tags are
+extracted directly from the bytes, so reads can be classified and
+written to output unchanged without splitting and rejoining fields.
+
+SAM files compressed with gzip or BGZF (eg with bgzip) are detected by
+open_sam and decompressed as they are read.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import io
+import gzip
+import re
+from xenomapper.bam import BgzfReader, is_bgzf
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+
+_TAG_PATTERNS = {}
+
+def _tag_pattern(tags):
+    """Return a compiled regular expression matching numeric values of
+    the optional fields tags as (tag, value) groups"""
+    pattern = _TAG_PATTERNS.get(tags)
+    if pattern is None:
+        names = b'|'.join(sorted([re.escape(tag.encode('ascii')) for tag in tags]))
+        pattern = _TAG_PATTERNS[tags] = re.compile(b'\t(' + names + b'):[if]:([^\t\r\n]*)')
+    return pattern
+
+
+class SamLine(object):
+    """A line from a SAM file kept as the original bytes
+
+    The record behaves as a sequence of SAM fields so it can be used
+    where a list of SAM fields is expected, but the fields are only
+    split from the line on first use of an index other than 0.
+    Fields are tab delimited as required by the SAM specification.
+
+    The scores extracted by a TagProfile are kept on the record (see
+    TagProfile.scores) so the tags of a read are only parsed once.
+    Records are pickled as the bytes of the line alone.
+
+    Attributes:
+        raw    - the bytes of the line including the trailing newline
+        qname  - the read name
+    """
+    __slots__ = ('raw', 'qname', '_fields', '_profile', '_scores')
+
+    def __init__(self, raw):
+        if raw[-1:] != b'\n':
+            raw += b'\n'
+        self.raw = raw
+        tab = raw.find(b'\t')
+        #lines with fields separated by spaces are whitespace split
+        self.qname = (raw[:tab] if tab >= 0 else raw.split(None, 1)[0]).decode('ascii')
+        self._fields = None
+        self._profile = None
+        self._scores = None
+        pass
+
+    def __reduce__(self):
+        return (SamLine, (self.raw,))
+
+    def _tags_start(self):
+        """Return the offset of the tab preceding the first optional field"""
+        optional = self.raw.split(b'\t', 11)
+        if len(optional) < 12:
+            return len(self.raw)
+        return len(self.raw) - len(optional[11]) - 1
+
+    @property
+    def flag(self):
+        """The integer SAM flag"""
+        start = self.raw.find(b'\t') + 1
+        try:
+            return int(self.raw[start:self.raw.find(b'\t', start)])
+        except ValueError:
+            return int(self.raw.split()[1])
+
+    @property
+    def cigar(self):
+        """The cigar string"""
+        if b' ' in self.raw:
+            return self.raw.split()[5].decode('ascii')
+        return self.raw.split(b'\t', 6)[5].decode('ascii')
+
+    def get_tags(self, tags):
+        """Return a dictionary of float values for the numeric tags in tags
+        that are present, extracted in a single pass over the optional fields.
+        Tag names must match exactly and non numeric values (eg XS:A from
+        spliced aligners) are ignored."""
+        raw = self.raw
+        tags = frozenset(tags)
+        values = {}
+        if b' ' in raw:
+            for field in raw.split()[11:]:
+                tag = field[:2].decode('ascii')
+                if tag in tags and field[2:5] in (b':i:', b':f:'):
+                    if tag in values:
+                        raise ValueError('SAM line has multiple values of {0}: {1}'.format(tag,raw)) #pragma: no cover
+                    values[tag] = float(field[5:])
+            return values
+        for tag, value in _tag_pattern(tags).findall(raw, self._tags_start()):
+            tag = tag.decode('ascii')
+            if tag in values:
+                raise ValueError('SAM line has multiple values of {0}: {1}'.format(tag,raw)) #pragma: no cover
+            values[tag] = float(value)
+        return values
+
+    def get_tag(self, tag='AS'):
+        """Return the value of a numeric tag as a float or -inf if the tag is not present.
+        Tag names must match exactly. Lines with fields separated by spaces
+        rather than tabs are parsed as whitespace split SAM lines."""
+        raw = self.raw
+        pattern = b'\t' + tag.encode('ascii') + b':'
+        i = raw.find(pattern, self._tags_start())
+        if i == -1:
+            if b' ' in raw:
+                return self._split_tag(tag)
+            return float('-inf') #this will always be worse than any bowtie score
+        end = raw.find(b'\t', i + 1)
+        if end == -1:
+            end = len(raw)
+        elif raw.find(pattern, end) != -1:
+            raise ValueError('SAM line has multiple values of {0}: {1}'.format(tag,raw)) #pragma: no cover
+        value = raw[i+6:end]
+        try:
+            return float(value)
+        except ValueError:
+            return self._split_tag(tag)
+
+    def _split_tag(self, tag):
+        """Return the value of a tag from the whitespace split line"""
+        values = [x[5:] for x in self.raw.split()[11:] if x[:3] == tag.encode('ascii') + b':']
+        if len(values) > 1:
+            raise ValueError('SAM line has multiple values of {0}: {1}'.format(tag,self.raw)) #pragma: no cover
+        if not values:
+            return float('-inf') #this will always be worse than any bowtie score
+        return float(values[0])
+
+    def fields(self):
+        """Return the line as a list of SAM fields"""
+        if self._fields is None:
+            if b'\t' in self.raw:
+                self._fields = self.raw.decode('ascii').rstrip('\r\n').split('\t')
+            else:
+                self._fields = self.raw.decode('ascii').split()
+        return self._fields
+
+    def __getitem__(self, index):
+        if index == 0:
+            return self.qname
+        return self.fields()[index]
+
+    def __iter__(self):
+        return iter(self.fields())
+
+    def __len__(self):
+        return len(self.fields())
+
+    def __bool__(self):
+        return True #avoid splitting the line to test truth
+
+    def __repr__(self):
+        return 'SamLine({0!r})'.format(self.raw)
+
+
+def sam_lines(samfile):
+    """Yield SamLine objects from a binary SAM file positioned after the header"""
+    for line in samfile:
+        if line.strip():
+            yield SamLine(line)
+
+
+def open_sam(samfile, executor=None):
+    """Return a binary file object reading a plain, gzip or BGZF compressed
+    SAM file.  The compression is detected from the first bytes of the file
+    without consuming them, so pipes and FIFOs can be used.
+        Arguments:
+        samfile  - a binary file or file like object in SAM format.
+                   Files that do not support peek must be seekable.
+        executor - an optional concurrent.futures executor used to
+                   decompress BGZF blocks ahead of the reader
+        Returns:   samfile if it is not compressed, otherwise a
+                   binary file object of the decompressed SAM that
+                   supports readline and peek (for get_sam_header)
+    """
+    if hasattr(samfile, 'peek'):
+        magic = samfile.peek(18)[:18]
+    else:
+        position = samfile.tell()
+        magic = samfile.read(18)
+        samfile.seek(position)
+    if magic[:2] != b'\x1f\x8b':
+        return samfile
+    if is_bgzf(magic):
+        return io.BufferedReader(BgzfReader(samfile, executor=executor), buffer_size=2**16)
+    return gzip.GzipFile(fileobj=samfile, mode='rb')
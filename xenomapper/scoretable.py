@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+scoretable.py
+
+Persistent score tables for reclassifying reads without parsing SAM files.
+
+A classification run can record a score table (--score_table), a binary
+file with one fixed width row for every read (or read of a pair) holding
+the byte offset of the read in each input SAM file, the best and next
+best scores in each species (AS1, XS1, AS2, XS2), the flags and whether
+the read has the same name as the previous row (the mate of a pair).
+The rows follow a short header holding the settings of the run as JSON.
+
+The reclassify subcommand memory maps the table and recomputes the
+category counts with a different --min_score, --conservative or
+--pair_policy (or at every minimum score of --min_score_sweep) in
+seconds, using the array functions of xenomapper.vectorised.  Outputs
+can also be written, by seeking to the recorded offsets of the reads in
+the input files.  The scores are those
+of the tag profile of the original run (eg XS or ZS), which is kept in
+the settings of the table.
+
+Run with:
+
+    xenomapper reclassify --score_table run.scores --min_score 50
+
+NumPy is required for reclassifying.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+import os
+import json
+import struct
+import argparse, textwrap
+from collections import Counter
+from xenomapper.sam import SamLine
+from xenomapper.writers import OUTPUT_CATEGORIES, write_read
+from xenomapper.policies import LIBERAL, CONSERVATIVE, BOTH_READS, WRITTEN_READS
+from xenomapper.vectorised import numpy, get_mapping_states, count_states, count_state_pairs
+from xenomapper.sweep import ThresholdSweep, add_sweep_arguments, output_sweep
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+MAGIC = b'XMSCORE1'
+_HEADER_LENGTH = struct.Struct('<I')
+
+#offset1, offset2, AS1, XS1, AS2, XS2, flag1, flag2, mate
+ROW = struct.Struct('<QQddddHHB')
+ROW_FIELDS = ('offset1', 'offset2', 'AS1', 'XS1', 'AS2', 'XS2', 'flag1', 'flag2', 'mate')
+
+#The offset of reads from inputs that cannot be seeked (pipes, compressed or BAM files)
+NO_OFFSET = 2**64 - 1
+
+
+class ScoreTableWriter(object):
+    """Record the scores of the read pairs of a classification run
+    Arguments:
+        outfile  - a binary file for the score table
+        scores   - a function returning a tuple of the best and next
+                   best score of a read (eg from get_score_function)
+        settings - a dictionary of the settings of the run, kept in
+                   the header of the table
+        samfiles - the binary SAM files read by the read pairs.  Offsets
+                   are only recorded if both files can be seeked.
+                   Default None records no offsets
+        buffer_rows - the number of rows written together. Default 65536
+    """
+    def __init__(self, outfile, scores, settings, samfiles=None, buffer_rows=65536):
+        self.outfile = outfile
+        self.scores = scores
+        self.settings = settings
+        self.samfiles = samfiles if samfiles and all(f.seekable() for f in samfiles) else None
+        self.buffer_rows = buffer_rows
+        self.rows = 0
+        header = json.dumps(dict(settings, version=__version__, row_format=ROW.format,
+                                 offsets=self.samfiles is not None)).encode('utf-8')
+        outfile.write(MAGIC + _HEADER_LENGTH.pack(len(header)) + header)
+        pass
+
+    def record(self, readpairs):
+        """Yield the read pairs of an iterable, recording a row for each.
+        The rows are written as the read pairs are consumed, so this can
+        be used as the readpairs of a main loop function."""
+        pack = ROW.pack
+        scores = self.scores
+        buffer = []
+        previous = None
+        for line1, line2 in readpairs:
+            if self.samfiles:
+                offset1 = self.samfiles[0].tell() - len(line1.raw)
+                offset2 = self.samfiles[1].tell() - len(line2.raw)
+            else:
+                offset1 = offset2 = NO_OFFSET
+            qname = line1[0]
+            buffer.append(pack(offset1, offset2, *(scores(line1) + scores(line2)),
+                               line1.flag, line2.flag, qname == previous))
+            previous = qname
+            if len(buffer) >= self.buffer_rows:
+                self.outfile.write(b''.join(buffer))
+                self.rows += len(buffer)
+                buffer = []
+            yield line1, line2
+        self.outfile.write(b''.join(buffer))
+        self.rows += len(buffer)
+        pass
+
+    def close(self):
+        self.outfile.close()
+        pass
+
+
+class ScoreTable(object):
+    """A memory mapped score table written by a ScoreTableWriter
+    Arguments:
+        filename - the score table file
+    Attributes:
+        settings - the settings of the run that recorded the table
+        rows     - a NumPy structured array with fields ROW_FIELDS
+    """
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError('{0} is not a xenomapper score table'.format(filename))
+            length, = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+            self.settings = json.loads(f.read(length).decode('utf-8'))
+        if self.settings['row_format'] != ROW.format:
+            raise ValueError('{0} was written by an incompatible version of xenomapper'.format(filename))
+        start = len(MAGIC) + _HEADER_LENGTH.size + length
+        size = os.path.getsize(filename) - start
+        if size % ROW.size:
+            raise ValueError('{0} is truncated'.format(filename))
+        if numpy is None: #pragma: no cover
+            raise ImportError('NumPy is required to read score tables. Install with pip3 install numpy')
+        dtype = numpy.dtype([(name, ROW.format[i+1]) for i,name in enumerate(ROW_FIELDS)]).newbyteorder('<')
+        if size:
+            self.rows = numpy.memmap(filename, dtype=dtype, mode='r', offset=start, shape=(size // ROW.size,))
+        else:
+            self.rows = numpy.zeros(0, dtype=dtype)
+        pass
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _write_reads(outfile, rows, indexes, samfiles, written, paired=False):
+    """Write the reads of the rows at indexes (the reverse reads of pairs if
+    paired) from the seekable input files in the order of the main loops"""
+    offsets = (rows['offset1'], rows['offset2'])
+    sides = (0, 1) if written == BOTH_READS else (written,)
+    for i in indexes:
+        for side in sides:
+            for row in ((i - 1, i) if paired else (i,)):
+                offset = int(offsets[side][row])
+                if offset == NO_OFFSET:
+                    raise ValueError('The score table has no offsets for writing reads')
+                samfiles[side].seek(offset)
+                raw = samfiles[side].readline()
+                if raw == b'\n': #the offset of a last line without a newline is one byte early
+                    raw = samfiles[side].readline()
+                write_read(outfile, SamLine(raw))
+    pass
+
+
+def reclassify(table, min_score=float('-inf'), policy=None, conservative=False, outputs=None, samfiles=None,
+               batch_size=1000000):
+    """Classify the reads of a score table.
+    Arguments:
+        table     - a ScoreTable
+        min_score - the score that matches must exceed in order to be
+                    considered valid matches. Default = -inf
+        policy    - a PairPolicy for paired end tables. Default = None
+                    uses the liberal or conservative rules
+        conservative - use the conservative paired end rules. Default = False
+        outputs   - a dictionary of writer objects (or None) keyed by
+                    category.  Default None writes no reads
+        samfiles  - the seekable binary input files of the table, required
+                    for writing outputs
+        batch_size - the number of rows classified together
+    Returns:
+        category_counts - a Counter keyed by state (single end) or tuple
+                    of forward and reverse states (paired end) as for the
+                    main loop functions
+    """
+    outputs = [(outputs or {}).get(category) for category in OUTPUT_CATEGORIES]
+    if any(outputs) and not samfiles:
+        raise ValueError('The input SAM files are required for writing reads')
+    paired = table.settings['paired']
+    pair_table = numpy.array((policy or (CONSERVATIVE if conservative else LIBERAL)).table,
+                             dtype=numpy.int8).reshape(len(OUTPUT_CATEGORIES), len(OUTPUT_CATEGORIES))
+    category_counts = Counter()
+    for start in range(0, len(table), batch_size):
+        #paired batches start with the last row of the previous batch to pair with its mate
+        first = start - 1 if paired and start else start
+        rows = table.rows[first:start + batch_size]
+        states = get_mapping_states(rows['AS1'], rows['XS1'], rows['AS2'], rows['XS2'], min_score=min_score)
+        if paired:
+            reverse_index = numpy.flatnonzero(rows['mate'][1:]) + 1
+            forward = states[reverse_index - 1]
+            reverse = states[reverse_index]
+            category_counts.update(count_state_pairs(forward, reverse))
+            output_states = pair_table[forward, reverse]
+            for state, outfile in enumerate(outputs):
+                if outfile:
+                    _write_reads(outfile, rows, reverse_index[output_states == state], samfiles,
+                                 WRITTEN_READS[state], paired=True)
+        else:
+            category_counts.update(count_states(states))
+            for state, outfile in enumerate(outputs):
+                if outfile:
+                    _write_reads(outfile, rows, numpy.flatnonzero(states == state), samfiles, WRITTEN_READS[state])
+    return category_counts
+
+
+def sweep_score_table(table, sweep, batch_size=1000000):
+    """Add the reads of a score table to a ThresholdSweep"""
+    paired = table.settings['paired']
+    for start in range(0, len(table), batch_size):
+        first = start - 1 if paired and start else start
+        rows = table.rows[first:start + batch_size]
+        states = get_mapping_states(rows['AS1'], rows['XS1'], rows['AS2'], rows['XS2'])
+        sweep.update(states, numpy.maximum(rows['AS1'], rows['AS2']), mate=rows['mate'] if paired else None)
+    pass
+
+
+def command_line_interface(argv=None): #pragma: no cover
+    from xenomapper.xenomapper import add_output_arguments, add_format_arguments, pair_policy_file
+    parser = argparse.ArgumentParser(prog = "xenomapper reclassify",
+                    formatter_class=argparse.RawDescriptionHelpFormatter,
+                    description=textwrap.dedent("""\
+                    Classify reads again from the score table of an earlier
+                    xenomapper run (written with --score_table) without
+                    reading the SAM files, for example with a different
+                    --min_score or pairing policy.
+
+                    Outputs are written by seeking to each read in the input
+                    files of the original run, which must be uncompressed
+                    SAM files.
+                    """),
+                    )
+    parser.add_argument('--score_table',
+                        required=True,
+                        help='a score table written by xenomapper --score_table')
+    parser.add_argument('--primary_sam',
+                        type=argparse.FileType('rb'),
+                        default=None,
+                        help='the primary SAM file of the original run for writing outputs. '
+                             'Default is the file name recorded in the score table')
+    parser.add_argument('--secondary_sam',
+                        type=argparse.FileType('rb'),
+                        default=None,
+                        help='the secondary SAM file of the original run for writing outputs. '
+                             'Default is the file name recorded in the score table')
+    parser.add_argument('--min_score',
+                        type=float,
+                        default=float('-inf'),
+                        help='the minimum mapping score.  Reads with scores less than or equal to min_score '
+                             'will be considered unassigned')
+    pairing = parser.add_mutually_exclusive_group()
+    pairing.add_argument('--conservative',
+                        action='store_true',
+                        help='conservatively allocate paired end reads with discordant category allocations')
+    pairing.add_argument('--pair_policy',
+                        type=pair_policy_file,
+                        default=None,
+                        help='a file of rules assigning paired end reads to an output category (see xenomapper -h)')
+    add_sweep_arguments(parser)
+    add_output_arguments(parser)
+    add_format_arguments(parser)
+    parser.set_defaults(primary_specific=None)
+    args = parser.parse_args(argv)
+    if args.split_fastq and not args.fastq_output:
+        parser.error('--split_fastq requires --fastq_output')
+    return args
+
+
+def run_reclassify(args): #pragma: no cover
+    """Reclassify the score table in args, write any outputs and print a
+    summary of the category counts to stderr"""
+    from xenomapper.xenomapper import process_headers, open_outputs, close_outputs, output_summary
+    table = ScoreTable(args.score_table)
+    writing = [category for category in OUTPUT_CATEGORIES if getattr(args, category)]
+    samfiles = None
+    if writing:
+        if not table.settings['offsets']:
+            raise ValueError('The score table has no read offsets as the inputs were not seekable SAM files')
+        samfiles = [args.primary_sam or open(table.settings['inputs'][0], 'rb'),
+                    args.secondary_sam or open(table.settings['inputs'][1], 'rb')]
+        open_outputs(args)
+        process_headers(samfiles[0], samfiles[1], **{category:getattr(args, category) for category in OUTPUT_CATEGORIES})
+    category_counts = reclassify(table, min_score=args.min_score, policy=args.pair_policy,
+                                 conservative=args.conservative,
+                                 outputs={category:getattr(args, category) for category in OUTPUT_CATEGORIES},
+                                 samfiles=samfiles)
+    if writing:
+        close_outputs(args)
+        for samfile in samfiles:
+            samfile.close()
+    output_summary(category_counts=category_counts)
+    if args.min_score_sweep:
+        sweep = ThresholdSweep(args.min_score_sweep, paired=table.settings['paired'])
+        sweep_score_table(table, sweep)
+        output_sweep(sweep, policy=args.pair_policy or (CONSERVATIVE if args.conservative else LIBERAL),
+                     outfile=args.sweep_output or sys.stderr, json_format=args.sweep_json)
+    return category_counts
+
+
+def main(argv=None): #pragma: no cover
+    args = command_line_interface(argv)
+    try:
+        run_reclassify(args)
+    except ValueError as error:
+        print('ERROR: {0}'.format(error), file=sys.stderr)
+        sys.exit(1)
+    pass
+
+
+if __name__ == '__main__': #pragma: no cover
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+shard.py
+
+Classification of byte ranges (shards) of a pair of SAM files in separate
+processes or on separate nodes.
+
+The primary SAM file is split into byte ranges of about the same size.
+Each split is moved forward to the start of the next read, so the
+alignments of a read (or read pair) are never split between shards.  The
+first alignment of the same read is located in the secondary file by
+searching near an offset interpolated from the reads already found.
+
+Each shard is classified independently, reading only its byte range of
+each input file, and writes its own part of each output file and a file of
+its category counts.  The merge step concatenates the parts of each output
+in shard order and sums the counts, giving the same output files and
+counts as classifying the whole files in a single pass.
+
+Usage:
+    xenomapper shard --primary_sam human.sam --secondary_sam mouse.sam \\
+                     --shards 8 --output_prefix sample
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+import os
+import json
+import shutil
+import argparse, textwrap
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from xenomapper.sam import SamLine
+from xenomapper.bam import BamWriter, BGZF_EOF
+from xenomapper.estimate import SamSampler
+from xenomapper.checkpoint import HeaderRestorer
+from xenomapper.writers import OUTPUT_CATEGORIES, SamWriter, BackgroundWriter
+from xenomapper.xenomapper import get_sam_header, getRawReadPairs, process_headers, get_tag_profile, \
+                                  get_main_function, output_summary, add_classification_arguments, \
+                                  add_format_arguments
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+Shard = namedtuple('Shard', ['start1', 'end1', 'start2', 'end2'])
+
+PLAN_COLUMNS = ('shard', 'primary_start', 'primary_end', 'secondary_start', 'secondary_end')
+
+
+def read_boundary(samfile, offset, end):
+    """Return the offset of the first line after offset in samfile that
+    starts a new read, or end if there is none before end.
+    The line before the returned offset has a different read name."""
+    samfile.seek(max(offset - 1, 0))
+    samfile.readline() #partial line
+    line = samfile.readline()
+    if samfile.tell() >= end or not line.strip():
+        return end
+    key = line.split(b'\t', 1)[0] + b'\t'
+    while True:
+        position = samfile.tell()
+        line = samfile.readline()
+        if position >= end or not line.strip():
+            return end
+        if not line.startswith(key):
+            return position
+
+
+def plan_shards(sam1, sam2, shards):
+    """Split two SAM files containing the same reads in the same order into
+    byte ranges that start at the same read in both files
+    Arguments:
+        sam1, sam2 - seekable binary SAM files positioned after the header
+                     (eg by get_sam_header)
+        shards     - the number of byte ranges. Fewer are returned if the
+                     files have fewer reads
+    Returns:
+        a list of Shards of the start and end offsets in each file
+    """
+    sampler = SamSampler(sam1, sam2)
+    start1, end1 = sampler.start1, sampler.end1
+    size = (end1 - start1) / shards
+    starts1 = sorted({read_boundary(sam1, int(start1 + i * size), end1) for i in range(1, shards)} | {start1})
+    starts1 = [x for x in starts1 if x < end1] or [start1]
+    starts2 = [sampler.start2]
+    for offset1 in starts1[1:]:
+        sam1.seek(offset1)
+        qname = SamLine(sam1.readline()).qname
+        starts2.append(sampler.find(qname, offset1))
+    return [Shard(s1, e1, s2, e2) for s1, e1, s2, e2 in zip(starts1, starts1[1:] + [end1],
+                                                          starts2, starts2[1:] + [sampler.end2])]
+
+
+def write_plan(shards, outfile):
+    """Write a list of Shards as a tab separated table"""
+    print('\t'.join(PLAN_COLUMNS), file=outfile)
+    for index, shard in enumerate(shards):
+        print('\t'.join(str(x) for x in (index,) + tuple(shard)), file=outfile)
+    pass
+
+
+def read_plan(infile):
+    """Return a list of Shards from a table written by write_plan"""
+    lines = [line.rstrip('\n').split('\t') for line in infile if line.strip()]
+    if tuple(lines[0]) != PLAN_COLUMNS:
+        raise ValueError('Not a shard plan: {0}'.format(getattr(infile, 'name', infile)))
+    return [Shard(*[int(x) for x in line[1:]]) for line in lines[1:]]
+
+
+class ShardFile(object):
+    """A binary file like object for reading the lines of a file
+    between two offsets with readline"""
+    def __init__(self, fileobj, start, end):
+        self.fileobj = fileobj
+        self.position = start
+        self.end = end
+        fileobj.seek(start)
+        pass
+
+    def readline(self):
+        if self.position >= self.end:
+            return b''
+        line = self.fileobj.readline()
+        self.position += len(line)
+        return line
+
+
+def part_name(prefix, category, index, bam=False):
+    """Return the name of the part of an output file written by a shard"""
+    return '{0}.shard{1}_{2}.{3}'.format(prefix, index, category, 'bam' if bam else 'sam')
+
+
+def output_name(prefix, category, bam=False):
+    """Return the name of a merged output file"""
+    return '{0}_{1}.{2}'.format(prefix, category, 'bam' if bam else 'sam')
+
+
+def counts_name(prefix, index):
+    """Return the name of the category counts file written by a shard"""
+    return '{0}.shard{1}.counts.json'.format(prefix, index)
+
+
+def write_counts(category_counts, filename):
+    """Write category counts to a JSON file. Paired end counts are keyed by
+    tuples, which are not valid JSON keys, so counts are written as a list"""
+    with open(filename, 'w') as f:
+        json.dump([[key, count] for key, count in category_counts.items()], f)
+    pass
+
+
+def read_counts(filename):
+    """Return a Counter of category counts from a file written by write_counts"""
+    with open(filename) as f:
+        return Counter({tuple(key) if isinstance(key, list) else key:count for key, count in json.load(f)})
+
+
+def run_shard(args, index, shard): #pragma: no cover
+    """Classify the reads of one shard of the input files in args, writing
+    a part of each output file and the category counts of the shard.
+    Only the first shard writes the output headers.
+    Returns:
+        category_counts - the category counts of the main loop function
+    """
+    executor = None
+    if args.io_threads > 1:
+        executor = ThreadPoolExecutor(max_workers=args.io_threads)
+    files = []
+    outputs = {}
+    for category in OUTPUT_CATEGORIES:
+        outfile = open(part_name(args.output_prefix, category, index, args.bam_output), 'wb')
+        files.append(outfile)
+        if args.write_buffer:
+            outfile = BackgroundWriter(outfile, buffer_size=int(args.write_buffer * 2**20),
+                                       max_pending=args.write_queue)
+            files.insert(0, outfile)
+        outputs[category] = BamWriter(outfile, executor=executor) if args.bam_output else SamWriter(outfile)
+    with open(args.primary_sam, 'rb') as sam1, open(args.secondary_sam, 'rb') as sam2:
+        #the references of BamWriters are needed by every shard
+        headers = outputs if index == 0 else {category:HeaderRestorer(x) for category, x in outputs.items()}
+        process_headers(sam1, sam2, **headers)
+        readpairs = getRawReadPairs(ShardFile(sam1, shard.start1, shard.end1),
+                                    ShardFile(sam2, shard.start2, shard.end2),
+                                    skip_repeated_reads=not args.paired)
+        category_counts = get_main_function(args)(readpairs, min_score=args.min_score,
+                                                  tag_func=get_tag_profile(args), **outputs)
+    for outfile in outputs.values():
+        outfile.close()
+    for outfile in files:
+        outfile.close()
+    if executor:
+        executor.shutdown()
+    write_counts(category_counts, counts_name(args.output_prefix, index))
+    return category_counts
+
+
+def merge_parts(parts, outfile, bam=False):
+    """Concatenate the parts of an output file in order.
+    The BGZF end of file marker is removed from all but the last BAM part.
+    The parts are copied in blocks so they need not fit in memory."""
+    for i, part in enumerate(parts):
+        with open(part, 'rb') as f:
+            if bam and i < len(parts) - 1:
+                size = f.seek(0, 2)
+                if size >= len(BGZF_EOF):
+                    f.seek(size - len(BGZF_EOF))
+                    if f.read() == BGZF_EOF:
+                        size -= len(BGZF_EOF)
+                f.seek(0)
+                copy_bytes(f, outfile, size)
+            else:
+                shutil.copyfileobj(f, outfile, 2**20)
+    pass
+
+
+def copy_bytes(infile, outfile, size, block_size=2**20):
+    """Copy size bytes from a binary file to another in blocks"""
+    while size > 0:
+        data = infile.read(min(block_size, size))
+        if not data:
+            raise ValueError('{0} ended before the expected size'.format(getattr(infile, 'name', 'file')))
+        outfile.write(data)
+        size -= len(data)
+    pass
+
+
+def merge_shards(prefix, shards, bam=False, keep_parts=False): #pragma: no cover
+    """Merge the output parts and category counts written by each shard
+    into files named prefix_category.sam (or .bam).
+    Returns:
+        category_counts - the summed category counts of all shards
+    """
+    category_counts = Counter()
+    for index in range(shards):
+        category_counts.update(read_counts(counts_name(prefix, index)))
+    for category in OUTPUT_CATEGORIES:
+        parts = [part_name(prefix, category, index, bam) for index in range(shards)]
+        with open(output_name(prefix, category, bam), 'wb') as outfile:
+            merge_parts(parts, outfile, bam=bam)
+        if not keep_parts:
+            for part in parts:
+                os.remove(part)
+    if not keep_parts:
+        for index in range(shards):
+            os.remove(counts_name(prefix, index))
+    return category_counts
+
+
+def get_plan(args): #pragma: no cover
+    """Return the shards of the input files in args, read from the
+    --plan file unless a plan is being made"""
+    if args.plan and not args.plan_only:
+        with open(args.plan) as f:
+            return read_plan(f)
+    with open(args.primary_sam, 'rb') as sam1, open(args.secondary_sam, 'rb') as sam2:
+        get_sam_header(sam1)
+        get_sam_header(sam2)
+        return plan_shards(sam1, sam2, args.shards)
+
+
+def run_sharded(args): #pragma: no cover
+    """Plan, classify and merge the shards of the input files in args as
+    selected by the --plan_only, --shard_index and --merge options
+    Returns:
+        category_counts - the category counts of the classified shards
+    """
+    shards = get_plan(args)
+    if args.plan_only:
+        if args.plan:
+            with open(args.plan, 'w') as f:
+                write_plan(shards, f)
+        else:
+            write_plan(shards, sys.stdout)
+        return Counter()
+    if args.shard_index is not None:
+        return run_shard(args, args.shard_index, shards[args.shard_index])
+    if not args.merge:
+        with ProcessPoolExecutor(max_workers=args.processes or len(shards)) as executor:
+            for future in [executor.submit(run_shard, args, index, shard) for index, shard in enumerate(shards)]:
+                future.result()
+    category_counts = merge_shards(args.output_prefix, len(shards), bam=args.bam_output)
+    output_summary(category_counts=category_counts)
+    return category_counts
+
+
+def command_line_interface(argv=None): #pragma: no cover
+    parser = argparse.ArgumentParser(prog = "xenomapper shard",
+                    formatter_class=argparse.RawDescriptionHelpFormatter,
+                    description=textwrap.dedent("""\
+                    Classify byte ranges (shards) of a pair of SAM files in parallel.
+
+                    The primary SAM file is split into shards that start at a read
+                    boundary, and the same read is found in the secondary file.
+                    Each shard is classified in its own process and the outputs are
+                    concatenated into files named PREFIX_CATEGORY.sam (or .bam),
+                    which are identical to the outputs of a single pass.
+
+                    To classify shards on separate nodes write the plan with
+                    --plan_only, run each shard with --shard_index and combine the
+                    results with --merge.  All runs must use the same options.
+
+                    Input files must be uncompressed seekable SAM files with the
+                    reads in the same order.
+                    """),
+                    epilog = textwrap.dedent("""\
+                    Example:
+                        xenomapper shard --paired --primary_sam human.sam --secondary_sam mouse.sam \\
+                            --shards 16 --plan sample.plan --plan_only
+                        xenomapper shard --paired --primary_sam human.sam --secondary_sam mouse.sam \\
+                            --plan sample.plan --shard_index 0 --output_prefix sample
+                        ...
+                        xenomapper shard --paired --primary_sam human.sam --secondary_sam mouse.sam \\
+                            --plan sample.plan --merge --output_prefix sample
+                    """),
+                    )
+    parser.add_argument('--primary_sam',
+                        required=True,
+                        help='a SAM format mapping output file corresponding to the primary species of interest')
+    parser.add_argument('--secondary_sam',
+                        required=True,
+                        help='a SAM format mapping output file corresponding to the secondary or contaminating species')
+    parser.add_argument('--output_prefix',
+                        default=None,
+                        help='write reads to files named PREFIX_CATEGORY.sam (or .bam) for every category')
+    parser.add_argument('--shards',
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help='the number of byte ranges the input files are split into. Default = number of cores')
+    parser.add_argument('--processes',
+                        type=int,
+                        default=None,
+                        help='the number of shards classified at the same time. Default = --shards')
+    parser.add_argument('--plan',
+                        default=None,
+                        help='a file for the byte ranges of each shard, written with --plan_only and '
+                             'read with --shard_index and --merge')
+    run_mode = parser.add_mutually_exclusive_group()
+    run_mode.add_argument('--plan_only',
+                        action='store_true',
+                        help='write the shard byte ranges to --plan (or standard output) and exit')
+    run_mode.add_argument('--shard_index',
+                        type=int,
+                        default=None,
+                        help='classify only this shard (numbered from 0) of the --plan')
+    run_mode.add_argument('--merge',
+                        action='store_true',
+                        help='merge the outputs of the shards of the --plan')
+    add_classification_arguments(parser)
+    add_format_arguments(parser)
+    args = parser.parse_args(argv)
+    if not args.plan_only and not args.output_prefix:
+        parser.error('--output_prefix is required')
+    if (args.shard_index is not None or args.merge) and not args.plan:
+        parser.error('--shard_index and --merge require --plan')
+    if args.shards < 1:
+        parser.error('--shards must be at least 1')
+    if args.fastq_output:
+        parser.error('--fastq_output is not supported by xenomapper shard')
+    return args
+
+
+def main(argv=None): #pragma: no cover
+    args = command_line_interface(argv)
+    run_sharded(args)
+    pass
+
+
+if __name__ == '__main__': #pragma: no cover
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+sweep.py
+
+Category counts for a range of minimum scores from a single pass.
+
+Changing the minimum score only changes the mapping state of a read from
+its state with no minimum score to unassigned, once the minimum score
+reaches the best score of the read in either species.  A ThresholdSweep
+therefore keeps a histogram of the state of each read (or the states of
+the two reads of a pair) and the number of thresholds below its best
+score, from which the category counts at every threshold are calculated
+at the end of the run.
+
+The counts are reported as a table of thresholds by output category
+(TSV or JSON).  For paired end reads the pairs are assigned to output
+categories with the pairing policy of the run.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+import json
+import argparse
+from bisect import bisect_left
+from collections import Counter
+from xenomapper.policies import MAPPING_STATES, STATE_CODES, UNASSIGNED, LIBERAL
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+
+def parse_thresholds(text):
+    """Return a list of minimum scores from a START:STOP:STEP string.
+    STOP is included if it is a whole number of steps from START."""
+    try:
+        start, stop, step = [float(x) for x in text.split(':')]
+    except ValueError:
+        raise ValueError('A minimum score range must be START:STOP:STEP, not {0!r}'.format(text))
+    if step <= 0 or stop < start:
+        raise ValueError('A minimum score range must have a positive STEP and STOP of at least START')
+    #the small tolerance includes STOP despite rounding of fractional steps
+    return [start + i * step for i in range(int((stop - start) / step + 1e-9) + 1)]
+
+
+def threshold_range(text): #pragma: no cover
+    """Parse the --min_score_sweep option"""
+    try:
+        return parse_thresholds(text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+class ThresholdSweep(object):
+    """Category counts of reads at a range of minimum scores
+    Arguments:
+        thresholds - a sequence of minimum scores
+        paired     - count read pairs as for the paired end main loops.
+                     Default False
+    Attributes:
+        histogram  - a Counter keyed by (state, rank) for single end
+                     reads or (forward state, forward rank, reverse state,
+                     reverse rank) for pairs, where states are indexes
+                     into MAPPING_STATES and the rank is the number of
+                     thresholds below the best score of the read
+    """
+    def __init__(self, thresholds, paired=False):
+        self.thresholds = sorted(thresholds)
+        self.paired = paired
+        self.histogram = Counter()
+        pass
+
+    def record(self, readpairs, scores):
+        """Yield the read pairs of an iterable, adding each to the histogram.
+        Arguments:
+            readpairs - an iterable of tuples of reads, as for the main
+                        loop functions
+            scores    - a function returning a tuple of the best and next
+                        best score of a read (eg from get_score_function)
+        """
+        from xenomapper.xenomapper import get_mapping_state
+        histogram = self.histogram
+        thresholds = self.thresholds
+        previous = None
+        for line1, line2 in readpairs:
+            AS1, XS1 = scores(line1)
+            AS2, XS2 = scores(line2)
+            state = STATE_CODES[get_mapping_state(AS1, XS1, AS2, XS2)]
+            rank = bisect_left(thresholds, AS1 if AS1 > AS2 else AS2)
+            if self.paired:
+                #as for main_paired_end every adjacent pair of reads with the same name is counted
+                qname = line1[0]
+                if previous and previous[0] == qname:
+                    histogram[previous[1], previous[2], state, rank] += 1
+                previous = (qname, state, rank)
+            else:
+                histogram[state, rank] += 1
+            yield line1, line2
+        pass
+
+    def update(self, states, best_scores, mate=None):
+        """Add arrays of reads to the histogram.
+        Arguments:
+            states      - a NumPy array of state indexes with no minimum score
+                          (eg from get_mapping_states)
+            best_scores - a NumPy array of the best score of each read in
+                          either species
+            mate        - for paired reads, a boolean array that is true for
+                          reads with the same name as the previous read
+        """
+        import numpy
+        ranks = numpy.searchsorted(self.thresholds, best_scores, side='left')
+        states = numpy.asarray(states, dtype=numpy.intp)
+        width = len(self.thresholds) + 1
+        if self.paired:
+            reverse_index = numpy.flatnonzero(mate[1:]) + 1
+            keys = states[reverse_index - 1] * width + ranks[reverse_index - 1]
+            keys = keys * len(MAPPING_STATES) * width + states[reverse_index] * width + ranks[reverse_index]
+        else:
+            keys = states * width + ranks
+        for key, count in zip(*numpy.unique(keys, return_counts=True)):
+            key = int(key)
+            if self.paired:
+                forward, reverse = divmod(key, len(MAPPING_STATES) * width)
+                self.histogram[forward // width, forward % width, reverse // width, reverse % width] += int(count)
+            else:
+                self.histogram[key // width, key % width] += int(count)
+        pass
+
+    def category_counts(self):
+        """Return a list of category counts at each threshold, keyed as
+        the counts of the main loop functions by state (single end) or a
+        tuple of forward and reverse states (paired end)"""
+        n = len(self.thresholds)
+        #the counts of each category change only at the ranks of the reads
+        changes = {}
+        def add(category, start, stop, count):
+            if start < stop:
+                change = changes.setdefault(category, [0] * (n + 1))
+                change[start] += count
+                change[stop] -= count
+        for key, count in self.histogram.items():
+            if self.paired:
+                forward, forward_rank, reverse, reverse_rank = key
+                first, last = sorted((forward_rank, reverse_rank))
+                add((forward, reverse), 0, first, count)
+                if forward_rank > reverse_rank:
+                    add((forward, UNASSIGNED), first, last, count)
+                else:
+                    add((UNASSIGNED, reverse), first, last, count)
+                add((UNASSIGNED, UNASSIGNED), last, n, count)
+            else:
+                state, rank = key
+                add(state, 0, rank, count)
+                add(UNASSIGNED, rank, n, count)
+        counts = [Counter() for threshold in self.thresholds]
+        for category, change in changes.items():
+            if self.paired:
+                name = (MAPPING_STATES[category[0]], MAPPING_STATES[category[1]])
+            else:
+                name = MAPPING_STATES[category]
+            total = 0
+            for i in range(n):
+                total += change[i]
+                if total:
+                    counts[i][name] = total
+        return counts
+
+    def table(self, policy=LIBERAL):
+        """Return a list of output categories and a list of the counts of
+        each category at each threshold.  Pairs are assigned to output
+        categories by a PairPolicy. Default LIBERAL"""
+        categories = list(MAPPING_STATES)
+        rows = []
+        for category_counts in self.category_counts():
+            counts = Counter()
+            for key, count in category_counts.items():
+                counts[policy.output_state(*key) if self.paired else key] += count
+            if 'discard' in counts and 'discard' not in categories:
+                categories.append('discard')
+            rows.append(counts)
+        return categories, [[row[category] for category in categories] for row in rows]
+
+
+def output_sweep(sweep, policy=LIBERAL, outfile=sys.stderr, json_format=False):
+    """Write the table of counts at each threshold of a ThresholdSweep as
+    tab separated text with a column of thresholds, or as JSON"""
+    categories, rows = sweep.table(policy)
+    if json_format:
+        json.dump({'version':__version__,
+                   'paired':sweep.paired,
+                   'thresholds':sweep.thresholds,
+                   'categories':categories,
+                   'counts':rows,
+                   #paired end counts are keyed by tuples which are not valid JSON keys
+                   'category_counts':[[[key, count] for key, count in sorted(counts.items())]
+                                      for counts in sweep.category_counts()],
+                   }, outfile)
+        print(file=outfile)
+        return
+    print('min_score', *categories, sep='\t', file=outfile)
+    for threshold, row in zip(sweep.thresholds, rows):
+        print('{0:g}'.format(threshold), *row, sep='\t', file=outfile)
+    pass
+
+
+def add_sweep_arguments(parser): #pragma: no cover
+    """Add the --min_score_sweep arguments to an argparse parser"""
+    parser.add_argument('--min_score_sweep',
+                        type=threshold_range,
+                        metavar='START:STOP:STEP',
+                        default=None,
+                        help='count the reads in each category at every minimum score from START to STOP \
+                              (inclusive) in steps of STEP in the same pass.  Outputs are only written for \
+                              --min_score, and only to outputs that are named.  Give negative \
+                              ranges with =, eg --min_score_sweep=-40:0:5 for bowtie2 end-to-end scores')
+    parser.add_argument('--sweep_output',
+                        type=argparse.FileType('w'),
+                        default=None,
+                        help='a file for the tab separated table of counts of each category at each minimum score. \
+                              Default is standard error')
+    parser.add_argument('--sweep_json',
+                        action='store_true',
+                        help='write the --min_score_sweep table as JSON')
+    pass
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+helpers.py
+
+Shared setup for tests that read the SAM test data from files in a
+temporary directory and write every output category.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import io
+import tempfile
+from pkg_resources import resource_filename
+from xenomapper.profiles import BOWTIE2
+from xenomapper.writers import OUTPUT_CATEGORIES
+from xenomapper.xenomapper import get_sam_header
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+PAIRED_END_DATA = ('paired_end_testdata_human.sam', 'paired_end_testdata_mouse.sam')
+SINGLE_END_DATA = ('test_human_in.sam', 'test_mouse_in.sam')
+
+def string_outputs(categories=OUTPUT_CATEGORIES):
+    """Return a dictionary of a StringIO for each output category"""
+    return {category:io.StringIO() for category in categories}
+
+def output_values(outputs):
+    """Return a dictionary of the text written to each StringIO output"""
+    return {category:outfile.getvalue() for category, outfile in outputs.items()}
+
+
+class InputFiles(object):
+    """A mixin for unittest.TestCase providing a temporary directory
+    (self.tempdir) and the test data opened as binary files with their
+    headers skipped.  Files added to self.files are closed in tearDown.
+    Subclasses that extend setUp or tearDown should call these methods."""
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.files = []
+        pass
+
+    def tearDown(self):
+        for f in self.files:
+            f.close()
+        self.tempdir.cleanup()
+        pass
+
+    def open_inputs(self, paired=True):
+        """Open the paired or single end test data after the headers"""
+        samfiles = [open(resource_filename(__name__, 'data/' + name), 'rb')
+                    for name in (PAIRED_END_DATA if paired else SINGLE_END_DATA)]
+        self.files.extend(samfiles)
+        for samfile in samfiles:
+            get_sam_header(samfile)
+        return samfiles
+
+    def classify(self, main_function, readpairs, min_score=float('-inf')):
+        """Classify read pairs with bowtie2 tags writing every output.
+        Returns the category counts and the text written to each output"""
+        outputs = string_outputs()
+        counts = main_function(readpairs, min_score=min_score, tag_func=BOWTIE2, **outputs)
+        return counts, output_values(outputs)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+stand_in_aligner.py
+
+A stand in for an aligner used to test xenomapper pipeline.
+Writes a SAM file to stdout and a message to stderr, then exits with
+the requested status.
+
+Usage:
+    python3 stand_in_aligner.py SAMFILE [--lines N] [--exit STATUS]
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import sys
+import argparse
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('samfile', type=argparse.FileType('rb'))
+    parser.add_argument('--lines', type=int, default=None, help='only write the first LINES lines')
+    parser.add_argument('--exit', type=int, default=0, help='the exit status')
+    args = parser.parse_args()
+    print('stand in aligner reading {0}'.format(args.samfile.name), file=sys.stderr)
+    for i, line in enumerate(args.samfile):
+        if args.lines is not None and i >= args.lines:
+            break
+        sys.stdout.buffer.write(line)
+    sys.stdout.buffer.flush()
+    if args.exit:
+        print('stand in aligner failed', file=sys.stderr)
+    sys.exit(args.exit)
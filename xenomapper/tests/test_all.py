@@ -10,6 +10,24 @@ Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute a
 import unittest
 from xenomapper.tests.test_xenomapper import *
 from xenomapper.tests.test_mappability import *
+from xenomapper.tests.test_sam import *
+from xenomapper.tests.test_bam import *
+from xenomapper.tests.test_profiles import *
+from xenomapper.tests.test_join import *
+from xenomapper.tests.test_parallel import *
+from xenomapper.tests.test_pipeline import *
+from xenomapper.tests.test_nway import *
+from xenomapper.tests.test_estimate import *
+from xenomapper.tests.test_checkpoint import *
+from xenomapper.tests.test_shard import *
+from xenomapper.tests.test_metrics import *
+from xenomapper.tests.test_profiling import *
+from xenomapper.tests.test_benchmark import *
+from xenomapper.tests.test_vectorised import *
+from xenomapper.tests.test_policies import *
+from xenomapper.tests.test_scoretable import *
+from xenomapper.tests.test_sweep import *
+from xenomapper.tests.test_manifest import *
 
 __author__ = "Matthew Wakefield"
 __copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
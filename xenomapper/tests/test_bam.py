@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_bam.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io
+import gzip
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from xenomapper.bam import *
+from pkg_resources import resource_stream
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+class test_bam(unittest.TestCase):
+    def setUp(self):
+        sam = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_human.sam'))
+        self.sam_lines = [x.strip('\n') for x in sam]
+        sam.close()
+        pass
+    
+    def test_read_bam_header(self):
+        bam = resource_stream(__name__, 'data/paired_end_testdata_human.bam')
+        header, references = read_bam_header(BgzfReader(bam))
+        self.assertEqual(header, [x for x in self.sam_lines if x[0] == '@'])
+        self.assertEqual(references[:3], ['MT','1','2'])
+        self.assertEqual(len(references), 25)
+        bam.close()
+        pass
+    
+    def test_bam_records(self):
+        bam = resource_stream(__name__, 'data/paired_end_testdata_human.bam')
+        records = list(bam_records(bam))
+        sam_records = [x.split('\t') for x in self.sam_lines if x[0] != '@']
+        self.assertEqual(len(records), 476)
+        self.assertEqual([x.qname for x in records], [x[0] for x in sam_records])
+        self.assertEqual([x.flag for x in records], [int(x[1]) for x in sam_records])
+        self.assertEqual([list(x) for x in records], sam_records)
+        bam.close()
+        pass
+    
+    def test_bam_reader(self):
+        bam = io.BufferedReader(io.BytesIO(resource_stream(__name__, 'data/paired_end_testdata_human.bam').read()))
+        bam.seek = None #header and records are read without seeking
+        reader = BamReader(bam)
+        self.assertEqual(reader.header, [x for x in self.sam_lines if x[0] == '@'])
+        self.assertEqual(reader.references[:3], ['MT','1','2'])
+        self.assertEqual([list(x) for x in reader], [x.split('\t') for x in self.sam_lines if x[0] != '@'])
+        pass
+    
+    def test_bam_record_tags(self):
+        bam = resource_stream(__name__, 'data/paired_end_testdata_human.bam')
+        records = bam_records(bam)
+        first = next(records)
+        self.assertEqual(first.tags, {'AS':198.0, 'XS':126.0, 'NM':0.0})
+        self.assertEqual(first.get_tag('AS'), 198.0)
+        self.assertEqual(first.get_tag('ZS'), float('-inf'))
+        self.assertIsNone(first._fields) #score tag access does not build SAM fields
+        self.assertEqual(first[0], 'HWI-ST960:96:COTO3ACXX:3:1101:1220:2089')
+        self.assertIsNone(first._fields)
+        self.assertEqual(first.get_tag('YS'), 189.0)
+        self.assertEqual(first[5], '99M1S')
+        bam.close()
+        pass
+    
+    def test_not_bgzf(self):
+        with self.assertRaises(ValueError):
+            BgzfReader(io.BytesIO(b'@HD\tVN:1.0\n' * 10)).read(4)
+        pass
+
+    def test_encode_sam_fields(self):
+        bam = resource_stream(__name__, 'data/paired_end_testdata_human.bam')
+        bgzf = BgzfReader(bam)
+        header, references = read_bam_header(bgzf)
+        reference_ids = {name:i for i,name in enumerate(references)}
+        for record in iter_bam_records(bgzf, references):
+            self.assertEqual(encode_sam_fields(list(record), reference_ids), record.data)
+        bam.close()
+        pass
+    
+    def test_bgzf_writer(self):
+        data = b''.join([str(x).encode('ascii') for x in range(100000)])
+        for executor in (None, ThreadPoolExecutor(max_workers=2)):
+            outfile = io.BytesIO()
+            bgzf = BgzfWriter(outfile, executor=executor, max_pending=2)
+            bgzf.write(data)
+            bgzf.close()
+            self.assertTrue(outfile.getvalue().endswith(BGZF_EOF))
+            self.assertEqual(gzip.decompress(outfile.getvalue()), data)
+            self.assertEqual(BgzfReader(io.BytesIO(outfile.getvalue())).read(len(data)+1), data)
+            self.assertEqual(BgzfReader(io.BytesIO(outfile.getvalue()), executor=executor,
+                                        max_pending=3).read(len(data)+1), data)
+            self.assertTrue(is_bgzf(outfile.getvalue()))
+        self.assertFalse(is_bgzf(gzip.compress(data)))
+        executor.shutdown()
+        pass
+    
+    def test_bam_writer(self):
+        bam = resource_stream(__name__, 'data/paired_end_testdata_human.bam')
+        bgzf = BgzfReader(bam)
+        header, references = read_bam_header(bgzf)
+        records = list(iter_bam_records(bgzf, references))
+        bam.close()
+        outfile = io.BytesIO()
+        writer = BamWriter(outfile, executor=ThreadPoolExecutor(max_workers=2))
+        writer.write_header(header)
+        for record in records:
+            writer.write_read(record)
+        writer.write_read(list(records[0]))
+        writer.close()
+        result_header, result_references = read_bam_header(BgzfReader(io.BytesIO(outfile.getvalue())))
+        self.assertEqual(result_header, header)
+        self.assertEqual(result_references, references)
+        result = list(bam_records(io.BytesIO(outfile.getvalue())))
+        self.assertEqual([list(x) for x in result], [list(x) for x in records + records[:1]])
+        pass
+    
+    def test_bam_writer_translates_references(self):
+        sam_fields = ['read1', '0', '2', '100', '42', '10M', '*', '0', '0', 'ACGTACGTAC', '*', 'AS:i:-3']
+        record = BamRecord(encode_sam_fields(sam_fields, {'1':0, '2':1}), ['1', '2'])
+        outfile = io.BytesIO()
+        writer = BamWriter(outfile)
+        writer.write_header(['@SQ\tSN:2\tLN:1000', '@SQ\tSN:3\tLN:1000'])
+        writer.write_read(record)
+        writer.write_read(sam_fields)
+        writer.close()
+        result = [list(x) for x in bam_records(io.BytesIO(outfile.getvalue()))]
+        self.assertEqual(result, [sam_fields, sam_fields])
+        self.assertEqual(struct.unpack_from('<i', next(bam_records(io.BytesIO(outfile.getvalue()))).data)[0], 0)
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_benchmark.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io, os
+import json
+import tempfile
+from xenomapper.benchmark.generate import *
+from xenomapper.benchmark.harness import *
+from xenomapper.profiles import PROFILES
+from xenomapper.xenomapper import get_sam_header, getRawReadPairs, main_single_end, main_paired_end, \
+                                  conservative_main_paired_end, get_cigarbased_AS_tag, cigar_score
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+class test_benchmark(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        pass
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        pass
+
+    def test_parse_mix(self):
+        mix = parse_mix(['primary_specific=3', 'unassigned=1'])
+        self.assertEqual(list(mix), list(OUTPUT_CATEGORIES))
+        self.assertEqual(normalised_mix(mix)['primary_specific'], 0.75)
+        self.assertEqual(normalised_mix(mix)['unresolved'], 0.0)
+        with self.assertRaises(ValueError):
+            parse_mix(['human=1'])
+        with self.assertRaises(ValueError):
+            parse_mix(['primary_specific'])
+        with self.assertRaises(ValueError):
+            normalised_mix(parse_mix(['unassigned=0']))
+        pass
+
+    def test_generate_sam_pair(self):
+        for profile in TAG_PROFILES:
+            for main_function, paired in ((main_single_end, False), (main_paired_end, True),
+                                          (conservative_main_paired_end, True)):
+                sam1 = io.BytesIO()
+                sam2 = io.BytesIO()
+                counts = generate_sam_pair(sam1, sam2, reads=2000, read_length=50, paired=paired,
+                                           profile=profile, seed=1)
+                self.assertEqual(sum(counts.values()), 1000 if paired else 2000)
+                self.assertEqual(set(counts), set([(x, x) if paired else x for x in OUTPUT_CATEGORIES]))
+                sam1.seek(0)
+                sam2.seek(0)
+                self.assertEqual(len(get_sam_header(sam1)), 5)
+                get_sam_header(sam2)
+                self.assertEqual(main_function(getRawReadPairs(sam1, sam2, skip_repeated_reads=not paired),
+                                               primary_specific=None, tag_func=PROFILES[profile]), counts)
+                self.assertEqual(len(sam1.getvalue().decode('ascii').split('\n')[5].split('\t')[9]), 50)
+        pass
+
+    def test_generate_options(self):
+        sam1 = io.BytesIO()
+        counts = generate_sam_pair(sam1, io.BytesIO(), reads=500, profile='cigar', seed=2,
+                                   mix={'primary_specific':1, 'secondary_multi':1})
+        self.assertEqual(set(counts), set(['primary_specific', 'secondary_multi']))
+        sam1_again = io.BytesIO()
+        self.assertEqual(generate_sam_pair(sam1_again, io.BytesIO(), reads=500, profile='cigar', seed=2,
+                                           mix={'primary_specific':1, 'secondary_multi':1}), counts)
+        self.assertEqual(sam1_again.getvalue(), sam1.getvalue())
+        lines = [line.split('\t') for line in sam1.getvalue().decode('ascii').splitlines() if line[0] != '@']
+        self.assertFalse([line for line in lines if [x for x in line[11:] if x.startswith('AS')]])
+        self.assertTrue([line for line in lines if 'D' in line[5] or 'I' in line[5] or 'S' in line[5]])
+        for line in lines:
+            if line[1] != '4':
+                self.assertEqual(get_cigarbased_AS_tag(line),
+                                 cigar_score(line[5], int([x for x in line if x.startswith('NM')][0][5:])))
+        with self.assertRaises(ValueError):
+            generate_sam_pair(io.BytesIO(), io.BytesIO(), reads=10, profile='bwa')
+        pass
+
+    def test_generate_mappability_data(self):
+        chromosome_sizes = genome_chromosomes(501)
+        self.assertEqual(chromosome_sizes, {'chr1':251, 'chr2':250})
+        fasta = io.StringIO()
+        generate_genome(fasta, chromosome_sizes)
+        self.assertEqual(fasta.getvalue().count('>'), 2)
+        samfile = io.StringIO()
+        self.assertEqual(generate_mappability_sam(samfile, chromosome_sizes, read_length=100, unique=0.5), 303)
+        samfile.seek(0)
+        wiggle = io.StringIO()
+        single_end_mappability_from_sam(samfile, outfile=wiggle)
+        values = [x for x in wiggle.getvalue().splitlines() if not x.startswith('fixedStep')]
+        self.assertEqual(len(values), 303)
+        self.assertTrue(100 < values.count('1') < 250)
+        pass
+
+    def test_run_benchmarks(self):
+        settings = data_settings(reads=200, read_length=50, genome_size=400)
+        report = run_benchmarks(self.tempdir.name, settings, outfile=None)
+        self.assertEqual([x['name'] for x in report['results']], list(BENCHMARKS))
+        results = {x['name']:x for x in report['results']}
+        self.assertEqual(results['main_single_end']['reads'], 200)
+        self.assertEqual(results['main_paired_end']['reads'], 200)
+        self.assertEqual(results['single_end_mappability_from_sam']['reads'], 302)
+        self.assertTrue(all(x['reads_per_second'] > 0 and x['peak_memory'] > 0 for x in report['results']))
+        #generated data is reused
+        manifest = os.path.join(self.tempdir.name, 'benchmark_data.json')
+        mtime = os.stat(manifest).st_mtime_ns
+        report = run_benchmarks(self.tempdir.name, settings, benchmarks=['main_paired_end'], memory=False,
+                                outfile=None)
+        self.assertEqual(os.stat(manifest).st_mtime_ns, mtime)
+        self.assertEqual(report['results'][0]['peak_memory'], None)
+        json.dumps(report)
+        pass
+
+    def test_compare_to_baseline(self):
+        baseline = {'version':'1.0.1', 'settings':{}, 'results':[
+                    {'name':'a', 'reads_per_second':100.0, 'peak_memory':1000},
+                    {'name':'b', 'reads_per_second':100.0, 'peak_memory':1000},
+                    {'name':'c', 'reads_per_second':100.0, 'peak_memory':1000},
+                    {'name':'d', 'reads_per_second':100.0, 'peak_memory':1000}]}
+        report = {'version':'1.0.2', 'python':'3', 'settings':{'reads':1, 'read_length':1, 'profile':'bowtie2'},
+                  'results':[
+                    {'name':'a', 'reads_per_second':85.0, 'peak_memory':1000},
+                    {'name':'b', 'reads_per_second':95.0, 'peak_memory':1200},
+                    {'name':'c', 'reads_per_second':120.0, 'peak_memory':900},
+                    {'name':'d', 'reads_per_second':105.0, 'peak_memory':None},
+                    {'name':'e', 'reads_per_second':1.0, 'peak_memory':1}]}
+        self.assertEqual([x[-1] for x in compare_to_baseline(report, baseline)],
+                         ['slower', 'more memory', 'faster', 'ok', 'new'])
+        self.assertEqual([x[-1] for x in compare_to_baseline(report, baseline, tolerance=0.25)],
+                         ['ok', 'ok', 'ok', 'ok', 'new'])
+        #baselines run with different settings are printed without a status
+        outfile = io.StringIO()
+        rows = output_benchmarks(report, baseline, outfile=outfile)
+        self.assertIn('different settings', outfile.getvalue())
+        self.assertNotIn('more memory', outfile.getvalue())
+        self.assertEqual([x[-1] for x in rows], [''] * 5)
+        self.assertEqual(rows[0][1:3], (100.0, 85.0))
+        outfile = io.StringIO()
+        rows = output_benchmarks(report, dict(baseline, settings=report['settings']), outfile=outfile)
+        self.assertNotIn('different settings', outfile.getvalue())
+        self.assertIn('more memory', outfile.getvalue())
+        self.assertEqual([x[-1] for x in rows], ['slower', 'more memory', 'faster', 'ok', 'new'])
+        pass
+
+    def test_stored_baseline(self):
+        with open(DEFAULT_BASELINE) as f:
+            baseline = json.load(f)
+        self.assertEqual(baseline['format'], REPORT_FORMAT)
+        self.assertEqual([x['name'] for x in baseline['results']], list(BENCHMARKS))
+        self.assertEqual(baseline['settings'], json.loads(json.dumps(data_settings())))
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
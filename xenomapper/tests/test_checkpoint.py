@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_checkpoint.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io, os
+from collections import Counter
+from pkg_resources import resource_filename
+from xenomapper.checkpoint import *
+from xenomapper.sam import sam_lines
+from xenomapper.writers import OUTPUT_CATEGORIES, SamWriter
+from xenomapper.bam import BamWriter, bam_records
+from xenomapper.xenomapper import get_sam_header, getRawReadPairs, main_single_end, main_paired_end
+from xenomapper.tests.helpers import InputFiles
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+class Interrupted(Exception):
+    pass
+
+class test_checkpoint(InputFiles, unittest.TestCase):
+    def setUp(self):
+        InputFiles.setUp(self)
+        self.checkpoint_file = os.path.join(self.tempdir.name, 'run.checkpoint')
+        pass
+
+    def open_outputs(self, mode='wb', bam=False):
+        files = {category:open(os.path.join(self.tempdir.name, category), mode) for category in OUTPUT_CATEGORIES}
+        self.files.extend(files.values())
+        writers = {category:BamWriter(f) if bam else SamWriter(f) for category, f in files.items()}
+        return writers, files
+
+    def read_outputs(self):
+        outputs = {}
+        for category in OUTPUT_CATEGORIES:
+            with open(os.path.join(self.tempdir.name, category), 'rb') as f:
+                outputs[category] = f.read()
+        return outputs
+
+    def get_header(self):
+        with open(resource_filename(__name__, 'data/paired_end_testdata_human.sam'), 'rb') as f:
+            return get_sam_header(f)
+
+    def run_interrupted(self, main_function, paired, interval, stop_after, bam=False):
+        """Run with checkpoints, raising an exception in the batch after stop_after batches"""
+        batches = []
+        def interrupted_main(readpairs, **kw):
+            batches.append(readpairs)
+            if len(batches) > stop_after:
+                raise Interrupted()
+            return main_function(readpairs, **kw)
+        samfiles = self.open_inputs()
+        writers, files = self.open_outputs(bam=bam)
+        if bam:
+            for writer in writers.values():
+                writer.write_header(self.get_header())
+        checkpoint = Checkpoint({'paired':paired})
+        with self.assertRaises(Interrupted):
+            checkpointed_main(interrupted_main, getRawReadPairs(*samfiles, skip_repeated_reads=not paired),
+                              samfiles, writers, files, checkpoint, self.checkpoint_file,
+                              interval=interval, paired=paired)
+        #output written after the last checkpoint
+        for f in files.values():
+            f.write(b'partial')
+            f.flush()
+        pass
+
+    def resume(self, main_function, paired, interval, bam=False):
+        checkpoint = Checkpoint.load(self.checkpoint_file)
+        checkpoint.check_settings({'paired':paired})
+        samfiles = self.open_inputs()
+        writers, files = self.open_outputs(mode='r+b', bam=bam)
+        truncate_outputs(files, checkpoint.output_sizes)
+        for writer in writers.values():
+            HeaderRestorer(writer).write_header(self.get_header())
+        for samfile, offset in zip(samfiles, checkpoint.input_offsets):
+            samfile.seek(offset)
+        counts = checkpointed_main(main_function, getRawReadPairs(*samfiles, skip_repeated_reads=not paired),
+                                   samfiles, writers, files, checkpoint, self.checkpoint_file,
+                                   interval=interval, paired=paired)
+        for writer in writers.values():
+            writer.close()
+        return counts
+
+    def run_uninterrupted(self, main_function, paired):
+        samfiles = self.open_inputs()
+        outputs = {category:io.BytesIO() for category in OUTPUT_CATEGORIES}
+        counts = main_function(getRawReadPairs(*samfiles, skip_repeated_reads=not paired),
+                               **{category:SamWriter(f) for category, f in outputs.items()})
+        return counts, {category:f.getvalue() for category, f in outputs.items()}
+
+    def test_save_load(self):
+        checkpoint = Checkpoint({'paired':True, 'min_score':'-inf'}, [10, 20], {'unassigned':30},
+                                Counter({('primary_specific', 'unassigned'):3}))
+        checkpoint.save(self.checkpoint_file)
+        self.assertFalse(os.path.exists(self.checkpoint_file + '.tmp'))
+        loaded = Checkpoint.load(self.checkpoint_file)
+        self.assertEqual(loaded.settings, checkpoint.settings)
+        self.assertEqual(loaded.input_offsets, [10, 20])
+        self.assertEqual(loaded.output_sizes, {'unassigned':30})
+        self.assertEqual(loaded.category_counts, Counter({('primary_specific', 'unassigned'):3}))
+        loaded.check_settings({'paired':True, 'min_score':'-inf'})
+        with self.assertRaises(ValueError):
+            loaded.check_settings({'paired':False, 'min_score':'-inf'})
+        pass
+
+    def test_line_offset(self):
+        #the last line has no newline
+        samfile = io.BytesIO(b'a\t1\nb\t2\nc\t3')
+        self.assertEqual([line_offset(samfile, line) for line in sam_lines(samfile)], [0, 4, 8])
+        pass
+
+    def test_checkpoint_batches(self):
+        samfiles = self.open_inputs()
+        batches = list(checkpoint_batches(getRawReadPairs(*samfiles), samfiles, interval=5, paired=True))
+        self.assertEqual(sum([len(batch) for batch, offsets in batches]), 476)
+        for (batch, offsets), (next_batch, next_offsets) in zip(batches, batches[1:]):
+            self.assertNotEqual(batch[-1][0][0], next_batch[0][0][0]) #pairs are not split
+            for samfile, offset, line in zip(samfiles, offsets, next_batch[0]):
+                position = samfile.tell()
+                samfile.seek(offset)
+                self.assertEqual(samfile.readline(), line.raw)
+                samfile.seek(position)
+        self.assertEqual(batches[-1][1], [samfile.seek(0, 2) for samfile in samfiles])
+        pass
+
+    def test_truncate_outputs(self):
+        writers, files = self.open_outputs()
+        files['unassigned'].write(b'0123456789')
+        truncate_outputs(files, {'unassigned':4})
+        files['unassigned'].write(b'ab')
+        files['unassigned'].flush()
+        self.assertEqual(self.read_outputs()['unassigned'], b'0123ab')
+        with self.assertRaises(ValueError):
+            truncate_outputs(files, {'unassigned':100})
+        pass
+
+    def test_resume_single_end(self):
+        self.run_interrupted(main_single_end, paired=False, interval=50, stop_after=2)
+        self.assertEqual(sum(Checkpoint.load(self.checkpoint_file).category_counts.values()), 100)
+        counts = self.resume(main_single_end, paired=False, interval=50)
+        expected_counts, expected_outputs = self.run_uninterrupted(main_single_end, paired=False)
+        self.assertEqual(counts, expected_counts)
+        self.assertEqual(self.read_outputs(), expected_outputs)
+        pass
+
+    def test_resume_paired_end(self):
+        self.run_interrupted(main_paired_end, paired=True, interval=31, stop_after=3)
+        counts = self.resume(main_paired_end, paired=True, interval=31)
+        expected_counts, expected_outputs = self.run_uninterrupted(main_paired_end, paired=True)
+        self.assertEqual(counts, expected_counts)
+        self.assertEqual(self.read_outputs(), expected_outputs)
+        pass
+
+    def test_resume_bam_output(self):
+        self.run_interrupted(main_paired_end, paired=True, interval=40, stop_after=2, bam=True)
+        counts = self.resume(main_paired_end, paired=True, interval=40, bam=True)
+        expected_counts, expected_outputs = self.run_uninterrupted(main_paired_end, paired=True)
+        self.assertEqual(counts, expected_counts)
+        for category, data in self.read_outputs().items():
+            #BGZF blocks end at each checkpoint so compare the records
+            self.assertEqual([list(x) for x in bam_records(io.BytesIO(data))],
+                             [line.split('\t') for line in expected_outputs[category].decode().splitlines()])
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_estimate.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io
+import itertools
+from pkg_resources import resource_stream
+from xenomapper.estimate import *
+from xenomapper.xenomapper import get_sam_header, getRawReadPairs, main_single_end, main_paired_end
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+class test_estimate(unittest.TestCase):
+    def setUp(self):
+        self.sam1 = resource_stream(__name__, 'data/paired_end_testdata_human.sam')
+        self.sam2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.sam')
+        get_sam_header(self.sam1)
+        get_sam_header(self.sam2)
+        self.readpairs = list(getRawReadPairs(self.sam1, self.sam2))
+        self.sam1.seek(0)
+        self.sam2.seek(0)
+        get_sam_header(self.sam1)
+        get_sam_header(self.sam2)
+        pass
+
+    def tearDown(self):
+        self.sam1.close()
+        self.sam2.close()
+        pass
+
+    def test_wilson_interval(self):
+        low, high = wilson_interval(50, 100)
+        self.assertAlmostEqual(low, 0.4038, places=4)
+        self.assertAlmostEqual(high, 0.5962, places=4)
+        low, high = wilson_interval(0, 100)
+        self.assertEqual(low, 0.0)
+        self.assertAlmostEqual(high, 0.0370, places=4)
+        self.assertEqual(wilson_interval(0, 0), (0.0, 1.0))
+        pass
+
+    def test_sequential_groups(self):
+        groups = list(sequential_groups(iter(self.readpairs)))
+        self.assertEqual(len(groups), 238)
+        self.assertEqual([len(x) for x in groups], [2] * 238)
+        pass
+
+    def test_sampler_paired(self):
+        expected = {tuple([(x.raw, y.raw) for x, y in group]) for group in sequential_groups(iter(self.readpairs))}
+        sampler = SamSampler(self.sam1, self.sam2, paired=True, seed=1)
+        samples = [tuple([(x.raw, y.raw) for x, y in group]) for group in itertools.islice(sampler, 2000)]
+        self.assertTrue(set(samples) <= expected)
+        self.assertEqual(len(set(samples)), 238) #every pair is sampled
+        self.assertTrue(sampler.searched < 2000 * 2**18)
+        pass
+
+    def test_sampler_single_end(self):
+        expected = {(x.raw, y.raw) for x, y in getRawReadPairs(io.BytesIO(b''.join([x.raw for x, y in self.readpairs])),
+                                                              io.BytesIO(b''.join([y.raw for x, y in self.readpairs])),
+                                                              skip_repeated_reads=True)}
+        sampler = SamSampler(self.sam1, self.sam2, seed=2)
+        samples = [[(x.raw, y.raw) for x, y in group] for group in itertools.islice(sampler, 2000)]
+        self.assertEqual([len(x) for x in samples], [1] * 2000)
+        self.assertEqual({x[0] for x in samples}, expected)
+        pass
+
+    def test_sampler_not_found(self):
+        sam2 = io.BytesIO(b''.join([y.raw for x, y in self.readpairs[:100]]))
+        with self.assertRaises(ValueError):
+            list(itertools.islice(SamSampler(self.sam1, sam2, paired=True, seed=1), 1000))
+        pass
+
+    def test_estimate_category_counts(self):
+        expected = main_paired_end(iter(self.readpairs), primary_specific=None)
+        counts, converged = estimate_category_counts(sequential_groups(iter(self.readpairs)), main_paired_end,
+                                                     precision=0.0)
+        self.assertEqual(counts, expected)
+        self.assertFalse(converged)
+        counts, converged = estimate_category_counts(SamSampler(self.sam1, self.sam2, paired=True, seed=3),
+                                                     main_paired_end, precision=0.02)
+        self.assertTrue(converged)
+        self.assertTrue(max_half_width(counts) <= 0.02)
+        total = sum(counts.values())
+        for category in expected:
+            #the sample proportions are close to the proportions of the whole file
+            self.assertAlmostEqual(counts[category] / total, expected[category] / 238, delta=0.05)
+        counts, converged = estimate_category_counts(SamSampler(self.sam1, self.sam2, seed=3),
+                                                     main_single_end, precision=0.0, max_reads=500)
+        self.assertEqual(sum(counts.values()), 500)
+        self.assertFalse(converged)
+        pass
+
+    def test_estimate_bounds(self):
+        #single end reads are never counted by main_paired_end
+        single = [[(x, y)] for x, y in self.readpairs]
+        with self.assertRaises(ValueError):
+            estimate_category_counts(iter(single * 10), main_paired_end, empty_groups=100)
+        with self.assertRaises(ValueError):
+            estimate_category_counts(iter(single), main_paired_end)
+        counts, converged = estimate_category_counts(itertools.cycle(sequential_groups(iter(self.readpairs))),
+                                                     main_paired_end, precision=0.0, max_groups=50)
+        self.assertEqual(sum(counts.values()), 50)
+        self.assertFalse(converged)
+        pass
+
+    def test_sampler_bounded(self):
+        sampler = SamSampler(self.sam1, self.sam2, paired=True, seed=1)
+        samples = list(sampler.bounded())
+        self.assertTrue(sampler.exhausted)
+        self.assertEqual(len(samples), sampler.draws)
+        #the file has 238 pairs
+        self.assertAlmostEqual(sampler.estimated_reads(), 238, delta=30)
+        self.assertTrue(200 < len(samples) < 280)
+        pass
+
+    def test_output_estimate(self):
+        outfile = io.StringIO()
+        output_estimate({'primary_specific':75, 'unassigned':25}, converged=False, outfile=outfile)
+        self.assertIn('100 randomly sampled reads', outfile.getvalue())
+        self.assertIn('|  primary_specific                                  |             75  |     0.7500 | 0.6570 - 0.8245   |',
+                      outfile.getvalue())
+        self.assertIn('WARNING', outfile.getvalue())
+        outfile = io.StringIO()
+        output_estimate({'primary_specific':75, 'unassigned':25}, complete=True, outfile=outfile)
+        self.assertIn('100 reads, the complete file', outfile.getvalue())
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
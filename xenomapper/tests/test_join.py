@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_join.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io
+import random
+from pkg_resources import resource_stream
+from xenomapper.join import *
+from xenomapper.bam import BamReader
+from xenomapper.xenomapper import get_sam_header, getRawReadPairs, main_paired_end, main_single_end
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+def shuffled(records, seed):
+    """Return a list of records with groups of records with the same name in random order"""
+    groups = [group for qname, group in group_reads(records, paired=True)]
+    random.Random(seed).shuffle(groups)
+    return [x for group in groups for x in group]
+
+class test_join(unittest.TestCase):
+    def setUp(self):
+        self.sam1 = resource_stream(__name__, 'data/paired_end_testdata_human.sam')
+        self.sam2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.sam')
+        get_sam_header(self.sam1)
+        get_sam_header(self.sam2)
+        self.ordered = list(getRawReadPairs(self.sam1, self.sam2))
+        self.records1 = shuffled([x[0] for x in self.ordered], 1)
+        self.records2 = shuffled([x[1] for x in self.ordered], 2)
+        pass
+
+    def tearDown(self):
+        self.sam1.close()
+        self.sam2.close()
+        pass
+
+    def test_group_reads(self):
+        records = [['read1','0'], ['read1','256'], ['read2','0'], ['read1','0']]
+        self.assertEqual(list(group_reads(records)),
+                         [('read1', [['read1','0']]), ('read2', [['read2','0']]), ('read1', [['read1','0']])])
+        self.assertEqual(list(group_reads(records, paired=True)),
+                         [('read1', [['read1','0'], ['read1','256']]), ('read2', [['read2','0']]), ('read1', [['read1','0']])])
+        pass
+
+    def test_join_paired(self):
+        for memory_limit in (2**30, 2000):
+            joiner = ReadPairJoiner(iter(self.records1), iter(self.records2), paired=True, memory_limit=memory_limit)
+            pairs = list(joiner)
+            self.assertEqual(sorted([(x.raw, y.raw) for x, y in pairs]),
+                             sorted([(x.raw, y.raw) for x, y in self.ordered]))
+            for i in range(0, len(pairs), 2): #pairs are kept together
+                self.assertEqual(pairs[i][0].qname, pairs[i+1][0].qname)
+            self.assertTrue(joiner.peak_buffered > 0)
+            if memory_limit == 2000:
+                self.assertTrue(joiner.peak_bytes <= 2000 + 1000)
+                self.assertTrue(joiner.spilled > 0)
+            else:
+                self.assertEqual(joiner.spilled, 0)
+        pass
+
+    def test_join_counts(self):
+        ordered_counts = main_paired_end(iter(self.ordered), primary_specific=None)
+        joined_counts = main_paired_end(ReadPairJoiner(self.records1, self.records2, paired=True, memory_limit=5000),
+                                        primary_specific=None)
+        self.assertEqual(ordered_counts, joined_counts)
+        ordered_counts = main_single_end(getRawReadPairs(io.BytesIO(b''.join([x[0].raw for x in self.ordered])),
+                                                         io.BytesIO(b''.join([x[1].raw for x in self.ordered])),
+                                                         skip_repeated_reads=True), primary_specific=None)
+        joined_counts = main_single_end(ReadPairJoiner(self.records1, self.records2, memory_limit=5000),
+                                        primary_specific=None)
+        self.assertEqual(ordered_counts, joined_counts)
+        pass
+
+    def test_join_bam_spill(self):
+        bam1 = BamReader(resource_stream(__name__, 'data/paired_end_testdata_human.bam'))
+        bam2 = BamReader(resource_stream(__name__, 'data/paired_end_testdata_mouse.bam'))
+        records1 = shuffled(bam1, 3)
+        records2 = shuffled(bam2, 4)
+        joiner = ReadPairJoiner(records1, records2, paired=True, memory_limit=2000)
+        pairs = sorted([(list(x), list(y)) for x, y in joiner])
+        self.assertTrue(joiner.spilled > 0)
+        self.assertEqual(pairs, sorted([(list(x), list(y)) for x, y in self.ordered]))
+        bam1.fileobj.close()
+        bam2.fileobj.close()
+        pass
+
+    def test_unmatched(self):
+        for memory_limit in (2**30, 2000):
+            with self.assertRaises(ValueError):
+                list(ReadPairJoiner(self.records1[:-2], self.records2, paired=True, memory_limit=memory_limit))
+        with self.assertRaises(ValueError):
+            list(ReadPairJoiner(self.records1[:-1], self.records2, paired=True))
+        pass
+
+    def test_output_join_summary(self):
+        joiner = ReadPairJoiner(self.records1, self.records2, paired=True)
+        list(joiner)
+        outfile = io.StringIO()
+        output_join_summary(joiner, outfile=outfile)
+        self.assertIn('peak {0} unmatched reads'.format(joiner.peak_buffered), outfile.getvalue())
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
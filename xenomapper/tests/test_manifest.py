@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_manifest.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io, os
+import gzip
+from functools import partial
+from pkg_resources import resource_filename
+from xenomapper.manifest import *
+from xenomapper.policies import PairPolicy, CONSERVATIVE
+from xenomapper.profiles import BOWTIE2
+from xenomapper.xenomapper import get_sam_header, getRawReadPairs, get_score_function, main_single_end, \
+                                  main_paired_end, conservative_main_paired_end, policy_main_paired_end
+from xenomapper.tests.test_policies import PRIMARY_ONLY_RULES
+from xenomapper.tests.helpers import InputFiles, string_outputs, output_values
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+class test_manifest(InputFiles, unittest.TestCase):
+    def setUp(self):
+        InputFiles.setUp(self)
+        self.manifest_file = os.path.join(self.tempdir.name, 'run.manifest')
+        pass
+
+    def run_main(self, main_function, paired, policy=LIBERAL, min_score=float('-inf'), interval=7):
+        """Classify the test data writing every output and recording a manifest"""
+        samfiles = self.open_inputs(paired)
+        writer = ManifestWriter(open(self.manifest_file, 'wb'), {'paired':paired}, samfiles=samfiles,
+                                interval=interval)
+        readpairs = writer.record(getRawReadPairs(*samfiles, skip_repeated_reads=not paired),
+                                  get_score_function(BOWTIE2), min_score=min_score, paired=paired, policy=policy)
+        outputs = self.classify(main_function, readpairs, min_score=min_score)[1]
+        writer.close()
+        return outputs
+
+    def run_extract(self, paired, categories=OUTPUT_CATEGORIES, samfiles=None):
+        manifest = Manifest(self.manifest_file)
+        outputs = string_outputs(categories)
+        counts = extract(manifest, samfiles or self.open_inputs(paired), outputs)
+        manifest.close()
+        return counts, output_values(outputs)
+
+    def test_single_end(self):
+        expected = self.run_main(main_single_end, paired=False, min_score=20)
+        manifest = Manifest(self.manifest_file)
+        self.assertEqual(manifest.settings['paired'], False)
+        self.assertEqual(manifest.settings['indexed'], True)
+        self.assertEqual([x[0] for x in manifest.index], list(range(0, len(manifest), 7)))
+        category_counts = main_single_end(getRawReadPairs(*self.open_inputs(paired=False)), min_score=20,
+                                          primary_specific=None)
+        self.assertEqual(manifest.category_counts(), category_counts)
+        manifest.close()
+        counts, outputs = self.run_extract(paired=False)
+        self.assertEqual(outputs, expected)
+        self.assertEqual(counts, category_counts)
+        pass
+
+    def test_paired_end(self):
+        for main_function, policy in ((main_paired_end, LIBERAL),
+                                      (conservative_main_paired_end, CONSERVATIVE),
+                                      (None, PairPolicy.parse(PRIMARY_ONLY_RULES.splitlines()))):
+            main_function = main_function or partial(policy_main_paired_end, policy=policy)
+            expected = self.run_main(main_function, paired=True, policy=policy, min_score=50)
+            manifest = Manifest(self.manifest_file)
+            #pairs are never split between blocks
+            for row, offset1, offset2 in manifest.index:
+                self.assertEqual(manifest.codes[row], UNPAIRED)
+            manifest.close()
+            self.assertEqual(self.run_extract(paired=True)[1], expected)
+        pass
+
+    def test_extract_category(self):
+        expected = self.run_main(main_paired_end, paired=True, interval=4)
+        manifest = Manifest(self.manifest_file)
+        samfiles = self.open_inputs(paired=True)
+        wanted = bytes((OUTPUT_CATEGORIES.index('unresolved'),))
+        blocks = [x for x in manifest.blocks() if wanted in bytes(manifest.codes[x[0]:x[1]])]
+        self.assertTrue(0 < len(blocks) < len(manifest.index))
+        manifest.close()
+        counts, outputs = self.run_extract(paired=True, categories=['unresolved'], samfiles=samfiles)
+        self.assertEqual(outputs['unresolved'], expected['unresolved'])
+        self.assertEqual(list(counts), ['unresolved'])
+        pass
+
+    def test_no_index(self):
+        expected = self.run_main(main_paired_end, paired=True)
+        samfiles = self.open_inputs(paired=True)
+        writer = ManifestWriter(open(self.manifest_file, 'wb'), {'paired':True})
+        main_paired_end(writer.record(getRawReadPairs(*samfiles), get_score_function(BOWTIE2), paired=True),
+                        primary_specific=None)
+        writer.close()
+        manifest = Manifest(self.manifest_file)
+        self.assertEqual(manifest.settings['indexed'], False)
+        self.assertEqual(manifest.index, [])
+        manifest.close()
+        with open(resource_filename(__name__, 'data/paired_end_testdata_human.sam'), 'rb') as f:
+            compressed = gzip.open(io.BytesIO(gzip.compress(f.read())))
+        get_sam_header(compressed)
+        samfiles = [compressed, self.open_inputs(paired=True)[1]]
+        self.assertEqual(self.run_extract(paired=True, samfiles=samfiles)[1], expected)
+        pass
+
+    def test_invalid_manifest(self):
+        with open(self.manifest_file, 'wb') as f:
+            f.write(b'@HD\tVN:1.0\n')
+        with self.assertRaises(ValueError):
+            Manifest(self.manifest_file)
+        writer = ManifestWriter(open(self.manifest_file, 'wb'), {'paired':False})
+        writer.outfile.close()
+        with self.assertRaises(ValueError):
+            Manifest(self.manifest_file)
+        #inputs shorter than the manifest
+        self.run_main(main_single_end, paired=False)
+        manifest = Manifest(self.manifest_file)
+        with self.assertRaises(ValueError):
+            extract(manifest, [io.BytesIO(), io.BytesIO()], {'unassigned':io.StringIO(),
+                                                             'primary_specific':io.StringIO()})
+        manifest.close()
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
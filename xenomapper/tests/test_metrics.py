@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_metrics.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io
+import json
+from pkg_resources import resource_stream
+from xenomapper.metrics import *
+from xenomapper.profiles import BOWTIE2
+from xenomapper.writers import OUTPUT_CATEGORIES, SamWriter
+from xenomapper.xenomapper import get_sam_header, getRawReadPairs, main_single_end, main_paired_end
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+class Unseekable(io.BytesIO):
+    def seekable(self):
+        return False
+
+class test_metrics(unittest.TestCase):
+    def setUp(self):
+        self.sam1 = resource_stream(__name__, 'data/paired_end_testdata_human.sam')
+        self.sam2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.sam')
+        pass
+
+    def tearDown(self):
+        self.sam1.close()
+        self.sam2.close()
+        pass
+
+    def run_main(self, main_function, metrics=None, paired=True):
+        outputs = {category:io.BytesIO() for category in OUTPUT_CATEGORIES}
+        writers = {category:SamWriter(f) for category, f in outputs.items()}
+        self.sam1.seek(0)
+        self.sam2.seek(0)
+        get_sam_header(self.sam1)
+        get_sam_header(self.sam2)
+        readpairs = getRawReadPairs(self.sam1, self.sam2, skip_repeated_reads=not paired)
+        if metrics:
+            counts = metered_main(main_function, metrics.timed_readpairs(readpairs, check_every=10), metrics,
+                                  batch_size=50, paired=paired, tag_func=metrics.timed_profile(BOWTIE2),
+                                  **metrics.timed_outputs(writers))
+        else:
+            counts = main_function(readpairs, tag_func=BOWTIE2, **writers)
+        return counts, {category:f.getvalue() for category, f in outputs.items()}
+
+    def test_metered_reader(self):
+        reader = MeteredReader(io.BytesIO(b'abc\ndef\nghi'))
+        self.assertEqual(reader.readline(), b'abc\n')
+        self.assertEqual(reader.read(2), b'de')
+        self.assertEqual(list(reader), [b'f\n', b'ghi'])
+        self.assertEqual(reader.bytes_read, 11)
+        self.assertEqual(reader.tell(), 11)
+        pass
+
+    def test_meter_input(self):
+        metrics = Metrics()
+        seekable = io.BytesIO(b'abc\ndef\n')
+        self.assertIs(metrics.meter_input('primary', seekable), seekable)
+        unseekable = metrics.meter_input('secondary', Unseekable(b'abc\ndef\n'))
+        self.assertIsInstance(unseekable, MeteredReader)
+        seekable.readline()
+        unseekable.read()
+        self.assertEqual(metrics.bytes_read(), {'primary':4, 'secondary':8})
+        pass
+
+    def test_timed_profile(self):
+        profile = TimedProfile(BOWTIE2, sample_every=1)
+        self.sam1.seek(0)
+        get_sam_header(self.sam1)
+        line = next(getRawReadPairs(self.sam1, self.sam1))[0]
+        self.assertEqual(profile.scores(line), BOWTIE2.scores(line))
+        self.assertTrue(profile.seconds > 0)
+        self.assertEqual(repr(profile), repr(BOWTIE2))
+        pass
+
+    def test_metered_main(self):
+        for main_function, paired in ((main_single_end, False), (main_paired_end, True)):
+            outfile = io.StringIO()
+            metrics = Metrics(outfile=outfile, json_lines=True, interval=0)
+            counts, outputs = self.run_main(main_function, metrics, paired=paired)
+            expected_counts, expected_outputs = self.run_main(main_function, paired=paired)
+            self.assertEqual(counts, expected_counts)
+            self.assertEqual(outputs, expected_outputs)
+            self.assertEqual(metrics.category_counts, expected_counts)
+            self.assertEqual(metrics.reads, sum(expected_counts.values()))
+            self.assertEqual(metrics.records, 476 if paired else sum(expected_counts.values()))
+            reports = [json.loads(line) for line in outfile.getvalue().splitlines()]
+            self.assertTrue(len(reports) > 1) #reported while running
+            self.assertEqual(sorted(reports[-1]['timings']), ['classification', 'parsing', 'tags', 'writing'])
+            self.assertTrue(all(x >= 0 for x in reports[-1]['timings'].values()))
+        self.assertIn('primary_specific/primary_specific', reports[-1]['category_counts'])
+        pass
+
+    def test_text_report(self):
+        outfile = io.StringIO()
+        metrics = Metrics(outfile=outfile)
+        metrics.meter_input('primary', io.BytesIO(b'x' * 2**20)).read()
+        metrics.category_counts.update({'unassigned':3})
+        metrics.report()
+        self.assertTrue(outfile.getvalue().startswith('[metrics] '))
+        self.assertIn('primary 1.0 MB', outfile.getvalue())
+        self.assertIn('| unassigned 3\n', outfile.getvalue())
+        metrics.report_if_due() #the interval has not passed
+        self.assertEqual(outfile.getvalue().count('\n'), 1)
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
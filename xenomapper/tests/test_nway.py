@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_nway.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io
+import itertools
+from pkg_resources import resource_stream
+from xenomapper.nway import *
+from xenomapper.sam import sam_lines
+from xenomapper.bam import BamReader
+from xenomapper.writers import SamWriter
+from xenomapper.xenomapper import get_sam_header, get_mapping_state, getRawReadPairs, main_single_end, \
+                                  main_paired_end, conservative_main_paired_end
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+TWO_WAY = ('primary', 'secondary')
+
+class test_nway(unittest.TestCase):
+    def setUp(self):
+        self.files = []
+        pass
+
+    def tearDown(self):
+        for f in self.files:
+            f.close()
+        pass
+
+    def open_sam(self, species):
+        f = resource_stream(__name__, 'data/paired_end_testdata_{0}.sam'.format(species))
+        self.files.append(f)
+        get_sam_header(f)
+        return sam_lines(f)
+
+    def test_nway_categories(self):
+        self.assertEqual(nway_categories(TWO_WAY), ('primary_specific', 'secondary_specific', 'primary_multi',
+                                                    'secondary_multi', 'unresolved', 'unassigned'))
+        self.assertEqual(len(nway_categories(['human', 'mouse', 'virus'])), 8)
+        pass
+
+    def test_get_nway_mapping_state(self):
+        values = (float('-inf'), -20, -10, 0)
+        categories = nway_categories(TWO_WAY)
+        for AS1, XS1, AS2, XS2 in itertools.product(values, repeat=4):
+            for min_score in (float('-inf'), -15):
+                self.assertEqual(categories[get_nway_mapping_state([(AS1, XS1), (AS2, XS2)], min_score)],
+                                 get_mapping_state(AS1, XS1, AS2, XS2, min_score))
+        self.assertEqual(get_nway_mapping_state([(-10, -20), (-5, -5), (-8, -30)]), 4) #multi in species 1
+        self.assertEqual(get_nway_mapping_state([(-10, -20), (-5, -9), (-5, -30)]), 6) #unresolved
+        self.assertEqual(get_nway_mapping_state([(-10, -20), (-5, -9), (-5, -30)], min_score=0), 7)
+        pass
+
+    def test_get_nway_pair_state(self):
+        #three species: 0-2 specific, 3-5 multi, 6 unresolved, 7 unassigned
+        self.assertEqual(get_nway_pair_state(1, 7, 3), 1)
+        self.assertEqual(get_nway_pair_state(2, 3, 3), 2)
+        self.assertEqual(get_nway_pair_state(1, 7, 3, conservative=True), 7)
+        self.assertEqual(get_nway_pair_state(2, 3, 3, conservative=True), 6)
+        self.assertEqual(get_nway_pair_state(2, 5, 3, conservative=True), 2)
+        self.assertEqual(get_nway_pair_state(6, 2, 3, conservative=True), 6)
+        pass
+
+    def test_two_way_single_end(self):
+        outfile = io.BytesIO()
+        counts = nway_main_single_end(getReadSets([self.open_sam('human'), self.open_sam('mouse')],
+                                                  skip_repeated_reads=True),
+                                      TWO_WAY, outputs={'primary_specific':SamWriter(outfile)})
+        expected_outfile = io.BytesIO()
+        sam1 = resource_stream(__name__, 'data/paired_end_testdata_human.sam')
+        sam2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.sam')
+        self.files.extend([sam1, sam2])
+        get_sam_header(sam1)
+        get_sam_header(sam2)
+        expected = main_single_end(getRawReadPairs(sam1, sam2, skip_repeated_reads=True),
+                                   primary_specific=SamWriter(expected_outfile))
+        self.assertEqual(counts, expected)
+        self.assertEqual(outfile.getvalue(), expected_outfile.getvalue())
+        pass
+
+    def test_two_way_paired_end(self):
+        for conservative, main_function in ((False, main_paired_end), (True, conservative_main_paired_end)):
+            outputs = {x:io.BytesIO() for x in nway_categories(TWO_WAY)}
+            counts = nway_main_paired_end(getReadSets([self.open_sam('human'), self.open_sam('mouse')]), TWO_WAY,
+                                          outputs={x:SamWriter(y) for x, y in outputs.items()},
+                                          conservative=conservative)
+            expected_outputs = {x:io.BytesIO() for x in nway_categories(TWO_WAY)}
+            sam1 = resource_stream(__name__, 'data/paired_end_testdata_human.sam')
+            sam2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.sam')
+            self.files.extend([sam1, sam2])
+            get_sam_header(sam1)
+            get_sam_header(sam2)
+            expected = main_function(getRawReadPairs(sam1, sam2),
+                                     **{x:SamWriter(y) for x, y in expected_outputs.items()})
+            self.assertEqual(counts, expected)
+            for category in outputs:
+                self.assertEqual(outputs[category].getvalue(), expected_outputs[category].getvalue())
+        pass
+
+    def test_three_way(self):
+        #a second copy of the human alignments makes every read that is best in human unresolved
+        names = ('human', 'mouse', 'copy')
+        counts = nway_main_single_end(getReadSets([self.open_sam('human'), self.open_sam('mouse'),
+                                                   self.open_sam('human')], skip_repeated_reads=True), names)
+        expected = main_single_end(getReadSets([self.open_sam('human'), self.open_sam('mouse')],
+                                               skip_repeated_reads=True), primary_specific=None)
+        self.assertEqual(counts['human_specific'] + counts['human_multi'] + counts['copy_specific'], 0)
+        self.assertEqual(counts['mouse_specific'], expected['secondary_specific'])
+        self.assertEqual(counts['mouse_multi'], expected['secondary_multi'])
+        self.assertEqual(counts['unresolved'],
+                         expected['primary_specific'] + expected['primary_multi'] + expected['unresolved'])
+        self.assertEqual(counts['unassigned'], expected['unassigned'])
+        pass
+
+    def test_three_way_bam(self):
+        names = ('human', 'mouse', 'copy')
+        sam_counts = nway_main_paired_end(getReadSets([self.open_sam('human'), self.open_sam('mouse'),
+                                                       self.open_sam('human')]), names, conservative=True)
+        bams = [resource_stream(__name__, 'data/paired_end_testdata_{0}.bam'.format(x))
+                for x in ('human', 'mouse', 'human')]
+        self.files.extend(bams)
+        unresolved = io.BytesIO()
+        bam_counts = nway_main_paired_end(getReadSets([BamReader(x) for x in bams]), names,
+                                          outputs={'unresolved':SamWriter(unresolved)}, conservative=True)
+        self.assertEqual(sam_counts, bam_counts)
+        self.assertEqual(sum(bam_counts.values()), 238)
+        #unresolved pairs are written from every species
+        self.assertEqual(unresolved.getvalue().count(b'\n'),
+                         6 * sum([count for (forward, reverse), count in bam_counts.items()
+                                  if get_nway_pair_state(nway_categories(names).index(forward),
+                                                         nway_categories(names).index(reverse),
+                                                         3, conservative=True) == 6]))
+        pass
+
+    def test_write_count_matrix(self):
+        outfile = io.StringIO()
+        write_count_matrix({'a_specific':3, 'unassigned':1}, ['a', 'b'], outfile)
+        self.assertEqual(outfile.getvalue(), 'category\tcount\na_specific\t3\nb_specific\t0\n'
+                                             'a_multi\t0\nb_multi\t0\nunresolved\t0\nunassigned\t1\n')
+        outfile = io.StringIO()
+        write_count_matrix({('a_specific', 'unassigned'):2}, ['a'], outfile, paired=True)
+        self.assertEqual(outfile.getvalue(), 'forward\\reverse\ta_specific\ta_multi\tunresolved\tunassigned\n'
+                                             'a_specific\t0\t0\t0\t2\n'
+                                             'a_multi\t0\t0\t0\t0\n'
+                                             'unresolved\t0\t0\t0\t0\n'
+                                             'unassigned\t0\t0\t0\t0\n')
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
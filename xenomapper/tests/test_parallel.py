@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_parallel.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io
+from xenomapper.xenomapper import *
+from xenomapper.parallel import *
+from pkg_resources import resource_stream
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+def run_main(main_function, primary, secondary, threads=1, batch_size=10000, paired=False, skip_repeated_reads=False):
+    outputs = {category:io.StringIO() for category in OUTPUT_CATEGORIES}
+    sam1 = io.TextIOWrapper(resource_stream(__name__, primary))
+    sam2 = io.TextIOWrapper(resource_stream(__name__, secondary))
+    process_headers(sam1, sam2, **outputs)
+    readpairs = getReadPairs(sam1, sam2, skip_repeated_reads=skip_repeated_reads)
+    if threads > 1:
+        category_counts = parallel_main(main_function, readpairs, threads=threads,
+                                        batch_size=batch_size, paired=paired, **outputs)
+    else:
+        category_counts = main_function(readpairs, **outputs)
+    sam1.close()
+    sam2.close()
+    return category_counts, {category:outputs[category].getvalue() for category in outputs}
+
+class test_parallel(unittest.TestCase):
+    def test_batch_readpairs(self):
+        readpairs = [(['a'],['a']), (['a'],['a']), (['b'],['b']), (['b'],['b']), (['c'],['c'])]
+        self.assertEqual([len(x) for x in batch_readpairs(readpairs, batch_size=3)], [3,2])
+        self.assertEqual([len(x) for x in batch_readpairs(readpairs, batch_size=3, paired=True)], [4,1])
+        self.assertEqual([len(x) for x in batch_readpairs(readpairs, batch_size=1, paired=True)], [2,2,1])
+        self.assertEqual(list(batch_readpairs([], batch_size=3)), [])
+        pass
+    
+    def test_classify_batch(self):
+        batch = [(['a','0','','','','','','','','','','AS:i:10'], ['a','0','','','','','','','','','','AS:i:5']),
+                 (['b','0','','','','','','','','','','AS:i:5'], ['b','0','','','','','','','','','','AS:i:10'])]
+        category_counts, written = classify_batch(main_single_end, batch, ['primary_specific','secondary_specific'])
+        self.assertEqual(category_counts, {'primary_specific':1, 'secondary_specific':1})
+        self.assertEqual(written, {'primary_specific':[0], 'secondary_specific':[3]})
+        pass
+    
+    def test_parallel_single_end(self):
+        expected = run_main(main_single_end, 'data/test_human_in.sam', 'data/test_mouse_in.sam', skip_repeated_reads=True)
+        result = run_main(main_single_end, 'data/test_human_in.sam', 'data/test_mouse_in.sam',
+                          threads=2, batch_size=5, skip_repeated_reads=True)
+        self.assertEqual(result, expected)
+        pass
+    
+    def test_parallel_paired_end(self):
+        for main_function in (main_paired_end, conservative_main_paired_end):
+            expected = run_main(main_function, 'data/paired_end_testdata_human.sam', 'data/paired_end_testdata_mouse.sam')
+            result = run_main(main_function, 'data/paired_end_testdata_human.sam', 'data/paired_end_testdata_mouse.sam',
+                              threads=3, batch_size=7, paired=True)
+            self.assertEqual(result, expected)
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
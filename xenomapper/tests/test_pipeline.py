@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_pipeline.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import sys, io, os
+import hashlib
+import tempfile
+from pkg_resources import resource_filename
+from xenomapper.pipeline import *
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+def stand_in_command(species, *options):
+    """Return a command line for the stand in aligner writing the paired end test data for species"""
+    return [sys.executable, resource_filename(__name__, 'stand_in_aligner.py'),
+            resource_filename(__name__, 'data/paired_end_testdata_{0}.sam'.format(species))] + list(options)
+
+class test_pipeline(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.outfile = os.path.join(self.tempdir.name, 'primary_specific.sam')
+        self.stderr = sys.stderr
+        sys.stderr = io.StringIO() #discard the summary
+        pass
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        self.tempdir.cleanup()
+        pass
+
+    def pipeline_args(self, primary_command, secondary_command):
+        args = command_line_interface(['--paired', '--primary_specific', self.outfile,
+                                       '--primary_command', 'aligner', '--secondary_command', 'aligner'])
+        args.primary_command = primary_command
+        args.secondary_command = secondary_command
+        return args
+
+    def test_run_pipeline(self):
+        log = io.StringIO()
+        args = self.pipeline_args(stand_in_command('human'), stand_in_command('mouse'))
+        category_counts = run_pipeline(args, log=log)
+        self.assertEqual(sum(category_counts.values()), 238)
+        with open(self.outfile, 'rb') as f:
+            self.assertEqual(hashlib.sha224(f.read()).hexdigest(),'64c0e24bf141c5aa3bb0993c73b34cdfe630a504ac424843f746918d')
+        self.assertIn('[primary] stand in aligner reading', log.getvalue())
+        self.assertIn('[secondary] stand in aligner reading', log.getvalue())
+        pass
+
+    def test_aligner_exit_status(self):
+        args = self.pipeline_args(stand_in_command('human'), stand_in_command('mouse', '--exit', '3'))
+        with self.assertRaises(AlignerError) as context:
+            run_pipeline(args, log=None)
+        self.assertIn('secondary aligner', str(context.exception))
+        self.assertIn('exited with status 3', str(context.exception))
+        self.assertIn('stand in aligner failed', str(context.exception))
+        pass
+
+    def test_aligner_failure_before_header(self):
+        args = self.pipeline_args(stand_in_command('human', '--lines', '0', '--exit', '1'), stand_in_command('mouse'))
+        with self.assertRaises(AlignerError) as context:
+            run_pipeline(args, log=None)
+        self.assertIn('primary aligner', str(context.exception))
+        pass
+
+    def test_unmatched_reads(self):
+        args = self.pipeline_args(stand_in_command('human'), stand_in_command('mouse', '--lines', '100'))
+        with self.assertRaises(AlignerError) as context:
+            run_pipeline(args, log=None)
+        self.assertIn('primary aligner', str(context.exception))
+        self.assertIn('not matched', str(context.exception))
+        pass
+
+    def test_missing_aligner(self):
+        args = self.pipeline_args(stand_in_command('human'), ['./no_such_aligner_xenomapper'])
+        with self.assertRaises(OSError):
+            run_pipeline(args, log=None)
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
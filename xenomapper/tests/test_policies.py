@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_policies.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io, os
+import pickle
+import tempfile
+from functools import partial
+from xenomapper.policies import *
+from xenomapper.xenomapper import main_paired_end, conservative_main_paired_end, policy_main_paired_end
+from xenomapper.vectorised import numpy, vectorised_main
+from xenomapper.tests.test_parallel import run_main
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+#Keep primary reads, discard everything else
+PRIMARY_ONLY_RULES = """\
+primary_specific,primary_multi  primary_specific,primary_multi  primary_specific # concordant
+*  *  discard
+"""
+
+class test_policies(unittest.TestCase):
+    def test_builtin_policies(self):
+        self.assertEqual(LIBERAL.output_state('primary_specific', 'secondary_specific'), 'primary_specific')
+        self.assertEqual(LIBERAL.output_state('unassigned', 'secondary_multi'), 'secondary_multi')
+        self.assertEqual(LIBERAL.output_state('unassigned', 'unresolved'), 'unresolved')
+        self.assertEqual(LIBERAL.output_state('unassigned', 'unassigned'), 'unassigned')
+        self.assertEqual(CONSERVATIVE.output_state('primary_specific', 'unassigned'), 'unassigned')
+        self.assertEqual(CONSERVATIVE.output_state('primary_multi', 'secondary_specific'), 'unresolved')
+        self.assertEqual(CONSERVATIVE.output_state('primary_multi', 'primary_specific'), 'primary_specific')
+        self.assertEqual(CONSERVATIVE.output_state('secondary_multi', 'secondary_multi'), 'secondary_multi')
+        self.assertEqual(POLICIES, {'liberal':LIBERAL, 'conservative':CONSERVATIVE})
+        self.assertEqual(PairPolicy.parse(LIBERAL.rules().splitlines()), LIBERAL)
+        self.assertNotEqual(LIBERAL, CONSERVATIVE)
+        self.assertEqual(pickle.loads(pickle.dumps(CONSERVATIVE)), CONSERVATIVE)
+        pass
+
+    def test_parse(self):
+        policy = PairPolicy.parse(PRIMARY_ONLY_RULES.splitlines(), name='primary_only')
+        self.assertEqual(repr(policy), "PairPolicy('primary_only')")
+        self.assertEqual(policy.output_state('primary_multi', 'primary_specific'), 'primary_specific')
+        self.assertEqual(policy.output_state('primary_specific', 'unassigned'), 'discard')
+        self.assertEqual(policy.table.count(DISCARD), 32)
+        outfile = io.StringIO()
+        actions = policy.actions([outfile, None, None, None, None, None])
+        self.assertEqual(actions[PRIMARY_MULTI * 6 + PRIMARY_SPECIFIC], (outfile, PRIMARY_READS))
+        self.assertEqual(actions[UNRESOLVED * 6 + UNRESOLVED], (None, None))
+        with self.assertRaises(ValueError):
+            PairPolicy.parse(['primary_specific * primary_specific'])
+        with self.assertRaises(ValueError):
+            PairPolicy.parse(['* * human'])
+        with self.assertRaises(ValueError):
+            PairPolicy.parse(['* primary * primary_specific'])
+        with self.assertRaises(ValueError):
+            PairPolicy.parse(['human * primary_specific', '* * discard'])
+        with self.assertRaises(ValueError):
+            PairPolicy('short', [0] * 35)
+        pass
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'primary_only.txt')
+            with open(filename, 'w') as f:
+                f.write(PRIMARY_ONLY_RULES)
+            policy = PairPolicy.load(filename)
+        self.assertEqual(policy.name, filename)
+        self.assertEqual(policy, PairPolicy.parse(PRIMARY_ONLY_RULES.splitlines()))
+        pass
+
+    def test_pair_counts(self):
+        counts = [0] * 36
+        counts[PRIMARY_SPECIFIC * 6 + UNASSIGNED] = 3
+        self.assertEqual(pair_counts(counts), Counter({('primary_specific', 'unassigned'):3}))
+        pass
+
+    def test_policy_main_paired_end(self):
+        for policy, main_function in ((LIBERAL, main_paired_end), (CONSERVATIVE, conservative_main_paired_end)):
+            expected = run_main(main_function, 'data/paired_end_testdata_human.sam', 'data/paired_end_testdata_mouse.sam')
+            self.assertEqual(run_main(partial(policy_main_paired_end, policy=policy),
+                                      'data/paired_end_testdata_human.sam', 'data/paired_end_testdata_mouse.sam'),
+                             expected)
+        policy = PairPolicy.parse(PRIMARY_ONLY_RULES.splitlines())
+        counts, outputs = run_main(partial(policy_main_paired_end, policy=policy),
+                                   'data/paired_end_testdata_human.sam', 'data/paired_end_testdata_mouse.sam')
+        self.assertEqual(counts, run_main(main_paired_end, 'data/paired_end_testdata_human.sam',
+                                          'data/paired_end_testdata_mouse.sam')[0])
+        written = [x for x in outputs['primary_specific'].splitlines() if x[0] != '@']
+        self.assertEqual(len(written), 2 * sum(x for (forward, reverse),x in counts.items()
+                                               if forward in ('primary_specific', 'primary_multi')
+                                               and reverse in ('primary_specific', 'primary_multi')))
+        self.assertEqual(len(written), 280)
+        for category in OUTPUT_CATEGORIES[1:]:
+            self.assertEqual([x for x in outputs[category].splitlines() if x[0] != '@'], [])
+        if numpy is not None:
+            self.assertEqual(run_main(partial(vectorised_main, paired=True, policy=policy, batch_size=7),
+                                      'data/paired_end_testdata_human.sam', 'data/paired_end_testdata_mouse.sam'),
+                             (counts, outputs))
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_profiles.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io
+import pickle
+from pkg_resources import resource_stream
+from xenomapper.profiles import *
+from xenomapper.sam import SamLine
+from xenomapper.xenomapper import get_tag, get_tag_with_ZS_as_XS, get_cigarbased_AS_tag, get_score_function, \
+                                  get_sam_header, getReadPairs, getRawReadPairs, getBamReadPairs, \
+                                  main_paired_end
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+class test_profiles(unittest.TestCase):
+    def setUp(self):
+        self.raw = b'read1\t0\tchr1\t100\t42\t3S45M2D2M\t*\t0\t0\tACGT\tAS:i\tAS:i:-3\tNM:i:2\tXS:A:+\tZS:i:-10\tYT:Z:UU\n'
+        self.fields = self.raw.decode('ascii').split()
+        pass
+
+    def test_scores(self):
+        for line in (self.fields, SamLine(self.raw)):
+            self.assertEqual(BOWTIE2.scores(line), (-3.0, float('-inf'))) #XS:A is not a score
+            self.assertEqual(HISAT.scores(line), (-3.0, -10.0))
+            self.assertEqual(TagProfile('ZS','NM').scores(line), (-10.0, 2.0))
+            self.assertEqual(CIGAR.scores(line), (-6*2 + -5 + -3*2 + -2*3, float('-inf')))
+            self.assertEqual(CigarProfile('ZS').scores(line), (-29, -10.0))
+        pass
+
+    def test_scores_kept_on_read(self):
+        line = SamLine(self.raw)
+        profile = CigarProfile('ZS', scorer=CigarScorer())
+        self.assertEqual(profile.scores(line), (-29, -10.0))
+        self.assertEqual(profile.scorer.misses, 1)
+        self.assertEqual(profile.scores(line), (-29, -10.0))
+        self.assertEqual(profile(line, tag='XS'), -10.0)
+        self.assertEqual((profile.scorer.hits, profile.scorer.misses), (0, 1)) #tags were not parsed again
+        self.assertEqual(HISAT.scores(line), (-3.0, -10.0)) #scores are kept for one profile at a time
+        self.assertEqual(profile.extract_scores(line), (-29, -10.0))
+        self.assertEqual(profile.scorer.hits, 1)
+        pass
+
+    def test_unmapped(self):
+        raw = b'read1\t4\t*\t0\t0\t*\t*\t0\t0\tACGT\t!!!!\tAS:i:0\tXS:i:0\tNM:i:0\n'
+        for line in (raw.decode('ascii').split(), SamLine(raw)):
+            for profile in PROFILES.values():
+                self.assertEqual(profile.scores(line), (float('-inf'), float('-inf')))
+            self.assertEqual(BOWTIE2(line, tag='NM'), 0.0) #other tags are still available
+        pass
+
+    def test_call(self):
+        for line in (self.fields, SamLine(self.raw)):
+            self.assertEqual(HISAT(line, tag='AS'), -3.0)
+            self.assertEqual(HISAT(line, tag='XS'), -10.0)
+            self.assertEqual(HISAT(line, tag='NM'), 2.0)
+            self.assertEqual(HISAT(line, tag='YS'), float('-inf'))
+        self.assertEqual(repr(HISAT), "TagProfile('AS', 'ZS')")
+        self.assertEqual(repr(CIGAR), "CigarProfile('XS', scorer=CigarScorer(-6, -5, -3, -2))")
+        #the penalties distinguish profiles in score table and checkpoint settings
+        self.assertNotEqual(repr(CigarProfile(scorer=CigarScorer(-4, -6, -2, -1))), repr(CIGAR))
+        self.assertEqual(pickle.loads(pickle.dumps(HISAT)).scores(self.fields), (-3.0, -10.0))
+        pass
+
+    def test_cigar_score(self):
+        self.assertEqual(cigar_score('50M', 0), 0)
+        self.assertEqual(cigar_score('2S46M2S', 1), -14)
+        self.assertEqual(cigar_score('10M2I10M3D10M', 0), -25)
+        pass
+
+    def test_parse_cigar(self):
+        self.assertEqual(parse_cigar('50M'), (0, 0, 0))
+        self.assertEqual(parse_cigar('3S45M2D2M'), (1, 2, 3))
+        self.assertEqual(parse_cigar('10S10M12I10M3D100N10M5S10H'), (2, 15, 15))
+        self.assertEqual(parse_cigar('*'), (0, 0, 0))
+        pass
+
+    def test_cigar_scorer(self):
+        scorer = CigarScorer(cache_size=2)
+        self.assertEqual(scorer.score('3S45M2D2M', 2), cigar_score('3S45M2D2M', 2))
+        self.assertEqual(scorer.score('3S45M2D2M', 0), cigar_score('3S45M2D2M', 0))
+        self.assertEqual(scorer.score('50M', 1), -6)
+        self.assertEqual((scorer.hits, scorer.misses), (1, 2))
+        scorer.score('3S45M2D2M', 0) #most recently used so 50M is evicted
+        scorer.score('48M2S', 0)
+        self.assertEqual(list(scorer._cache), ['3S45M2D2M', '48M2S'])
+        self.assertEqual((scorer.hits, scorer.misses), (2, 3))
+        scorer = CigarScorer(mismatch=-4, gap_open=-6, gap_extend=-1, softclip=-0.5)
+        self.assertEqual(scorer.score('3S45M2D2M', 2), -4*2 + -6 + -1*2 + -0.5*3)
+        self.assertEqual(scorer.components('3S45M2D2M'), (-6, -2, -1.5))
+        self.assertEqual(repr(scorer), 'CigarScorer(-4, -6, -1, -0.5)')
+        profile = CigarProfile(scorer=scorer)
+        self.assertEqual(profile.scores(SamLine(self.raw)), (-17.5, float('-inf')))
+        pass
+
+    def test_get_score_function(self):
+        self.assertEqual(get_score_function(get_tag), BOWTIE2.scores)
+        self.assertEqual(get_score_function(get_tag_with_ZS_as_XS), HISAT.scores)
+        self.assertEqual(get_score_function(get_cigarbased_AS_tag), CIGAR.scores)
+        self.assertEqual(get_score_function(HISAT), HISAT.scores)
+        def zs_tag(sam_line, tag='AS'):
+            return get_tag(sam_line, 'ZS' if tag == 'AS' else 'NM')
+        self.assertEqual(get_score_function(zs_tag)(self.fields), (-10.0, 2.0))
+        pass
+
+    def test_profiles_match_tag_functions(self):
+        sam1 = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_human.sam'))
+        sam2 = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_mouse.sam'))
+        raw1 = resource_stream(__name__, 'data/paired_end_testdata_human.sam')
+        raw2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.sam')
+        bam1 = resource_stream(__name__, 'data/paired_end_testdata_human.bam')
+        bam2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.bam')
+        for f in (sam1, sam2, raw1, raw2):
+            get_sam_header(f)
+        for readpair in zip(getReadPairs(sam1,sam2), getRawReadPairs(raw1,raw2), getBamReadPairs(bam1,bam2)):
+            for line in (x for pair in readpair for x in pair):
+                for tag_func, profile in ((get_tag, BOWTIE2),
+                                          (get_tag_with_ZS_as_XS, HISAT),
+                                          (get_cigarbased_AS_tag, CIGAR)):
+                    fields = line if isinstance(line, list) else list(line)
+                    self.assertEqual(profile.scores(line), (tag_func(fields,'AS'), tag_func(fields,'XS')))
+        for f in (sam1, sam2, raw1, raw2, bam1, bam2):
+            f.close()
+        pass
+
+    def test_main_with_profile(self):
+        sam1 = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_human.sam'))
+        sam2 = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_mouse.sam'))
+        get_sam_header(sam1)
+        get_sam_header(sam2)
+        tag_func_counts = main_paired_end(getReadPairs(sam1,sam2), primary_specific=None,
+                                          tag_func=lambda sam_line, tag: get_tag(sam_line, tag))
+        sam1.seek(0)
+        sam2.seek(0)
+        get_sam_header(sam1)
+        get_sam_header(sam2)
+        profile_counts = main_paired_end(getReadPairs(sam1,sam2), primary_specific=None, tag_func=BOWTIE2)
+        self.assertEqual(tag_func_counts, profile_counts)
+        sam1.close()
+        sam2.close()
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
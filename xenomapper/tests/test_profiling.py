@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_profiling.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io, os
+import json
+import tempfile
+from pkg_resources import resource_stream
+from xenomapper.profiling import *
+from xenomapper.xenomapper import get_sam_header, getRawReadPairs, main_paired_end
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+def classify():
+    sam1 = resource_stream(__name__, 'data/paired_end_testdata_human.sam')
+    sam2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.sam')
+    get_sam_header(sam1)
+    get_sam_header(sam2)
+    counts = main_paired_end(getRawReadPairs(sam1, sam2), primary_specific=None)
+    sam1.close()
+    sam2.close()
+    return counts
+
+class test_profiling(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.report_file = os.path.join(self.tempdir.name, 'profile.json')
+        pass
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        pass
+
+    def test_function_name(self):
+        self.assertEqual(function_name('/usr/lib/python3/site-packages/xenomapper/sam.py', 'get_tags'),
+                         'xenomapper/sam.py:get_tags')
+        self.assertEqual(function_name('/home/user/xenomapper/xenomapper/tests/test_sam.py', 'setUp'),
+                         'xenomapper/tests/test_sam.py:setUp')
+        self.assertEqual(function_name('/usr/lib/python3.7/gzip.py', 'read'), 'gzip.py:read')
+        self.assertEqual(function_name('~', "<built-in method builtins.print>"), "<built-in method builtins.print>")
+        pass
+
+    def test_profile_call(self):
+        outfile = io.StringIO()
+        counts = profile_call(classify, program='xenomapper', report_file=self.report_file, top=10,
+                              outfile=outfile)
+        self.assertEqual(counts, classify())
+        with open(self.report_file) as f:
+            report = json.load(f)
+        self.assertEqual(report['program'], 'xenomapper')
+        self.assertEqual(len(report['functions']), 10)
+        self.assertEqual(report['functions'][0]['function'], 'xenomapper/tests/test_profiling.py:classify')
+        self.assertIn('xenomapper/xenomapper.py:main_paired_end', [x['function'] for x in report['functions']])
+        cumtimes = [x['cumtime'] for x in report['functions']]
+        self.assertEqual(cumtimes, sorted(cumtimes, reverse=True))
+        self.assertTrue(report['peak_memory'] > 0)
+        self.assertTrue(report['allocations_at_exit'])
+        self.assertIn('xenomapper/xenomapper.py:main_paired_end', outfile.getvalue())
+        pass
+
+    def test_compare_reports(self):
+        old = {'version':'1.0.1', 'wall_seconds':2.0, 'cpu_seconds':2.0, 'peak_memory':2**20,
+               'functions':[{'function':'a', 'cumtime':1.0}, {'function':'b', 'cumtime':0.5}]}
+        new = {'version':'1.0.2', 'wall_seconds':1.0, 'cpu_seconds':1.0, 'peak_memory':2**21,
+               'functions':[{'function':'a', 'cumtime':0.8}, {'function':'c', 'cumtime':0.1}]}
+        self.assertEqual(compare_reports(old, new), [('b', 0.5, None), ('a', 1.0, 0.8), ('c', None, 0.1)])
+        outfile = io.StringIO()
+        output_comparison(old, new, outfile=outfile)
+        self.assertIn('-50.0%', outfile.getvalue())
+        self.assertIn('+100.0%', outfile.getvalue())
+        self.assertIn('-20.0%', outfile.getvalue())
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_sam.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io
+import pickle
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from pkg_resources import resource_stream
+from xenomapper.sam import *
+from xenomapper.bam import BgzfWriter
+from xenomapper.xenomapper import get_sam_header, process_headers, getRawReadPairs, main_paired_end, main_single_end
+from xenomapper.writers import SamWriter
+import hashlib
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+class test_sam(unittest.TestCase):
+    def setUp(self):
+        self.raw = b'read1\t0\tchr1\t100\t42\t50M\t*\t0\t0\tACGT\tAS:i:\tNM:i:0\tAS:i:-3\tXS:i:-10\tYT:Z:UU with space\n'
+        pass
+    
+    def test_samline_fields(self):
+        line = SamLine(self.raw)
+        self.assertEqual(line.qname, 'read1')
+        self.assertEqual(line[0], 'read1')
+        self.assertIsNone(line._fields)
+        self.assertEqual(line[5], '50M')
+        self.assertEqual(line[-1], 'YT:Z:UU with space')
+        self.assertEqual(len(line), 15)
+        self.assertEqual('\t'.join(line)+'\n', self.raw.decode('ascii'))
+        self.assertTrue(line)
+        pass
+    
+    def test_samline_get_tag(self):
+        line = SamLine(self.raw)
+        self.assertEqual(line.get_tag('AS'), -3.0) #QUAL field beginning AS:i: is not a tag
+        self.assertEqual(line.get_tag('XS'), -10.0)
+        self.assertEqual(line.get_tag('NM'), 0.0)
+        self.assertEqual(line.get_tag('ZS'), float('-inf'))
+        self.assertEqual(line.get_tag('S'), float('-inf')) #no substring matches
+        self.assertIsNone(line._fields)
+        self.assertEqual(SamLine(b'read1\t4\t*\t0\t0\t*\t*\t0\t0\tACGT\t!!!!').get_tag('AS'), float('-inf'))
+        self.assertEqual(SamLine(b'read1\t4\t*\t0\t0\t*\t*\t0\t0\tACGT\t!!!!\tAS:i:7').get_tag('AS'), 7.0)
+        pass
+    
+    def test_samline_spaces(self):
+        line = SamLine(self.raw.replace(b' with space', b'').replace(b'\t', b' '))
+        self.assertEqual(line.qname, 'read1')
+        self.assertEqual(line[5], '50M')
+        self.assertEqual(line.flag, 0)
+        self.assertEqual(line.get_tag('XS'), -10.0)
+        self.assertEqual(len(line), 15)
+        pass
+
+    def test_space_separated_input(self):
+        for names, main_function, skip in ((('paired_end_testdata_human.sam', 'paired_end_testdata_mouse.sam'),
+                                            main_paired_end, False),
+                                           (('test_human_in.sam', 'test_mouse_in.sam'), main_single_end, True)):
+            counts = []
+            for separator in (b'\t', b' '):
+                sam1, sam2 = [io.BytesIO(resource_stream(__name__, 'data/' + name).read().replace(b'\t', separator))
+                              for name in names]
+                get_sam_header(sam1)
+                get_sam_header(sam2)
+                counts.append(main_function(getRawReadPairs(sam1, sam2, skip_repeated_reads=skip),
+                                            primary_specific=None))
+            self.assertEqual(counts[0], counts[1])
+            self.assertTrue(sum(counts[0].values()) > 0)
+        pass
+
+    def test_samline_newline(self):
+        self.assertEqual(SamLine(self.raw.rstrip(b'\n')).raw, self.raw)
+        pass
+    
+    def test_samline_pickle(self):
+        line = SamLine(self.raw)
+        line[5]
+        line._scores = (1.0, 2.0)
+        copy = pickle.loads(pickle.dumps(line))
+        self.assertEqual(copy.raw, self.raw)
+        self.assertEqual(copy.qname, 'read1')
+        self.assertIsNone(copy._fields) #only the bytes of the line are pickled
+        self.assertIsNone(copy._scores)
+        pass
+    
+    def test_sam_lines(self):
+        lines = list(sam_lines(io.BytesIO(self.raw * 3 + b'\n')))
+        self.assertEqual([x.raw for x in lines], [self.raw] * 3)
+        pass
+
+    def test_open_sam(self):
+        plain = resource_stream(__name__, 'data/paired_end_testdata_human.sam').read()
+        bgzf_data = io.BytesIO()
+        writer = BgzfWriter(bgzf_data)
+        writer.write(plain)
+        writer.close()
+        expected = io.BytesIO(plain)
+        expected_header = get_sam_header(expected)
+        expected_lines = [x.raw for x in sam_lines(expected)]
+        executor = ThreadPoolExecutor(max_workers=2)
+        for data in (plain, gzip.compress(plain), bgzf_data.getvalue()):
+            #BytesIO is read by seeking and BufferedReader (as for pipes) with peek
+            for samfile in (io.BytesIO(data), io.BufferedReader(io.BytesIO(data))):
+                samfile = open_sam(samfile, executor=executor)
+                header = get_sam_header(samfile)
+                self.assertEqual(header, expected_header)
+                self.assertEqual([x.raw for x in sam_lines(samfile)], expected_lines)
+        executor.shutdown()
+        pass
+
+    def test_compressed_input_PE(self):
+        plain1 = resource_stream(__name__, 'data/paired_end_testdata_human.sam').read()
+        plain2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.sam').read()
+        bgzf_data = io.BytesIO()
+        writer = BgzfWriter(bgzf_data)
+        writer.write(plain1)
+        writer.close()
+        raw_outfile = io.BytesIO()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            sam1 = open_sam(io.BufferedReader(io.BytesIO(bgzf_data.getvalue())), executor=executor)
+            sam2 = open_sam(io.BufferedReader(io.BytesIO(gzip.compress(plain2))))
+            process_headers(sam1, sam2, primary_specific=SamWriter(raw_outfile))
+            counts = main_paired_end(getRawReadPairs(sam1, sam2), primary_specific=SamWriter(raw_outfile))
+        self.assertEqual(sum(counts.values()), 238)
+        self.assertEqual(hashlib.sha224(raw_outfile.getvalue()).hexdigest(),'64c0e24bf141c5aa3bb0993c73b34cdfe630a504ac424843f746918d')
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_scoretable.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io, os
+from functools import partial
+from xenomapper.scoretable import *
+from xenomapper.policies import PairPolicy
+from xenomapper.profiles import BOWTIE2
+from xenomapper.xenomapper import getRawReadPairs, get_score_function, main_single_end, \
+                                  main_paired_end, conservative_main_paired_end, policy_main_paired_end
+from xenomapper.tests.test_policies import PRIMARY_ONLY_RULES
+from xenomapper.tests.helpers import InputFiles, string_outputs, output_values
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class test_scoretable(InputFiles, unittest.TestCase):
+    def setUp(self):
+        InputFiles.setUp(self)
+        self.table_file = os.path.join(self.tempdir.name, 'run.scores')
+        pass
+
+    def run_main(self, main_function, paired, score_table=False, min_score=float('-inf')):
+        """Classify the test data writing every output, optionally recording a score table"""
+        samfiles = self.open_inputs(paired)
+        readpairs = getRawReadPairs(*samfiles, skip_repeated_reads=not paired)
+        if score_table:
+            writer = ScoreTableWriter(open(self.table_file, 'wb'), get_score_function(BOWTIE2),
+                                      {'paired':paired}, samfiles=samfiles, buffer_rows=10)
+            readpairs = writer.record(readpairs)
+        result = self.classify(main_function, readpairs, min_score=min_score)
+        if score_table:
+            writer.close()
+        return result
+
+    def run_reclassify(self, paired, **kw):
+        outputs = string_outputs()
+        counts = reclassify(ScoreTable(self.table_file), outputs=outputs, samfiles=self.open_inputs(paired),
+                            batch_size=25, **kw)
+        return counts, output_values(outputs)
+
+    def test_single_end(self):
+        expected = self.run_main(main_single_end, paired=False, score_table=True)
+        table = ScoreTable(self.table_file)
+        self.assertEqual(table.settings['paired'], False)
+        self.assertEqual(table.settings['offsets'], True)
+        self.assertEqual(len(table), sum(expected[0].values()))
+        self.assertEqual(self.run_reclassify(paired=False), expected)
+        self.assertEqual(self.run_reclassify(paired=False, min_score=20),
+                         self.run_main(main_single_end, paired=False, min_score=20))
+        pass
+
+    def test_paired_end(self):
+        expected = self.run_main(main_paired_end, paired=True, score_table=True)
+        table = ScoreTable(self.table_file)
+        self.assertEqual(len(table), 2 * sum(expected[0].values()))
+        self.assertEqual(list(table.rows['mate'][:4]), [0, 1, 0, 1])
+        self.assertEqual(self.run_reclassify(paired=True), expected)
+        self.assertEqual(self.run_reclassify(paired=True, conservative=True, min_score=50),
+                         self.run_main(conservative_main_paired_end, paired=True, min_score=50))
+        policy = PairPolicy.parse(PRIMARY_ONLY_RULES.splitlines())
+        self.assertEqual(self.run_reclassify(paired=True, policy=policy),
+                         self.run_main(partial(policy_main_paired_end, policy=policy), paired=True))
+        pass
+
+    def test_no_offsets(self):
+        samfiles = self.open_inputs(paired=True)
+        writer = ScoreTableWriter(open(self.table_file, 'wb'), get_score_function(BOWTIE2), {'paired':True})
+        counts = main_paired_end(writer.record(getRawReadPairs(*samfiles)), primary_specific=None)
+        writer.close()
+        table = ScoreTable(self.table_file)
+        self.assertEqual(table.settings['offsets'], False)
+        self.assertTrue(numpy.all(table.rows['offset1'] == NO_OFFSET))
+        self.assertEqual(reclassify(table), counts)
+        with self.assertRaises(ValueError):
+            reclassify(table, outputs={'unassigned':io.StringIO()}, samfiles=samfiles)
+        with self.assertRaises(ValueError):
+            reclassify(table, outputs={'unassigned':io.StringIO()})
+        pass
+
+    def test_invalid_table(self):
+        with open(self.table_file, 'wb') as f:
+            f.write(b'@HD\tVN:1.0\n')
+        with self.assertRaises(ValueError):
+            ScoreTable(self.table_file)
+        writer = ScoreTableWriter(open(self.table_file, 'wb'), get_score_function(BOWTIE2), {'paired':False})
+        writer.outfile.write(b'\x00' * (ROW.size + 1))
+        writer.close()
+        with self.assertRaises(ValueError):
+            ScoreTable(self.table_file)
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_shard.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import sys, io, os
+import tempfile
+from collections import Counter
+from pkg_resources import resource_filename
+from xenomapper.shard import *
+from xenomapper.bam import bam_records
+from xenomapper.writers import OUTPUT_CATEGORIES, SamWriter
+from xenomapper.xenomapper import get_sam_header, getRawReadPairs, process_headers, main_single_end, \
+                                  main_paired_end, conservative_main_paired_end
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+class test_shard(unittest.TestCase):
+    def setUp(self):
+        self.sam1_name = resource_filename(__name__, 'data/paired_end_testdata_human.sam')
+        self.sam2_name = resource_filename(__name__, 'data/paired_end_testdata_mouse.sam')
+        self.sam1 = open(self.sam1_name, 'rb')
+        self.sam2 = open(self.sam2_name, 'rb')
+        get_sam_header(self.sam1)
+        get_sam_header(self.sam2)
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.prefix = os.path.join(self.tempdir.name, 'sample')
+        self.stderr = sys.stderr
+        sys.stderr = io.StringIO() #discard the summary
+        pass
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        self.sam1.close()
+        self.sam2.close()
+        self.tempdir.cleanup()
+        pass
+
+    def single_pass(self, main_function, paired):
+        """Return the counts and outputs of classifying the whole files"""
+        outputs = {category:io.BytesIO() for category in OUTPUT_CATEGORIES}
+        writers = {category:SamWriter(f) for category, f in outputs.items()}
+        with open(self.sam1_name, 'rb') as sam1, open(self.sam2_name, 'rb') as sam2:
+            process_headers(sam1, sam2, **writers)
+            counts = main_function(getRawReadPairs(sam1, sam2, skip_repeated_reads=not paired), **writers)
+        return counts, {category:f.getvalue() for category, f in outputs.items()}
+
+    def test_read_boundary(self):
+        start = self.sam1.tell()
+        end = self.sam1.seek(0, 2)
+        for offset in range(start, end, 997):
+            boundary = read_boundary(self.sam1, offset, end)
+            self.assertTrue(offset <= boundary <= end)
+            if boundary < end:
+                self.sam1.seek(boundary - 1)
+                self.assertEqual(self.sam1.read(1), b'\n')
+                line = self.sam1.readline()
+                self.sam1.seek(boundary - 2)
+                while self.sam1.read(1) != b'\n':
+                    self.sam1.seek(-2, 1)
+                previous = self.sam1.readline()
+                self.assertNotEqual(line.split(b'\t')[0], previous.split(b'\t')[0])
+        self.assertEqual(read_boundary(self.sam1, end - 10, end), end)
+        pass
+
+    def test_plan_shards(self):
+        for shards in (1, 2, 7, 50, 1000):
+            self.sam1.seek(0)
+            self.sam2.seek(0)
+            get_sam_header(self.sam1)
+            get_sam_header(self.sam2)
+            start1, start2 = self.sam1.tell(), self.sam2.tell()
+            plan = plan_shards(self.sam1, self.sam2, shards)
+            self.assertTrue(len(plan) <= shards)
+            self.assertEqual((plan[0].start1, plan[0].start2), (start1, start2))
+            self.assertEqual((plan[-1].end1, plan[-1].end2), (self.sam1.seek(0, 2), self.sam2.seek(0, 2)))
+            readpairs = []
+            for shard in plan:
+                self.assertTrue(shard.start1 < shard.end1 and shard.start2 < shard.end2)
+                readpairs.extend(getRawReadPairs(ShardFile(self.sam1, shard.start1, shard.end1),
+                                                 ShardFile(self.sam2, shard.start2, shard.end2)))
+            self.assertEqual(len(readpairs), 476)
+        self.assertEqual(len(plan), 238) #no more shards than read pairs
+        pass
+
+    def test_plan_round_trip(self):
+        plan = plan_shards(self.sam1, self.sam2, 4)
+        outfile = io.StringIO()
+        write_plan(plan, outfile)
+        self.assertEqual(read_plan(io.StringIO(outfile.getvalue())), plan)
+        with self.assertRaises(ValueError):
+            read_plan(io.StringIO('a\tb\n'))
+        pass
+
+    def test_counts_round_trip(self):
+        filename = os.path.join(self.tempdir.name, 'counts.json')
+        counts = Counter({('primary_specific', 'unassigned'):2, ('unassigned', 'unassigned'):1})
+        write_counts(counts, filename)
+        self.assertEqual(read_counts(filename), counts)
+        pass
+
+    def test_merge_parts(self):
+        parts = []
+        for i, data in enumerate([b'abc' + BGZF_EOF, b'def' + BGZF_EOF]):
+            parts.append(os.path.join(self.tempdir.name, 'part{0}'.format(i)))
+            with open(parts[-1], 'wb') as f:
+                f.write(data)
+        outfile = io.BytesIO()
+        merge_parts(parts, outfile, bam=True)
+        self.assertEqual(outfile.getvalue(), b'abcdef' + BGZF_EOF)
+        outfile = io.BytesIO()
+        merge_parts(parts, outfile)
+        self.assertEqual(outfile.getvalue(), b'abc' + BGZF_EOF + b'def' + BGZF_EOF)
+        #parts without an end of file marker are copied whole
+        with open(parts[0], 'wb') as f:
+            f.write(b'abc')
+        outfile = io.BytesIO()
+        merge_parts(parts, outfile, bam=True)
+        self.assertEqual(outfile.getvalue(), b'abcdef' + BGZF_EOF)
+        outfile = io.BytesIO()
+        copy_bytes(io.BytesIO(b'abcdefgh'), outfile, 7, block_size=3)
+        self.assertEqual(outfile.getvalue(), b'abcdefg')
+        with self.assertRaises(ValueError):
+            copy_bytes(io.BytesIO(b'abc'), io.BytesIO(), 7)
+        pass
+
+    def run_shards(self, options):
+        plan = os.path.join(self.tempdir.name, 'sample.plan')
+        argv = ['--primary_sam', self.sam1_name, '--secondary_sam', self.sam2_name,
+                '--output_prefix', self.prefix, '--plan', plan, '--write_buffer', '0'] + options
+        run_sharded(command_line_interface(argv + ['--plan_only']))
+        with open(plan) as f:
+            shards = len(read_plan(f))
+        for index in range(shards):
+            run_sharded(command_line_interface(argv + ['--shard_index', str(index)]))
+        return run_sharded(command_line_interface(argv + ['--merge']))
+
+    def test_sharded_single_end(self):
+        counts = self.run_shards(['--shards', '5'])
+        expected_counts, expected_outputs = self.single_pass(main_single_end, paired=False)
+        self.assertEqual(counts, expected_counts)
+        for category in OUTPUT_CATEGORIES:
+            with open(output_name(self.prefix, category)) as f:
+                self.assertEqual(f.read().encode('ascii'), expected_outputs[category])
+        self.assertEqual(os.listdir(self.tempdir.name).count('sample.plan'), 1)
+        self.assertEqual(len(os.listdir(self.tempdir.name)), 7) #parts were removed
+        pass
+
+    def test_sharded_paired_end(self):
+        counts = self.run_shards(['--paired', '--conservative', '--shards', '8'])
+        expected_counts, expected_outputs = self.single_pass(conservative_main_paired_end, paired=True)
+        self.assertEqual(counts, expected_counts)
+        for category in OUTPUT_CATEGORIES:
+            with open(output_name(self.prefix, category), 'rb') as f:
+                self.assertEqual(f.read(), expected_outputs[category])
+        pass
+
+    def test_sharded_bam_output(self):
+        counts = run_sharded(command_line_interface(['--primary_sam', self.sam1_name,
+                                                     '--secondary_sam', self.sam2_name,
+                                                     '--output_prefix', self.prefix, '--paired',
+                                                     '--shards', '3', '--processes', '2', '--bam_output']))
+        expected_counts, expected_outputs = self.single_pass(main_paired_end, paired=True)
+        self.assertEqual(counts, expected_counts)
+        for category in OUTPUT_CATEGORIES:
+            with open(output_name(self.prefix, category, bam=True), 'rb') as f:
+                data = f.read()
+            self.assertEqual(data.count(BGZF_EOF), 1)
+            expected = [line.split('\t') for line in expected_outputs[category].decode().splitlines()
+                        if not line.startswith('@')]
+            self.assertEqual([list(x) for x in bam_records(io.BytesIO(data))], expected)
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
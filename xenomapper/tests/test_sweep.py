@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_sweep.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io
+import json
+import argparse
+from pkg_resources import resource_stream
+from xenomapper.sweep import *
+from xenomapper.policies import CONSERVATIVE
+from xenomapper.profiles import BOWTIE2
+from xenomapper.vectorised import numpy, get_mapping_states
+from xenomapper.xenomapper import get_sam_header, getRawReadPairs, get_score_function, main_single_end, \
+                                  main_paired_end, conservative_main_paired_end
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+THRESHOLDS = parse_thresholds('-10:200:15')
+
+def read_pairs(paired):
+    names = ('paired_end_testdata_human.sam', 'paired_end_testdata_mouse.sam') if paired else \
+            ('test_human_in.sam', 'test_mouse_in.sam')
+    sam1 = resource_stream(__name__, 'data/' + names[0])
+    sam2 = resource_stream(__name__, 'data/' + names[1])
+    get_sam_header(sam1)
+    get_sam_header(sam2)
+    return list(getRawReadPairs(sam1, sam2, skip_repeated_reads=not paired))
+
+class test_sweep(unittest.TestCase):
+    def test_parse_thresholds(self):
+        self.assertEqual(parse_thresholds('0:100:25'), [0, 25, 50, 75, 100])
+        self.assertEqual(parse_thresholds('0:90:25'), [0, 25, 50, 75])
+        self.assertEqual(len(parse_thresholds('0:1:0.1')), 11)
+        self.assertEqual(parse_thresholds('-5:-5:1'), [-5])
+        for text in ('0:100', '0:x:1', '0:100:0', '100:0:10'):
+            with self.assertRaises(ValueError):
+                parse_thresholds(text)
+        pass
+
+    def test_sweep_arguments(self):
+        parser = argparse.ArgumentParser()
+        add_sweep_arguments(parser)
+        self.assertEqual(parser.parse_args(['--min_score_sweep=-40:0:10']).min_score_sweep, [-40, -30, -20, -10, 0])
+        self.assertEqual(parser.parse_args(['--min_score_sweep', '0:20:10']).min_score_sweep, [0, 10, 20])
+        pass
+
+    def test_single_end(self):
+        readpairs = read_pairs(paired=False)
+        sweep = ThresholdSweep(THRESHOLDS)
+        expected = main_single_end(sweep.record(readpairs, get_score_function(BOWTIE2)), primary_specific=None)
+        self.assertEqual(expected, main_single_end(readpairs, primary_specific=None))
+        counts = sweep.category_counts()
+        self.assertEqual(len(counts), len(THRESHOLDS))
+        for threshold, category_counts in zip(THRESHOLDS, counts):
+            self.assertEqual(category_counts, main_single_end(readpairs, primary_specific=None, min_score=threshold))
+        categories, rows = sweep.table()
+        self.assertEqual(categories, list(MAPPING_STATES))
+        self.assertEqual(rows[0], [counts[0][x] for x in categories])
+        pass
+
+    def test_paired_end(self):
+        readpairs = read_pairs(paired=True)
+        sweep = ThresholdSweep(THRESHOLDS, paired=True)
+        main_paired_end(sweep.record(readpairs, get_score_function(BOWTIE2)), primary_specific=None)
+        counts = sweep.category_counts()
+        for threshold, category_counts in zip(THRESHOLDS, counts):
+            self.assertEqual(category_counts, main_paired_end(readpairs, primary_specific=None, min_score=threshold))
+        categories, rows = sweep.table(CONSERVATIVE)
+        for threshold, row in zip(THRESHOLDS, rows):
+            outputs = {category:io.StringIO() for category in categories}
+            conservative_main_paired_end(readpairs, min_score=threshold, **outputs)
+            self.assertEqual(row, [outputs[x].getvalue().count('\n') // (4 if x == 'unresolved' else 2)
+                                   for x in categories])
+        pass
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_update(self):
+        for paired in (False, True):
+            readpairs = read_pairs(paired)
+            sweep = ThresholdSweep(THRESHOLDS, paired=paired)
+            list(sweep.record(readpairs, get_score_function(BOWTIE2)))
+            scores = numpy.array([BOWTIE2.scores(x) + BOWTIE2.scores(y) for x,y in readpairs]).T
+            mate = numpy.array([i > 0 and readpairs[i][0][0] == readpairs[i-1][0][0] for i in range(len(readpairs))])
+            arrays = ThresholdSweep(THRESHOLDS, paired=paired)
+            for start, stop in ((0, 100), (99, len(readpairs))) if paired else ((0, 100), (100, len(readpairs))):
+                arrays.update(get_mapping_states(*scores[:, start:stop]),
+                              numpy.maximum(scores[0, start:stop], scores[2, start:stop]),
+                              mate=mate[start:stop])
+            self.assertEqual(arrays.histogram, sweep.histogram)
+        pass
+
+    def test_output_sweep(self):
+        sweep = ThresholdSweep([0, 10], paired=True)
+        sweep.histogram[0, 2, 4, 0] = 3
+        sweep.histogram[0, 2, 0, 1] = 2
+        outfile = io.StringIO()
+        output_sweep(sweep, outfile=outfile)
+        self.assertEqual(outfile.getvalue().splitlines(), ['min_score\t' + '\t'.join(MAPPING_STATES),
+                                                           '0\t5\t0\t0\t0\t0\t0',
+                                                           '10\t5\t0\t0\t0\t0\t0'])
+        outfile = io.StringIO()
+        output_sweep(sweep, policy=CONSERVATIVE, outfile=outfile, json_format=True)
+        report = json.loads(outfile.getvalue())
+        self.assertEqual(report['thresholds'], [0, 10])
+        self.assertEqual(report['counts'], [[2,0,0,0,3,0], [0,0,0,0,5,0]])
+        self.assertEqual(report['category_counts'][0], [[['primary_specific', 'primary_specific'], 2],
+                                                        [['primary_specific', 'unassigned'], 3]])
+        self.assertEqual(report['category_counts'][1], [[['primary_specific', 'unassigned'], 5]])
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+test_vectorised.py
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+
+import unittest
+import io
+import random
+from xenomapper.xenomapper import *
+from xenomapper.vectorised import *
+from xenomapper.tests.test_parallel import run_main
+from pkg_resources import resource_stream
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPLv3"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+def random_scores(n, seed=42):
+    """Random scores with many ties, zeros and missing values"""
+    rng = random.Random(seed)
+    values = [float('-inf'), 0, -1, -2, 5, 9, 10]
+    return [tuple(rng.choice(values) for i in range(4)) for x in range(n)]
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class test_vectorised(unittest.TestCase):
+    def test_get_mapping_states(self):
+        scores = random_scores(5000)
+        for min_score in (float('-inf'), -1, 5):
+            expected = [MAPPING_STATES.index(get_mapping_state(*x, min_score=min_score)) for x in scores]
+            result = get_mapping_states(*zip(*scores), min_score=min_score)
+            self.assertEqual(list(result), expected)
+        pass
+    
+    def test_get_mapping_states_nan(self):
+        with self.assertRaises(RuntimeError):
+            get_mapping_states([float('nan')], [0], [1], [0])
+        pass
+    
+    def test_combine_states(self):
+        #exhaustive comparison against the main loop functions using one read pair per state combination
+        scores = {'primary_specific':(10,5,5,5), 'secondary_specific':(5,5,10,5),
+                  'primary_multi':(10,10,5,5), 'secondary_multi':(5,5,10,10),
+                  'unassigned':(float('-inf'),)*4, 'unresolved':(10,5,10,5)}
+        def line(name, AS, XS):
+            return [name,'0','','','','','','','','','','AS:i:{0}'.format(AS) if AS > float('-inf') else 'YT:Z:UU','XS:i:{0}'.format(XS) if XS > float('-inf') else 'YT:Z:UU']
+        for conservative, main_function in ((False, main_paired_end), (True, conservative_main_paired_end)):
+            for forward in MAPPING_STATES:
+                for reverse in MAPPING_STATES:
+                    f, r = scores[forward], scores[reverse]
+                    readpairs = [(line('a',f[0],f[1]),line('a',f[2],f[3])), (line('a',r[0],r[1]),line('a',r[2],r[3]))]
+                    outputs = {category:io.StringIO() for category in OUTPUT_CATEGORIES}
+                    main_function(readpairs, **outputs)
+                    written = [category for category in OUTPUT_CATEGORIES if outputs[category].getvalue()]
+                    state = combine_states([MAPPING_STATES.index(forward)], [MAPPING_STATES.index(reverse)], conservative=conservative)
+                    self.assertEqual([MAPPING_STATES[state[0]]], written)
+        pass
+    
+    def test_count_states(self):
+        self.assertEqual(count_states(numpy.array([0,0,5,1])), Counter({'primary_specific':2, 'unresolved':1, 'secondary_specific':1}))
+        self.assertEqual(count_state_pairs([0,0,4], [1,1,4]), Counter({('primary_specific','secondary_specific'):2, ('unassigned','unassigned'):1}))
+        pass
+    
+    def test_vectorised_main_single_end(self):
+        expected = run_main(main_single_end, 'data/test_human_in.sam', 'data/test_mouse_in.sam', skip_repeated_reads=True)
+        result = run_main(vectorised_main_single_end, 'data/test_human_in.sam', 'data/test_mouse_in.sam', skip_repeated_reads=True)
+        self.assertEqual(result, expected)
+        pass
+    
+    def test_vectorised_main_paired_end(self):
+        for main_function, vectorised_function in ((main_paired_end, vectorised_main_paired_end),
+                                        (conservative_main_paired_end, vectorised_conservative_main_paired_end)):
+            expected = run_main(main_function, 'data/paired_end_testdata_human.sam', 'data/paired_end_testdata_mouse.sam')
+            result = run_main(vectorised_function, 'data/paired_end_testdata_human.sam', 'data/paired_end_testdata_mouse.sam')
+            self.assertEqual(result, expected)
+            #small batches exercise pairs that span batch boundaries
+            result = run_main(vectorised_function, 'data/paired_end_testdata_human.sam', 'data/paired_end_testdata_mouse.sam',
+                              threads=2, batch_size=7, paired=True)
+            self.assertEqual(result, expected)
+        pass
+    
+    def test_vectorised_batch_boundaries(self):
+        sam1 = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_human.sam'))
+        sam2 = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_mouse.sam'))
+        get_sam_header(sam1)
+        get_sam_header(sam2)
+        readpairs = list(getReadPairs(sam1, sam2))
+        sam1.close()
+        sam2.close()
+        for conservative, main_function in ((False, main_paired_end), (True, conservative_main_paired_end)):
+            expected_outputs = {category:io.StringIO() for category in OUTPUT_CATEGORIES}
+            expected = main_function(readpairs, **expected_outputs)
+            for batch_size in (1, 2, 3, 50):
+                outputs = {category:io.StringIO() for category in OUTPUT_CATEGORIES}
+                result = vectorised_main(readpairs, paired=True, conservative=conservative,
+                                         batch_size=batch_size, **outputs)
+                self.assertEqual(result, expected)
+                for category in OUTPUT_CATEGORIES:
+                    self.assertEqual(outputs[category].getvalue(), expected_outputs[category].getvalue())
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
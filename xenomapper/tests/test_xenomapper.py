@@ -8,7 +8,10 @@ Copyright (c) 2011-2016 Matthew Wakefield and The Walter and Eliza Hall Institut
 """
 
 import unittest
-import sys, io
+import sys, io, os
+import gzip
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from xenomapper.xenomapper import *
 import hashlib
 from pkg_resources import resource_stream
@@ -22,6 +25,17 @@ __maintainer__ = "Matthew Wakefield"
 __email__ = "wakefield@wehi.edu.au"
 __status__ = "Production/Stable"
 
+def pipe_resource(name):
+    """Return a binary file object reading the test data file name
+    from a pipe that is written by a separate thread"""
+    data = resource_stream(__name__, name).read()
+    read_fd, write_fd = os.pipe()
+    def writer():
+        with open(write_fd, 'wb') as f:
+            f.write(data)
+    threading.Thread(target=writer, daemon=True).start()
+    return open(read_fd, 'rb')
+
 class test_main(unittest.TestCase):
     def setUp(self):
         pass
@@ -160,7 +174,221 @@ class test_main(unittest.TestCase):
         sam2.close()
         pass
 
+    def test_consistent_output_bam_PE(self):
+        sam_outfile = io.StringIO()
+        bam_outfile = io.StringIO()
+        sam1 = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_human.sam'))
+        sam2 = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_mouse.sam'))
+        bam1 = resource_stream(__name__, 'data/paired_end_testdata_human.bam')
+        bam2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.bam')
+        process_headers(sam1,sam2,primary_specific=sam_outfile)
+        process_headers(bam1,bam2,primary_specific=bam_outfile,bam=True)
+        sam_counts = main_paired_end(getReadPairs(sam1,sam2), primary_specific=sam_outfile)
+        bam_counts = main_paired_end(getBamReadPairs(bam1,bam2), primary_specific=bam_outfile)
+        self.assertEqual(sam_counts, bam_counts)
+        self.assertEqual(hashlib.sha224(bam_outfile.getvalue().encode('latin-1')).hexdigest(),'64c0e24bf141c5aa3bb0993c73b34cdfe630a504ac424843f746918d')
+        for f in (sam1, sam2, bam1, bam2):
+            f.close()
+        pass
+    def test_raw_output_PE(self):
+        sam_outfile = io.StringIO()
+        raw_outfile = io.BytesIO()
+        sam1 = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_human.sam'))
+        sam2 = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_mouse.sam'))
+        raw1 = resource_stream(__name__, 'data/paired_end_testdata_human.sam')
+        raw2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.sam')
+        process_headers(sam1,sam2,primary_specific=sam_outfile)
+        process_headers(raw1,raw2,primary_specific=SamWriter(raw_outfile))
+        sam_counts = main_paired_end(getReadPairs(sam1,sam2), primary_specific=sam_outfile)
+        raw_counts = main_paired_end(getRawReadPairs(raw1,raw2), primary_specific=SamWriter(raw_outfile))
+        self.assertEqual(sam_counts, raw_counts)
+        self.assertEqual(hashlib.sha224(raw_outfile.getvalue()).hexdigest(),'64c0e24bf141c5aa3bb0993c73b34cdfe630a504ac424843f746918d')
+        for f in (sam1, sam2, raw1, raw2):
+            f.close()
+        pass
+    
+    def test_background_writer_PE(self):
+        for buffer_size in (1, 1000, 2**22):
+            outfile = io.BytesIO()
+            writer = BackgroundWriter(outfile, buffer_size=buffer_size, max_pending=2)
+            raw1 = resource_stream(__name__, 'data/paired_end_testdata_human.sam')
+            raw2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.sam')
+            process_headers(raw1,raw2,primary_specific=SamWriter(writer))
+            counts = main_paired_end(getRawReadPairs(raw1,raw2), primary_specific=SamWriter(writer))
+            writer.close()
+            self.assertEqual(sum(counts.values()), 238)
+            self.assertEqual(hashlib.sha224(outfile.getvalue()).hexdigest(),'64c0e24bf141c5aa3bb0993c73b34cdfe630a504ac424843f746918d')
+            if buffer_size == 2**22:
+                self.assertEqual(writer.blocks, 1)
+            else:
+                self.assertTrue(writer.blocks > 10)
+            for f in (raw1, raw2):
+                f.close()
+        pass
+    
+    def test_background_writer_error(self):
+        class FullDisk(io.BytesIO):
+            def write(self, data):
+                raise OSError(28, 'No space left on device')
+        writer = BackgroundWriter(FullDisk(), buffer_size=10)
+        writer.write(b'x' * 20)
+        with self.assertRaises(OSError):
+            writer.flush()
+        with self.assertRaises(OSError):
+            writer.write(b'x' * 20)
+        pass
+    
+    def test_raw_output_SE(self):
+        outputs = {category:io.BytesIO() for category in OUTPUT_CATEGORIES}
+        raw1 = resource_stream(__name__, 'data/test_human_in.sam')
+        raw2 = resource_stream(__name__, 'data/test_mouse_in.sam')
+        writers = {category:SamWriter(outputs[category]) for category in outputs}
+        process_headers(raw1,raw2,**writers)
+        cat_counts = main_single_end(getRawReadPairs(raw1,raw2,skip_repeated_reads=True), **writers)
+        raw1.seek(0)
+        raw2.seek(0)
+        input_lines = set(raw1.readlines() + raw2.readlines())
+        for category in outputs:
+            output_lines = outputs[category].getvalue().split(b'\n')[:-1]
+            #output lines are byte identical to input lines, including space delimited tags
+            self.assertTrue(set([x + b'\n' for x in output_lines if x[:1] != b'@']) <= input_lines)
+        self.assertEqual(cat_counts['primary_specific'],
+                         len(outputs['primary_specific'].getvalue().split(b'\n'))-4)
+        self.assertEqual(cat_counts['unassigned'],
+                         len(outputs['unassigned'].getvalue().split(b'\n'))-4)
+        #reads are the same as the whitespace split text processing
+        sam1 = io.TextIOWrapper(resource_stream(__name__, 'data/test_human_in.sam'))
+        sam2 = io.TextIOWrapper(resource_stream(__name__, 'data/test_mouse_in.sam'))
+        text_outfile = io.StringIO()
+        process_headers(sam1,sam2,primary_specific=text_outfile)
+        main_single_end(getReadPairs(sam1,sam2), primary_specific=text_outfile)
+        self.assertEqual([b'\t'.join(x.split()) for x in outputs['primary_specific'].getvalue().split(b'\n')[:-1] if x[:1] != b'@'],
+                         [x.encode('ascii') for x in text_outfile.getvalue().split('\n')[:-1] if x[:1] != '@'])
+        for f in (sam1, sam2, raw1, raw2):
+            f.close()
+        pass
+
+    def test_streaming_input_PE(self):
+        for name, readpairs, bam in (('sam', getRawReadPairs, False), ('bam', getBamReadPairs, True)):
+            raw_outfile = io.BytesIO()
+            file1 = pipe_resource('data/paired_end_testdata_human.' + name)
+            file2 = pipe_resource('data/paired_end_testdata_mouse.' + name)
+            self.assertFalse(file1.seekable())
+            if bam:
+                file1 = BamReader(file1)
+                file2 = BamReader(file2)
+            process_headers(file1,file2,primary_specific=SamWriter(raw_outfile),bam=bam)
+            counts = main_paired_end(readpairs(file1,file2), primary_specific=SamWriter(raw_outfile))
+            self.assertEqual(sum(counts.values()), 238)
+            self.assertEqual(hashlib.sha224(raw_outfile.getvalue()).hexdigest(),'64c0e24bf141c5aa3bb0993c73b34cdfe630a504ac424843f746918d')
+            for f in (file1, file2):
+                if bam:
+                    f = f.fileobj
+                f.close()
+        pass
+
+    def test_bam_output_PE(self):
+        sam_outfile = io.StringIO()
+        bam_outfile = io.BytesIO()
+        bam_writer = BamWriter(bam_outfile)
+        sam1 = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_human.sam'))
+        sam2 = io.TextIOWrapper(resource_stream(__name__, 'data/paired_end_testdata_mouse.sam'))
+        bam1 = resource_stream(__name__, 'data/paired_end_testdata_human.bam')
+        bam2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.bam')
+        process_headers(sam1,sam2,primary_specific=sam_outfile)
+        process_headers(bam1,bam2,primary_specific=bam_writer,bam=True)
+        sam_counts = main_paired_end(getReadPairs(sam1,sam2), primary_specific=sam_outfile)
+        bam_counts = main_paired_end(getBamReadPairs(bam1,bam2), primary_specific=bam_writer)
+        bam_writer.close()
+        self.assertEqual(sam_counts, bam_counts)
+        self.assertEqual(get_bam_header(io.BytesIO(bam_outfile.getvalue())), sam_outfile.getvalue().split('\n')[:29])
+        self.assertEqual(sam_outfile.getvalue().split('\n',29)[-1], ''.join(bam_lines(io.BytesIO(bam_outfile.getvalue()))))
+        for f in (sam1, sam2, bam1, bam2):
+            f.close()
+        pass
         
+    def fastq_records(self, data):
+        lines = data.split(b'\n')[:-1]
+        return [tuple(lines[i:i+4]) for i in range(0, len(lines), 4)]
+
+    def test_fastq_output(self):
+        #reads are reverse complemented to the same records from alignments on either strand in each species
+        records = []
+        for name in ('human.sam', 'mouse.sam', 'human.bam'):
+            infile = resource_stream(__name__, 'data/paired_end_testdata_' + name)
+            outfile = io.BytesIO()
+            writer = FastqWriter(outfile)
+            if name.endswith('.bam'):
+                reads = BamReader(infile)
+            else:
+                get_sam_header(infile)
+                reads = sam_lines(infile)
+            for read in reads:
+                writer.write_read(read)
+            writer.close()
+            infile.close()
+            interleaved = self.fastq_records(outfile.getvalue())
+            self.assertEqual([x[0] for x in interleaved[::2]], [x[0] for x in interleaved[1::2]])
+            records.append(sorted(interleaved))
+        self.assertEqual(len(records[0]), 476)
+        #space separated lines give the same records
+        outfile = io.BytesIO()
+        writer = FastqWriter(outfile)
+        infile = resource_stream(__name__, 'data/paired_end_testdata_human.sam')
+        get_sam_header(infile)
+        for read in sam_lines(io.BytesIO(infile.read().replace(b'\t', b' '))):
+            writer.write_read(read)
+        writer.close()
+        infile.close()
+        self.assertEqual(sorted(self.fastq_records(outfile.getvalue())), records[0])
+        self.assertEqual(records[0], records[1])
+        self.assertEqual(records[0], records[2])
+        self.assertTrue((b'@HWI-ST960:96:COTO3ACXX:3:1101:1180:2236',
+                         b'TATGTATATACACATACACTGTATATATGTATATACACATACACTGTATATATGTATATACACATACACTGTATATATGTATGTACACATACACTGTATA',
+                         b'+',
+                         b'C@CFDFFFHHHHHJJJJJJJJJJJJJJJJHJIJJJIJJJJJ?GHIIHIJJFIIJIJIJJIIEHIIJJGJJJJJIJIJJJHII//@FGGIJIIIGGGHHGH')
+                        in records[0])
+        pass
+
+    def test_fastq_output_PE(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for compress in (False, True):
+                outputs = {category:(io.BytesIO(), io.BytesIO()) for category in OUTPUT_CATEGORIES}
+                writers = {category:FastqWriter(*outputs[category], compress=compress, executor=executor)
+                           for category in OUTPUT_CATEGORIES}
+                sam_outputs = {category:io.BytesIO() for category in OUTPUT_CATEGORIES}
+                raw1 = resource_stream(__name__, 'data/paired_end_testdata_human.sam')
+                raw2 = resource_stream(__name__, 'data/paired_end_testdata_mouse.sam')
+                process_headers(raw1,raw2,**writers)
+                main_paired_end(getRawReadPairs(raw1,raw2), **writers)
+                for writer in writers.values():
+                    writer.close()
+                raw1.seek(0)
+                raw2.seek(0)
+                process_headers(raw1,raw2,**{x:SamWriter(y) for x,y in sam_outputs.items()})
+                main_paired_end(getRawReadPairs(raw1,raw2), **{x:SamWriter(y) for x,y in sam_outputs.items()})
+                for category in OUTPUT_CATEGORIES:
+                    first, second = [gzip.decompress(x.getvalue()) if compress else x.getvalue()
+                                     for x in outputs[category]]
+                    first, second = self.fastq_records(first), self.fastq_records(second)
+                    self.assertEqual([x[0] for x in first], [x[0] for x in second])
+                    sam_reads = [x for x in sam_outputs[category].getvalue().split(b'\n')[:-1] if x[:1] != b'@']
+                    #unresolved pairs are written once from the alignments in both species
+                    self.assertEqual(len(first) + len(second),
+                                     len(sam_reads) // (2 if category == 'unresolved' else 1))
+                for f in (raw1, raw2):
+                    f.close()
+        pass
+
+    def test_split_fastq_names(self):
+        self.assertEqual(split_fastq_names('human.fastq.gz'), ('human_R1.fastq.gz', 'human_R2.fastq.gz'))
+        self.assertEqual(split_fastq_names('out/human.fq'), ('out/human_R1.fq', 'out/human_R2.fq'))
+        self.assertEqual(split_fastq_names('human.bgz'), ('human_R1.bgz', 'human_R2.bgz'))
+        self.assertEqual(split_fastq_names('human'), ('human_R1', 'human_R2'))
+        self.assertTrue(is_compressed_name('human.fastq.gz'))
+        self.assertFalse(is_compressed_name('human.fastq'))
+        pass
+
     def test_get_mapping_state(self):
         inpt_and_outpt = [
                             ((200,199,199,198,float('-inf')),'primary_specific'),
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+vectorised.py
+
+Vectorised classification of batches of reads for xenomapper using NumPy.
+
+Mapping states are represented as small integers that index
+MAPPING_STATES.  get_mapping_states is an array equivalent of
+get_mapping_state and combine_states applies the liberal or conservative
+rules (or any PairPolicy, see xenomapper.policies) for assigning a read
+pair from its forward and reverse states.
+The vectorised main loop functions are drop in replacements for
+main_single_end, main_paired_end and conservative_main_paired_end that
+classify reads in batches and return identical category counts.
+
+NumPy is an optional dependency and is only required for this module.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import sys
+from collections import Counter
+from xenomapper.writers import write_read
+from xenomapper.parallel import batch_readpairs
+from xenomapper.policies import MAPPING_STATES, PRIMARY_SPECIFIC, SECONDARY_SPECIFIC, PRIMARY_MULTI, \
+                                SECONDARY_MULTI, UNASSIGNED, UNRESOLVED, BOTH_READS, \
+                                WRITTEN_READS, LIBERAL, CONSERVATIVE
+
+try:
+    import numpy
+except ImportError: #pragma: no cover
+    numpy = None
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+def _require_numpy():
+    if numpy is None: #pragma: no cover
+        raise ImportError('NumPy is required for vectorised classification. Install with pip3 install numpy')
+    pass
+
+
+def get_mapping_states(AS1, XS1, AS2, XS2, min_score=float('-inf')):
+    """Determine the mapping states of arrays of scores in each species.
+    Equivalent to calling get_mapping_state for each element.
+    Arguments:
+        AS1, XS1, AS2, XS2 - array like float or integer scores of the best
+                    and other match in the primary and secondary species.
+                    Missing scores should be -inf
+        min_score - the score that matches must exceed in order to be
+                    considered valid matches. Default = -inf
+    Returns
+        states    - a numpy int8 array of indexes into MAPPING_STATES
+    """
+    _require_numpy()
+    AS1 = numpy.asarray(AS1, dtype=numpy.float64)
+    XS1 = numpy.asarray(XS1, dtype=numpy.float64)
+    AS2 = numpy.asarray(AS2, dtype=numpy.float64)
+    XS2 = numpy.asarray(XS2, dtype=numpy.float64)
+    #comparisons mirror get_mapping_state exactly so NaN scores are also rejected
+    low1 = AS1 <= min_score
+    low2 = AS2 <= min_score
+    unassigned = low1 & low2
+    primary = ~unassigned & (AS1 > min_score) & (low2 | (AS1 > AS2))
+    unresolved = ~unassigned & ~primary & (AS1 == AS2)
+    secondary = ~unassigned & ~primary & ~unresolved & (AS2 > min_score) & (low1 | (AS2 > AS1))
+    if not numpy.all(unassigned | primary | unresolved | secondary):
+        i = numpy.flatnonzero(~(unassigned | primary | unresolved | secondary))[0]
+        raise RuntimeError('Error in processing logic with values {0} '.format((AS1[i],XS1[i],AS2[i],XS2[i])))
+    #XS of zero is treated as absent as in get_mapping_state
+    unique1 = (XS1 == 0) | (AS1 > XS1)
+    unique2 = (XS2 == 0) | (AS2 > XS2)
+    states = numpy.full(AS1.shape, UNRESOLVED, dtype=numpy.int8)
+    states[unassigned] = UNASSIGNED
+    states[primary & unique1] = PRIMARY_SPECIFIC
+    states[primary & ~unique1] = PRIMARY_MULTI
+    states[secondary & unique2] = SECONDARY_SPECIFIC
+    states[secondary & ~unique2] = SECONDARY_MULTI
+    return states
+
+
+def _pair_table(policy):
+    """Return a 6x6 array of the output state (or DISCARD) of a PairPolicy
+    for each forward and reverse state"""
+    return numpy.array(policy.table, dtype=numpy.int8).reshape(len(MAPPING_STATES), len(MAPPING_STATES))
+
+
+def combine_states(forward, reverse, conservative=False, policy=None):
+    """Determine the output category of read pairs from the states of
+    the forward and reverse reads.
+    Arguments:
+        forward, reverse - arrays of indexes into MAPPING_STATES
+        conservative     - if True apply the rules of
+                           conservative_main_paired_end otherwise the
+                           rules of main_paired_end
+        policy           - a PairPolicy used in place of the liberal
+                           or conservative rules. Default = None
+    Returns
+        states - a numpy int8 array of indexes into MAPPING_STATES
+                 (or DISCARD)
+    """
+    _require_numpy()
+    return _pair_table(policy or (CONSERVATIVE if conservative else LIBERAL))[numpy.asarray(forward), numpy.asarray(reverse)]
+
+
+def count_states(states):
+    """Return a Counter of state names from an array of state indexes"""
+    counts = numpy.bincount(states, minlength=len(MAPPING_STATES))
+    return Counter({MAPPING_STATES[i]:int(x) for i,x in enumerate(counts) if x})
+
+
+def count_state_pairs(forward, reverse):
+    """Return a Counter keyed by tuples of forward and reverse state names"""
+    n = len(MAPPING_STATES)
+    counts = numpy.bincount(numpy.asarray(forward, dtype=numpy.intp) * n + reverse, minlength=n*n)
+    return Counter({(MAPPING_STATES[i // n], MAPPING_STATES[i % n]):int(x) for i,x in enumerate(counts) if x})
+
+
+def _scores(batch, score_func):
+    """Return arrays of AS1, XS1, AS2, XS2 for a batch of read pairs"""
+    scores = numpy.array([score_func(line1) + score_func(line2)
+                          for line1, line2 in batch], dtype=numpy.float64).reshape(-1, 4)
+    return scores.T
+
+
+def vectorised_main(readpairs,
+                    primary_specific=sys.stdout,
+                    secondary_specific=None,
+                    primary_multi=None,
+                    secondary_multi=None,
+                    unassigned=None,
+                    unresolved=None,
+                    min_score=float('-inf'),
+                    tag_func=None,
+                    paired=False,
+                    conservative=False,
+                    policy=None,
+                    batch_size=100000):
+    """Batch processing equivalent of main_single_end, main_paired_end
+    and conservative_main_paired_end.
+    Arguments:
+        readpairs - an iterable of tuples of lists of sam fields
+        primary_specific, secondary_specific, primary_multi,
+        secondary_multi, unassigned, unresolved
+                  - ascii file or file like objects or writer objects
+                    (such as a BamWriter) for outputs
+        min_score - the score that matches must exceed in order to be
+                    considered valid matches. Default = -inf
+        tag_func  - a TagProfile or a function that takes a list of sam
+                    fields and a tag identifier and returns a numeric value
+                    for that tag. Default = get_tag
+        paired    - process as paired end reads. Default = False
+        conservative - use the conservative paired end rules. Default = False
+        policy    - a PairPolicy for paired end reads used in place of the
+                    liberal or conservative rules. Default = None
+        batch_size - the number of reads classified together
+    Returns:
+        category_counts - a Counter keyed by state (single end) or tuple
+                    of forward and reverse states (paired end)
+    """
+    _require_numpy()
+    from xenomapper.xenomapper import get_tag, get_score_function
+    score_func = get_score_function(tag_func or get_tag)
+    outputs = (primary_specific, secondary_specific, primary_multi,
+               secondary_multi, unassigned, unresolved)
+    table = _pair_table(policy or (CONSERVATIVE if conservative else LIBERAL))
+    category_counts = Counter()
+    previous = None #the last read pair of the previous batch
+    for batch in batch_readpairs(readpairs, batch_size=batch_size):
+        for line1, line2 in batch:
+            assert line1[0] == line2[0]
+        if paired and previous is not None:
+            batch.insert(0, previous)
+        states = get_mapping_states(*_scores(batch, score_func), min_score=min_score)
+        if paired:
+            #as for main_paired_end every adjacent pair of reads with the same name is processed
+            names = [line1[0] for line1, line2 in batch]
+            reverse_index = numpy.array([i for i in range(1, len(names)) if names[i] == names[i-1]], dtype=numpy.intp)
+            forward = states[reverse_index - 1]
+            reverse = states[reverse_index]
+            category_counts.update(count_state_pairs(forward, reverse))
+            output_states = table[forward, reverse]
+            for state, outfile in enumerate(outputs):
+                if outfile:
+                    for i in reverse_index[output_states == state]:
+                        if WRITTEN_READS[state] == BOTH_READS:
+                            write_read(outfile, batch[i-1][0])
+                            write_read(outfile, batch[i][0])
+                            write_read(outfile, batch[i-1][1])
+                            write_read(outfile, batch[i][1])
+                        else:
+                            side = WRITTEN_READS[state]
+                            write_read(outfile, batch[i-1][side])
+                            write_read(outfile, batch[i][side])
+            previous = batch[-1]
+        else:
+            category_counts.update(count_states(states))
+            for state, outfile in enumerate(outputs):
+                if outfile:
+                    for i in numpy.flatnonzero(states == state):
+                        for side in ((0, 1) if WRITTEN_READS[state] == BOTH_READS else (WRITTEN_READS[state],)):
+                            write_read(outfile, batch[i][side])
+    return category_counts
+
+
+def vectorised_main_single_end(readpairs, **kw):
+    """Vectorised equivalent of main_single_end"""
+    return vectorised_main(readpairs, paired=False, **kw)
+
+def vectorised_main_paired_end(readpairs, **kw):
+    """Vectorised equivalent of main_paired_end"""
+    return vectorised_main(readpairs, paired=True, conservative=False, **kw)
+
+def vectorised_conservative_main_paired_end(readpairs, **kw):
+    """Vectorised equivalent of conservative_main_paired_end"""
+    return vectorised_main(readpairs, paired=True, conservative=True, **kw)
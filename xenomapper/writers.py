@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+writers.py
+
+Output of reads from xenomapper to SAM files or writer objects.
+
+Created by Matthew Wakefield.
+Copyright (c) 2011-2019  Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne. All rights reserved.
+"""
+import re
+import queue
+import threading
+from xenomapper.sam import SamLine
+from xenomapper.bam import BamRecord, BgzfWriter
+
+__author__ = "Matthew Wakefield"
+__copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
+__credits__ = ["Matthew Wakefield",]
+__license__ = "GPL"
+__version__ = "1.0.2"
+__maintainer__ = "Matthew Wakefield"
+__email__ = "wakefield@wehi.edu.au"
+__status__ = "Production/Stable"
+
+OUTPUT_CATEGORIES = ('primary_specific', 'secondary_specific', 'primary_multi',
+                     'secondary_multi', 'unassigned', 'unresolved')
+
+_COMPLEMENT = bytes.maketrans(b'ACGTUNRYKMSWBDHVacgtunrykmswbdhv', b'TGCAANYRMKSWVHDBtgcaanyrmkswvhdb')
+#the quality written for reads without qualities, as by samtools fastq
+_MISSING_QUALITY = b'"'
+_FASTQ_NAME = re.compile(r'(\.f(ast)?q)?(\.b?gz)?$')
+
+def write_header(outfile, header):
+    """Write a list of SAM header lines to a SAM file or a writer
+    object (such as a BamWriter) with a write_header method"""
+    if hasattr(outfile, 'write_header'):
+        outfile.write_header(header)
+    else:
+        print('\n'.join(header), file=outfile)
+    pass
+
+def write_read(outfile, line):
+    """Write a read as a line of SAM or to a writer object (such as a
+    BamWriter) with a write_read method. SamLines are written unchanged."""
+    if hasattr(outfile, 'write_read'):
+        outfile.write_read(line)
+    elif isinstance(line, SamLine):
+        outfile.write(line.raw.decode('ascii'))
+    else:
+        print('\t'.join(line),file=outfile)
+    pass
+
+
+class SamWriter(object):
+    """Writer for SAM format output to a binary file.
+    SamLines are written as their original bytes and other reads
+    (lists of SAM fields or BamRecords) are joined with tabs.
+    Arguments:
+        fileobj - a binary file or file like object for output
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        pass
+
+    def write_header(self, header):
+        """Write a list of SAM header lines"""
+        self.fileobj.write(('\n'.join(header) + '\n').encode('ascii'))
+        pass
+
+    def write_read(self, line):
+        if isinstance(line, SamLine):
+            self.fileobj.write(line.raw)
+        else:
+            self.fileobj.write(('\t'.join(line) + '\n').encode('ascii'))
+        pass
+
+    def flush(self):
+        """Flush the output"""
+        self.fileobj.flush()
+        pass
+
+    def close(self):
+        """Flush the output. The underlying file object is not closed."""
+        self.fileobj.flush()
+        pass
+
+
+def split_fastq_names(filename):
+    """Return the names of the R1 and R2 files of split FASTQ output,
+    inserting _R1 and _R2 before any .fastq/.fq and .gz/.bgz extensions
+    (eg human.fastq.gz gives human_R1.fastq.gz and human_R2.fastq.gz)"""
+    match = _FASTQ_NAME.search(filename)
+    return tuple(filename[:match.start()] + suffix + match.group() for suffix in ('_R1', '_R2'))
+
+def is_compressed_name(filename):
+    """Return True if an output file name has a .gz or .bgz extension"""
+    return filename.endswith(('.gz', '.bgz'))
+
+
+class FastqWriter(object):
+    """Writer for FASTQ format output to binary files.
+    Reads are written in their sequenced orientation, with the sequence of
+    reverse strand alignments (flag 0x10) reverse complemented and their
+    qualities reversed.  Secondary and supplementary alignments are not
+    written, and each read is written once where the alignments of a read
+    in both species are written consecutively (as for unresolved reads).
+    Interleaved pairs are written first read first.  The header is not written.
+    Arguments:
+        fileobj      - a binary file or file like object for output of all
+                       reads, or the first read of pairs (flag 0x40) when
+                       mate_fileobj is given
+        mate_fileobj - an optional binary file for the second read of pairs
+                       (flag 0x80). Default None writes interleaved pairs
+        compress     - compress the output as BGZF, which can be read as gzip.
+                       Default False
+        executor     - an optional concurrent.futures executor used
+                       for BGZF compression
+    """
+    def __init__(self, fileobj, mate_fileobj=None, compress=False, executor=None):
+        if compress:
+            fileobj = BgzfWriter(fileobj, executor=executor)
+            if mate_fileobj:
+                mate_fileobj = BgzfWriter(mate_fileobj, executor=executor)
+        self.compress = compress
+        self.fileobj = fileobj
+        self.mate_fileobj = mate_fileobj or fileobj
+        self._qname = None
+        self._written = set()
+        self._pending = None
+        pass
+
+    def write_header(self, header):
+        """FASTQ files have no header"""
+        pass
+
+    def write_read(self, line):
+        if isinstance(line, SamLine):
+            raw = line.raw
+            fields = raw.rstrip(b'\r\n').split(b'\t', 11) if b'\t' in raw else raw.split()
+        elif isinstance(line, BamRecord):
+            fields = [x.encode('ascii') for x in line.sam_fields()[:11]]
+        else:
+            fields = [x.encode('ascii') for x in line[:11]]
+        qname, flag, seq, qual = fields[0], int(fields[1]), fields[9], fields[10]
+        if flag & 0x900:
+            return
+        if qname != self._qname:
+            self._write_pending()
+            self._qname = qname
+            self._written = set()
+        mate = flag & 0xc0
+        if mate in self._written:
+            return
+        self._written.add(mate)
+        if seq == b'*':
+            seq = b''
+        if qual == b'*':
+            qual = _MISSING_QUALITY * len(seq)
+        if flag & 0x10:
+            seq = seq.translate(_COMPLEMENT)[::-1]
+            qual = qual[::-1]
+        record = b'@' + qname + b'\n' + seq + b'\n+\n' + qual + b'\n'
+        if not flag & 0x80:
+            self.fileobj.write(record)
+            self._write_pending()
+        elif self.mate_fileobj is self.fileobj and 0x40 not in self._written:
+            #interleaved pairs are written first read first
+            self._pending = record
+        else:
+            self.mate_fileobj.write(record)
+        pass
+
+    def _write_pending(self):
+        if self._pending:
+            self.fileobj.write(self._pending)
+            self._pending = None
+        pass
+
+    def flush(self):
+        """Flush the output"""
+        self._write_pending()
+        self.fileobj.flush()
+        if self.mate_fileobj is not self.fileobj:
+            self.mate_fileobj.flush()
+        pass
+
+    def close(self):
+        """Flush the output, ending BGZF compressed files.
+        The underlying file objects are not closed."""
+        self._write_pending()
+        for fileobj in {id(x):x for x in (self.fileobj, self.mate_fileobj)}.values():
+            if self.compress:
+                fileobj.close()
+            else:
+                fileobj.flush()
+        pass
+
+
+class BackgroundWriter(object):
+    """A binary file like object that collects writes into blocks and
+    writes each block to a file on a background thread, so the caller
+    does not wait for slow filesystems.
+    Writes are collected until at least buffer_size bytes are held and the
+    block is then joined and written with a single write call.  At most
+    max_pending blocks wait for the background thread, after which write
+    blocks the caller until the file catches up.  An error writing the
+    file is raised by the next write, flush or close.
+    Arguments:
+        fileobj     - a binary file or file like object for output
+        buffer_size - the size in bytes of blocks written. Default 4MB
+        max_pending - the maximum number of blocks waiting to be
+                      written. Default = 4
+    Attributes:
+        blocks      - the number of blocks written
+        waits       - the number of blocks that waited for a full queue
+    """
+    def __init__(self, fileobj, buffer_size=2**22, max_pending=4):
+        self.fileobj = fileobj
+        self.buffer_size = buffer_size
+        self.blocks = 0
+        self.waits = 0
+        self._block = []
+        self._size = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._write_blocks, daemon=True)
+        self._thread.start()
+        pass
+
+    def _write_blocks(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                self._queue.task_done()
+                return
+            if self._error is None:
+                try:
+                    self.fileobj.write(b''.join(block))
+                    self.blocks += 1
+                except Exception as error:
+                    self._error = error
+            self._queue.task_done()
+        pass
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error
+        pass
+
+    def _submit(self):
+        self._check_error()
+        block = self._block
+        self._block = []
+        self._size = 0
+        if self._queue.full():
+            self.waits += 1
+        self._queue.put(block)
+        pass
+
+    def write(self, data):
+        self._block.append(data)
+        self._size += len(data)
+        if self._size >= self.buffer_size:
+            self._submit()
+        return len(data)
+
+    def writelines(self, lines):
+        for data in lines:
+            self.write(data)
+        pass
+
+    def flush(self):
+        """Write all collected data and wait for it to reach the file"""
+        if self._block:
+            self._submit()
+        self._queue.join()
+        self._check_error()
+        self.fileobj.flush()
+        pass
+
+    def close(self):
+        """Flush all data and stop the background thread.
+        The underlying file object is not closed."""
+        if self._thread.is_alive():
+            self.flush()
+            self._queue.put(None)
+            self._thread.join()
+        pass
@@ -19,10 +19,29 @@ Copyright (c) 2011-2016  Matthew Wakefield, The Walter and Eliza Hall Institute
 import sys
 import os
 import argparse, textwrap
-import subprocess
-import re
+import importlib
 from collections import Counter
 from copy import copy
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from xenomapper.sam import SamLine, sam_lines, open_sam
+from xenomapper.bam import BgzfReader, BamReader, BamRecord, BamWriter, read_bam_header, bam_records
+from xenomapper.profiles import TagProfile, CigarProfile, CigarScorer, BOWTIE2, HISAT, CIGAR, cigar_score
+from xenomapper.join import ReadPairJoiner, output_join_summary
+from xenomapper.estimate import SamSampler, sequential_groups, estimate_category_counts, output_estimate
+from xenomapper.checkpoint import Checkpoint, HeaderRestorer, checkpointed_main, truncate_outputs
+from xenomapper.metrics import Metrics, metered_main
+from xenomapper.profiling import add_profile_arguments, profile_call
+from xenomapper.writers import OUTPUT_CATEGORIES, SamWriter, FastqWriter, BackgroundWriter, write_header, write_read, \
+                               split_fastq_names, is_compressed_name
+from xenomapper.parallel import parallel_main
+from xenomapper.scoretable import ScoreTableWriter
+from xenomapper.manifest import ManifestWriter
+from xenomapper.sweep import ThresholdSweep, add_sweep_arguments, output_sweep
+from xenomapper.policies import PairPolicy, LIBERAL, CONSERVATIVE, MAPPING_STATES, STATE_CODES, \
+                                PRIMARY_READS, SECONDARY_READS, pair_counts
+from xenomapper.vectorised import vectorised_main, vectorised_main_single_end, vectorised_main_paired_end, \
+                                  vectorised_conservative_main_paired_end
 
 __author__ = "Matthew Wakefield"
 __copyright__ = "Copyright 2011-2019 Matthew Wakefield, The Walter and Eliza Hall Institute and The University of Melbourne"
@@ -34,61 +53,83 @@ __email__ = "wakefield@wehi.edu.au"
 __status__ = "Production/Stable"
 
 def get_sam_header(samfile):
-    line = "@"
+    """Return the header of a sam file as a list of sam header lines
+        Arguments: a file or file like object in sam format
+        Returns:   a list of header lines without newlines
+                   The file is left at the first line after the header.
+                   Binary files that support peek (including pipes
+                   and FIFOs opened with open(filename, 'rb')) are read
+                   without seeking, other files must be seekable.
+    """
     header = []
+    if hasattr(samfile, 'peek'):
+        while samfile.peek(1)[:1] == b'@':
+            header.append(samfile.readline().decode('ascii').strip('\n'))
+        return header
+    line = "@"
     pointer = 0
-    while line[0] == '@':
+    while line[:1] == '@':
         pointer = samfile.tell()
-        line = samfile.readline().strip('\n')
-        if line[0] == '@':
+        line = samfile.readline()
+        if isinstance(line, bytes): #binary sam file
+            line = line.decode('ascii')
+        line = line.strip('\n')
+        if line[:1] == '@':
             header.append(line)
     samfile.seek(pointer) #set file to first line after header
     return header
 
-def get_bam_header(bamfile): #pragma: no cover #not tested due to need for samtools
-    p = subprocess.Popen('samtools view -H -',stdin=bamfile,stdout=subprocess.PIPE,stderr=subprocess.PIPE, shell=True)
-    header = []
-    for line in p.stdout:
-        header.append(line.decode('ascii'))
-    bamfile.seek(0) #reset to start of file for next samtools call
-    return [x.strip('\n') for x in header]
+def get_bam_header(bamfile):
+    """Return the header of a bam file as a list of sam header lines
+        Arguments: a BamReader or a seekable binary file or file like
+                   object in bam format
+        Returns:   a list of header lines without newlines
+                   A file is reset to the start for subsequent reading.
+                   A BamReader has already read the header so can
+                   be used with files that are not seekable.
+    """
+    if isinstance(bamfile, BamReader):
+        return bamfile.header
+    header, references = read_bam_header(BgzfReader(bamfile))
+    bamfile.seek(0) #reset to start of file for reading records
+    return header
 
-def bam_lines(f): #pragma: no cover #not tested due to need for samtools
-    """Use samtools in a subprocess to yield lines of sam from a bam file
+def bam_lines(f):
+    """Yield lines of sam from a bam file
         Arguments: a file or file like object in bam format
         Yields:    ascii sam file lines
     """
-    p = subprocess.Popen('samtools view -',stdin=f,stdout=subprocess.PIPE,stderr=subprocess.PIPE, shell=True)
-    header_lines = []
-    for line in p.stdout:
-        yield line.decode('ascii')
+    for record in bam_records(f):
+        yield '\t'.join(record.sam_fields())+'\n'
 
-def getBamReadPairs(bamfile1,bamfile2, skip_repeated_reads=False): #pragma: no cover #not tested due to need for samtools
-    """Process two bamfiles to yield the equivalent line from each file
+def getBamReadPairs(bamfile1,bamfile2, skip_repeated_reads=False):
+    """Process two bamfiles to yield the equivalent record from each file
         Arguments: 
-        bamfile1, bamfile2  - file or file like objects in binary bam format
-                              containing the same reads in the same order
-                              mapped in two different species
-        Yields:    a tuple of lists of sam fields split on white space
+        bamfile1, bamfile2  - BamReaders or file or file like objects in
+                              binary bam format containing the same reads
+                              in the same order mapped in two different species
+        Yields:    a tuple of BamRecord objects. These behave as lists of
+                   sam fields but only decode the read name, flag and
+                   score tags unless other fields are accessed.
     """
-    bam1 = bam_lines(bamfile1)
-    bam2 = bam_lines(bamfile2)
+    bam1 = iter(bamfile1) if isinstance(bamfile1, BamReader) else bam_records(bamfile1)
+    bam2 = iter(bamfile2) if isinstance(bamfile2, BamReader) else bam_records(bamfile2)
     try:
-        line1= next(bam1).strip('\n').split() #split on white space. Results in 11 fields of mandatory SAM + variable number of additional tags.
-        line2= next(bam2).strip('\n').split()
-        while line1 and line2 and line1 !=[''] and line2 !=['']:
-            assert line1[0] == line2[0]
+        line1= next(bam1)
+        line2= next(bam2)
+        while True:
+            assert line1.qname == line2.qname
             yield line1,line2
-            previous_read1 = line1[0]
-            previous_read2 = line2[0]
+            previous_read1 = line1.qname
+            previous_read2 = line2.qname
             if skip_repeated_reads:
-                while line1 and line2 and line1 !=[''] and line2 !=[''] and line1[0] == previous_read1:
-                    line1= next(bam1).strip('\n').split()
-                while line1 and line2 and line1 !=[''] and line2 !=[''] and line2[0] == previous_read2:
-                    line2= next(bam2).strip('\n').split()
+                while line1.qname == previous_read1:
+                    line1= next(bam1)
+                while line2.qname == previous_read2:
+                    line2= next(bam2)
             else:
-                line1= next(bam1).strip('\n').split()
-                line2= next(bam2).strip('\n').split()
+                line1= next(bam1)
+                line2= next(bam2)
     except StopIteration:
         return
 
@@ -117,11 +158,40 @@ def getReadPairs(sam1,sam2, skip_repeated_reads=False):
             line2= sam2.readline().strip('\n').split()
     pass
 
+def getRawReadPairs(sam1,sam2, skip_repeated_reads=False):
+    """Process two binary sam files to yield the equivalent line from each file
+        Arguments: 
+        sam1, sam2  - file or file like objects in binary sam format
+                      containing the same reads in the same order
+                      mapped in two different species
+        Yields:    a tuple of SamLine objects. These behave as lists of
+                   sam fields split on tabs but keep the original bytes
+                   of the line for output.
+    """
+    raw1 = sam1.readline()
+    raw2 = sam2.readline()
+    while raw1 not in (b'', b'\n') and raw2 not in (b'', b'\n'):
+        line1 = SamLine(raw1)
+        line2 = SamLine(raw2)
+        assert line1.qname == line2.qname
+        yield line1,line2
+        raw1 = sam1.readline()
+        raw2 = sam2.readline()
+        if skip_repeated_reads:
+            previous_read = line1.qname.encode('ascii')
+            end = len(previous_read)
+            #fields may be separated by spaces rather than tabs
+            while raw1.startswith(previous_read) and raw1[end:end+1] in (b'\t', b' '):
+                raw1 = sam1.readline()
+            while raw2.startswith(previous_read) and raw2[end:end+1] in (b'\t', b' '):
+                raw2 = sam2.readline()
+    pass
+
 def add_pg_tag(sam_header_list,comment=None):
     new_header = copy(sam_header_list)
     if not [x[0] for x in new_header] == ['@',]*len(new_header):
         raise ValueError('Incorrect SAM header format :\n{0}'.format('\n'.join(new_header))) #pragma: no cover
-    if new_header[-1][:3] == '@PG':
+    if new_header and new_header[-1][:3] == '@PG':
         PP = 'PP'+[x for x in new_header[-1].split() if x[:2] == 'ID'][0][2:]+'\t'
     else:
         PP = ''
@@ -138,51 +208,56 @@ def process_headers(file1,file2, primary_specific=sys.stdout, secondary_specific
                         or ascii sam format
         primary_specific, secondary_specific, primary_multi,
         secondary_multi, unassigned, unresolved
-                      - ascii file or file like objects for outputs
+                      - ascii file or file like objects or writer objects
+                        (such as a BamWriter) for outputs
         bam           - Boolean flag indicating file1 & file2 are
                         in binary bam format.  Default = False
     """
-    if bam: #pragma: no cover
+    if bam:
         samheader1 = get_bam_header(file1)
         samheader2 = get_bam_header(file2)
     else:
         samheader1 = get_sam_header(file1)
         samheader2 = get_sam_header(file2)
-    print('\n'.join(add_pg_tag(samheader1,
+    if primary_specific:
+        write_header(primary_specific, add_pg_tag(samheader1,
                     comment='species specific reads'
-                    )), file=primary_specific)
+                    ))
     if secondary_specific:
-        print('\n'.join(add_pg_tag(samheader2,
+        write_header(secondary_specific, add_pg_tag(samheader2,
                     comment='species specific reads'
-                    )), file=secondary_specific)
+                    ))
     if primary_multi:
-        print('\n'.join(add_pg_tag(samheader1,
+        write_header(primary_multi, add_pg_tag(samheader1,
                     comment='species specific multimapping reads'
-                    )), file=primary_multi)
+                    ))
     if secondary_multi:
-        print('\n'.join(add_pg_tag(samheader2,
+        write_header(secondary_multi, add_pg_tag(samheader2,
                     comment='species specific multimapping reads'
-                    )), file=secondary_multi)
+                    ))
     if unassigned:
-        print('\n'.join(add_pg_tag(samheader1,
+        write_header(unassigned, add_pg_tag(samheader1,
                     comment='reads that could not be assigned'
-                    )), file=unassigned)
+                    ))
     if unresolved: #This will not be the correct header - Look into merging header 1 and 2
-        print('\n'.join(add_pg_tag(samheader1,
+        write_header(unresolved, add_pg_tag(samheader1,
                     comment='reads that could not be resolved'
-                    )), file=unresolved)
+                    ))
     pass
 
 def get_tag(sam_line,tag='AS'):
     """Return the value of a SAM tag field
     Arguments:
-        sam_line  - list of elements from a SAM file line
+        sam_line  - list of elements from a SAM file line or a SamLine
+                    or BamRecord (which match tag names exactly)
         tag       - the name of the optional tag to be returned
                     Only suitable for numeric tags eg AS or XS
     Returns
         tag_value - the value of the SAM tag converted to a float
                     or -inf if tag is not present.
     """
+    if isinstance(sam_line, (SamLine, BamRecord)):
+        return sam_line.get_tag(tag)
     tag_list = [x for x in sam_line[11:] if tag in x]
     if not tag_list:
         return float('-inf') #this will always be worse than any bowtie score
@@ -248,12 +323,31 @@ def get_cigarbased_AS_tag(sam_line,tag='AS'):
     if not NM:
         return float('-inf') #either a multimapper or unmapped
     mismatches = int(NM[0].split(':')[-1])
-    cigar = re.findall(r'([0-9]+)([MIDNSHPX=])',sam_line[5]) 
-    deletions = [int(x[0]) for x in cigar if x[1] == 'D']
-    insertions = [int(x[0]) for x in cigar if x[1] == 'I']
-    softclips = [int(x[0]) for x in cigar if x[1] == 'S']
-    score = (-6 * mismatches) + (-5 * (len(insertions) + len(deletions))) + (-3 * (sum(insertions) + sum(deletions))) + (-2 * sum(softclips))
-    return score
+    return cigar_score(sam_line[5], mismatches)
+
+#Compiled profiles used by the main loops in place of the tag functions above
+TAG_FUNC_PROFILES = {get_tag:BOWTIE2,
+                     get_tag_with_ZS_as_XS:HISAT,
+                     get_cigarbased_AS_tag:CIGAR,
+                     }
+
+def get_score_function(tag_func=get_tag):
+    """Return a function that takes a read and returns a tuple of the
+    AS and XS scores of the read.
+    The tag functions get_tag, get_tag_with_ZS_as_XS and
+    get_cigarbased_AS_tag are replaced by the equivalent compiled
+    profile from xenomapper.profiles, which extracts both scores in one
+    pass with exact tag name matching and does not parse the tags of
+    unmapped reads.  Any other tag_func is called once for each tag.
+    Arguments:
+        tag_func  - a TagProfile or a function that takes a list of sam
+                    fields and a tag identifier (at least 'AS' and 'XS')
+                    returns a numeric value for that tag
+    """
+    profile = TAG_FUNC_PROFILES.get(tag_func, tag_func)
+    if isinstance(profile, TagProfile):
+        return profile.scores
+    return lambda sam_line: (tag_func(sam_line, tag='AS'), tag_func(sam_line, tag='XS'))
 
 def get_mapping_state(AS1,XS1,AS2,XS2, min_score=float('-inf')):
     """Determine the mapping state based on scores in each species.
@@ -302,14 +396,15 @@ def main_single_end(readpairs,
         readpairs - an iterable of tuples of lists of sam fields
         primary_specific, secondary_specific, primary_multi,
         secondary_multi, unassigned, unresolved
-                  - ascii file or file like objects for outputs
+                  - ascii file or file like objects or writer objects
+                    (such as a BamWriter) for outputs
         min_score - the score that matches must exceed in order to be
                     considered valid matches. Note scores equalling this
                     value will also be considered not to match.
                     Default = -inf
-        tag_func  - a function that takes a list of sam fields and a
-                    tag identifier (at least 'AS' and 'XS')
-                    returns a numeric value for that tag
+        tag_func  - a TagProfile (see xenomapper.profiles) or a function
+                    that takes a list of sam fields and a tag identifier
+                    (at least 'AS' and 'XS') returns a numeric value for that tag
     Returns:
         category_counts - a dictionary keyed by category containing
                     occurance counts
@@ -317,13 +412,12 @@ def main_single_end(readpairs,
     #assume that reads occur only once and are in the same order in both files
     
     category_counts = Counter()
+    scores = get_score_function(tag_func)
     
     for line1,line2 in readpairs:
         assert line1[0] == line2[0]
-        AS1 = tag_func(line1, tag='AS')
-        XS1 = tag_func(line1, tag='XS')
-        AS2 = tag_func(line2, tag='AS')
-        XS2 = tag_func(line2, tag='XS')
+        AS1, XS1 = scores(line1)
+        AS2, XS2 = scores(line2)
         
         state = get_mapping_state(AS1,XS1,AS2,XS2,min_score)
         
@@ -331,27 +425,28 @@ def main_single_end(readpairs,
         
         if state == 'primary_specific':
             if primary_specific:
-                print('\t'.join(line1),file=primary_specific)
+                write_read(primary_specific, line1)
         elif state == 'secondary_specific':
             if secondary_specific:
-                print('\t'.join(line2),file=secondary_specific)
+                write_read(secondary_specific, line2)
         elif state == 'primary_multi':
             if primary_multi:
-                print('\t'.join(line1),file=primary_multi)
+                write_read(primary_multi, line1)
         elif state == 'secondary_multi':
             if secondary_multi:
-                print('\t'.join(line2),file=secondary_multi)
+                write_read(secondary_multi, line2)
         elif state == 'unassigned':
             if unassigned:
-                print('\t'.join(line1),file=unassigned)
+                write_read(unassigned, line1)
         elif state == 'unresolved':
             if unresolved:
-                print('\t'.join(line1),file=unresolved)
-                print('\t'.join(line2),file=unresolved)
+                write_read(unresolved, line1)
+                write_read(unresolved, line2)
         else: raise RuntimeError('Unexpected state {0} '.format(state)) # pragma: no cover
     return category_counts
 
-def main_paired_end(readpairs,
+def policy_main_paired_end(readpairs,
+                    policy=LIBERAL,
                     primary_specific=sys.stdout,
                     secondary_specific=None,
                     primary_multi=None,
@@ -360,38 +455,41 @@ def main_paired_end(readpairs,
                     unresolved=None,
                     min_score=float('-inf'),
                     tag_func=get_tag):
-    """Liberal main loop for processing paired end read files.
-    Discordant reads will be assigned to the highest
-    priority category in the order: primary_specific,
-    secondary_specific, primary_multi, secondary_multi,
-    unresolved, unassigned
-    
-    This will rescue unresolved or unassigned reads where the second read 
-    can be assigned, and deems primary/secondary discordant reads as
-    primary.
+    """Main loop for processing paired end read files with a pairing policy.
+    Each pair is assigned to an output category by looking up the mapping
+    states of the forward and reverse reads in the table of the policy
+    (see xenomapper.policies).  main_paired_end and
+    conservative_main_paired_end use this loop with the LIBERAL and
+    CONSERVATIVE policies.
     
     Paired end reads must be sequential in the sam or bam file,
     occur only once and be in the same order in both files.
     
     Arguments:
         readpairs - an iterable of tuples of lists of sam fields
+        policy    - a PairPolicy. Default = LIBERAL
         primary_specific, secondary_specific, primary_multi,
         secondary_multi, unassigned, unresolved
-                  - ascii file or file like objects for outputs
+                  - ascii file or file like objects or writer objects
+                    (such as a BamWriter) for outputs
         min_score - the score that matches must exceed in order to be
                     considered valid matches. Note scores equalling this
                     value will also be considered not to match.
                     Default = -inf
-        tag_func  - a function that takes a list of sam fields and a
-                    tag identifier (at least 'AS' and 'XS')
-                    returns a numeric value for that tag
+        tag_func  - a TagProfile (see xenomapper.profiles) or a function
+                    that takes a list of sam fields and a tag identifier
+                    (at least 'AS' and 'XS') returns a numeric value for that tag
     Returns:
         category_counts - a dictionary keyed by a tuple of forward
                     and reverse read category containing
                     occurance counts
     """
     
-    category_counts = Counter()
+    scores = get_score_function(tag_func)
+    actions = policy.actions((primary_specific, secondary_specific, primary_multi,
+                              secondary_multi, unassigned, unresolved))
+    n = len(MAPPING_STATES)
+    counts = [0] * n * n
     
     previous_line1 = []
     previous_line2 = []
@@ -405,53 +503,84 @@ def main_paired_end(readpairs,
             continue
         
         #Get AS and XS tags from all four reads
-        PAS1 = tag_func(previous_line1, tag='AS')
-        PXS1 = tag_func(previous_line1, tag='XS')
-        PAS2 = tag_func(previous_line2, tag='AS')
-        PXS2 = tag_func(previous_line2, tag='XS')
-        AS1 = tag_func(line1, tag='AS')
-        XS1 = tag_func(line1, tag='XS')
-        AS2 = tag_func(line2, tag='AS')
-        XS2 = tag_func(line2, tag='XS')
-        
-        forward_state = get_mapping_state(PAS1,PXS1,PAS2,PXS2,min_score)
-        reverse_state = get_mapping_state(AS1,XS1,AS2,XS2,min_score)
+        PAS1, PXS1 = scores(previous_line1)
+        PAS2, PXS2 = scores(previous_line2)
+        AS1, XS1 = scores(line1)
+        AS2, XS2 = scores(line2)
         
-        category_counts[(forward_state,reverse_state)] += 1
+        index = STATE_CODES[get_mapping_state(PAS1,PXS1,PAS2,PXS2,min_score)] * n + \
+                STATE_CODES[get_mapping_state(AS1,XS1,AS2,XS2,min_score)]
+        counts[index] += 1
         
-        
-        if forward_state == 'primary_specific' or reverse_state == 'primary_specific':
-            if primary_specific:
-                print('\t'.join(previous_line1),file=primary_specific) 
-                print('\t'.join(line1),file=primary_specific)
-        elif forward_state == 'secondary_specific' or reverse_state == 'secondary_specific':
-            if secondary_specific:
-                print('\t'.join(previous_line2),file=secondary_specific) 
-                print('\t'.join(line2),file=secondary_specific)
-        elif forward_state == 'primary_multi' or reverse_state == 'primary_multi':
-            if primary_multi:
-                print('\t'.join(previous_line1),file=primary_multi) 
-                print('\t'.join(line1),file=primary_multi)
-        elif forward_state == 'secondary_multi' or reverse_state == 'secondary_multi':
-            if secondary_multi:
-                print('\t'.join(previous_line2),file=secondary_multi) 
-                print('\t'.join(line2),file=secondary_multi)
-        elif forward_state == 'unresolved' or reverse_state == 'unresolved':
-            if unresolved:
-                print('\t'.join(previous_line1),file=unresolved) 
-                print('\t'.join(line1),file=unresolved)
-                print('\t'.join(previous_line2),file=unresolved) 
-                print('\t'.join(line2),file=unresolved)
-        elif forward_state == 'unassigned' or reverse_state == 'unassigned':
-            if unassigned:
-                print('\t'.join(previous_line1),file=unassigned) 
-                print('\t'.join(line1),file=unassigned)
-        else: raise RuntimeError('Unexpected states forward:{0} reverse:{1}'.format(forward_state,reverse_state)) # pragma: no cover
+        outfile, written = actions[index]
+        if outfile:
+            if written == PRIMARY_READS:
+                write_read(outfile, previous_line1)
+                write_read(outfile, line1)
+            elif written == SECONDARY_READS:
+                write_read(outfile, previous_line2)
+                write_read(outfile, line2)
+            else:
+                write_read(outfile, previous_line1)
+                write_read(outfile, line1)
+                write_read(outfile, previous_line2)
+                write_read(outfile, line2)
         
         previous_line1 = line1
         previous_line2 = line2
         
-    return category_counts
+    return pair_counts(counts)
+
+def main_paired_end(readpairs,
+                    primary_specific=sys.stdout,
+                    secondary_specific=None,
+                    primary_multi=None,
+                    secondary_multi=None,
+                    unassigned=None,
+                    unresolved=None,
+                    min_score=float('-inf'),
+                    tag_func=get_tag):
+    """Liberal main loop for processing paired end read files.
+    Discordant reads will be assigned to the highest
+    priority category in the order: primary_specific,
+    secondary_specific, primary_multi, secondary_multi,
+    unresolved, unassigned
+    
+    This will rescue unresolved or unassigned reads where the second read 
+    can be assigned, and deems primary/secondary discordant reads as
+    primary.
+    
+    Paired end reads must be sequential in the sam or bam file,
+    occur only once and be in the same order in both files.
+    
+    Arguments:
+        readpairs - an iterable of tuples of lists of sam fields
+        primary_specific, secondary_specific, primary_multi,
+        secondary_multi, unassigned, unresolved
+                  - ascii file or file like objects or writer objects
+                    (such as a BamWriter) for outputs
+        min_score - the score that matches must exceed in order to be
+                    considered valid matches. Note scores equalling this
+                    value will also be considered not to match.
+                    Default = -inf
+        tag_func  - a TagProfile (see xenomapper.profiles) or a function
+                    that takes a list of sam fields and a tag identifier
+                    (at least 'AS' and 'XS') returns a numeric value for that tag
+    Returns:
+        category_counts - a dictionary keyed by a tuple of forward
+                    and reverse read category containing
+                    occurance counts
+    """
+    
+    return policy_main_paired_end(readpairs, policy=LIBERAL,
+                    primary_specific=primary_specific,
+                    secondary_specific=secondary_specific,
+                    primary_multi=primary_multi,
+                    secondary_multi=secondary_multi,
+                    unassigned=unassigned,
+                    unresolved=unresolved,
+                    min_score=min_score,
+                    tag_func=tag_func)
 
 def conservative_main_paired_end(readpairs,
                     primary_specific=sys.stdout,
@@ -477,83 +606,30 @@ def conservative_main_paired_end(readpairs,
         readpairs - an iterable of tuples of lists of sam fields
         primary_specific, secondary_specific, primary_multi,
         secondary_multi, unassigned, unresolved
-                  - ascii file or file like objects for outputs
+                  - ascii file or file like objects or writer objects
+                    (such as a BamWriter) for outputs
         min_score - the score that matches must exceed in order to be
                     considered valid matches. Note scores equalling this
                     value will also be considered not to match.
                     Default = -inf
-        tag_func  - a function that takes a list of sam fields and a
-                    tag identifier (at least 'AS' and 'XS')
-                    returns a numeric value for that tag
+        tag_func  - a TagProfile (see xenomapper.profiles) or a function
+                    that takes a list of sam fields and a tag identifier
+                    (at least 'AS' and 'XS') returns a numeric value for that tag
     Returns:
         category_counts - a dictionary keyed by a tuple of forward
                     and reverse read category containing
                     occurance counts
     """
     
-    category_counts = Counter()
-    
-    previous_line1 = []
-    previous_line2 = []
-    for line1,line2 in readpairs:
-        assert line1[0] == line2[0]
-        
-        #Test to see if line1 is pair of previous_line1 - if not skip ahead to next readpair
-        if not previous_line1 or not line1 or not previous_line1[0] == line1[0]:
-            previous_line1 = line1
-            previous_line2 = line2
-            continue
-        
-        #Get AS and XS tags from all four reads
-        PAS1 = tag_func(previous_line1, tag='AS')
-        PXS1 = tag_func(previous_line1, tag='XS')
-        PAS2 = tag_func(previous_line2, tag='AS')
-        PXS2 = tag_func(previous_line2, tag='XS')
-        AS1 = tag_func(line1, tag='AS')
-        XS1 = tag_func(line1, tag='XS')
-        AS2 = tag_func(line2, tag='AS')
-        XS2 = tag_func(line2, tag='XS')
-        
-        forward_state = get_mapping_state(PAS1,PXS1,PAS2,PXS2,min_score)
-        reverse_state = get_mapping_state(AS1,XS1,AS2,XS2,min_score)
-        
-        category_counts[(forward_state,reverse_state)] += 1
-        if forward_state == 'unassigned' or reverse_state == 'unassigned':
-            if unassigned:
-                print('\t'.join(previous_line1),file=unassigned) 
-                print('\t'.join(line1),file=unassigned)
-        elif forward_state == 'unresolved' or reverse_state == 'unresolved' \
-            or (forward_state in ['primary_specific','primary_multi'] and \
-                reverse_state in ['secondary_specific','secondary_multi']) \
-            or (forward_state in ['secondary_specific','secondary_multi'] and \
-                reverse_state in ['primary_specific','primary_multi']):
-            if unresolved:
-                print('\t'.join(previous_line1),file=unresolved) 
-                print('\t'.join(line1),file=unresolved)
-                print('\t'.join(previous_line2),file=unresolved) 
-                print('\t'.join(line2),file=unresolved)
-        elif forward_state == 'primary_specific' or reverse_state == 'primary_specific':
-            if primary_specific:
-                print('\t'.join(previous_line1),file=primary_specific) 
-                print('\t'.join(line1),file=primary_specific)
-        elif forward_state == 'secondary_specific' or reverse_state == 'secondary_specific':
-            if secondary_specific:
-                print('\t'.join(previous_line2),file=secondary_specific) 
-                print('\t'.join(line2),file=secondary_specific)
-        elif forward_state == 'primary_multi' or reverse_state == 'primary_multi':
-            if primary_multi:
-                print('\t'.join(previous_line1),file=primary_multi) 
-                print('\t'.join(line1),file=primary_multi)
-        elif forward_state == 'secondary_multi' or reverse_state == 'secondary_multi':
-            if secondary_multi:
-                print('\t'.join(previous_line2),file=secondary_multi) 
-                print('\t'.join(line2),file=secondary_multi)
-        else: raise RuntimeError('Unexpected states forward:{0} reverse:{1}'.format(forward_state,reverse_state)) # pragma: no cover
-        
-        previous_line1 = line1
-        previous_line2 = line2
-        
-    return category_counts
+    return policy_main_paired_end(readpairs, policy=CONSERVATIVE,
+                    primary_specific=primary_specific,
+                    secondary_specific=secondary_specific,
+                    primary_multi=primary_multi,
+                    secondary_multi=secondary_multi,
+                    unassigned=unassigned,
+                    unresolved=unresolved,
+                    min_score=min_score,
+                    tag_func=tag_func)
 
 def output_summary(category_counts, outfile=sys.stderr):
     print('-'*80, file=outfile)
@@ -565,6 +641,181 @@ def output_summary(category_counts, outfile=sys.stderr):
     print(file=outfile)
     pass
 
+def output_cigar_cache_summary(scorer, outfile=sys.stderr):
+    """Print the hit and miss counts of the cache of a CigarScorer"""
+    total = scorer.hits + scorer.misses
+    print('CIGAR score cache: {0} hits, {1} misses ({2:.1%} hit rate, {3} cigars cached)\n'.format(
+              scorer.hits, scorer.misses, scorer.hits / total if total else 0.0, len(scorer._cache)), file=outfile)
+    pass
+
+def add_output_arguments(parser): #pragma: no cover
+    """Add the output file arguments to an argparse parser"""
+    parser.add_argument('--primary_specific',
+                        type=str,
+                        default='-',
+                        help='name for SAM format output file for reads mapping to a specific location in the primary species. \
+                              Default is standard output')
+    parser.add_argument('--secondary_specific',
+                        type=str,
+                        default=None,
+                        help='name for SAM format output file for reads mapping to a specific location in the secondary species')
+    parser.add_argument('--primary_multi',
+                        type=str,
+                        default=None,
+                        help='name for SAM format output file for reads multi mapping in the primary species')
+    parser.add_argument('--secondary_multi',
+                        type=str,
+                        default=None,
+                        help='name for SAM format output file for reads multi mapping in the secondary species')
+    parser.add_argument('--unassigned',
+                        type=str,
+                        default=None,
+                        help='name for SAM format output file for unassigned (non-mapping) reads')
+    parser.add_argument('--unresolved',
+                        type=str,
+                        default=None,
+                        help='name for SAM format output file for unresolved (maps equally well in both species) reads')
+    pass
+
+def pair_policy_file(filename): #pragma: no cover
+    """Load a PairPolicy for the --pair_policy option"""
+    try:
+        return PairPolicy.load(filename)
+    except (OSError, ValueError) as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+def add_classification_arguments(parser): #pragma: no cover
+    """Add the arguments controlling scoring and classification of reads to an argparse parser"""
+    parser.add_argument('--paired',
+                        action='store_true',
+                        help='the SAM files consist of paired reads with forward and reverse reads occuring once and interlaced')
+    pairing = parser.add_mutually_exclusive_group()
+    pairing.add_argument('--conservative',
+                        action='store_true',
+                        help='conservatively allocate paired end reads with discordant category allocations. \
+                              Only pairs that are both specific, or specific and multi will be allocated as specific. \
+                              Pairs that are discordant for species will be deemed unresolved.  Pairs where any read \
+                              is unassigned will be deemed unassigned.')
+    pairing.add_argument('--pair_policy',
+                        type=pair_policy_file,
+                        default=None,
+                        help='a file of rules assigning paired end reads to an output category (or discard) from the \
+                              categories of the forward and reverse reads.  Each line is a forward category, reverse \
+                              category and output, with * matching any category.  The first matching rule is used. \
+                              See xenomapper.policies for the format')
+    parser.add_argument('--min_score',
+                        type=float,
+                        default=float('-inf'),
+                        help='the minimum mapping score.  Reads with scores less than or equal to min_score will be considered unassigned. \
+                              Values should be chosen based on the mapping program and read length')
+    parser.add_argument('--cigar_scores',
+                        action='store_true',
+                        help='Use the cigar line and the NM tag to calculate a score. For aligners that do not support the AS tag. \
+                              No determination of multimapping state will be done.  Reads that are unique in one species and multimap \
+                              in the other species may be misassigned as no score can be calculated in the multimapping species. \
+                              Score is -6 * mismatches + -5 * indel open + -3 * indel extend + -2 * softclip. \
+                              Treatment of multimappers will vary with aligner.  If multimappers are assigned a cigar line they \
+                              will be treated as species specific, otherwise as unassigned.')
+    parser.add_argument('--cigar_penalties',
+                        nargs=4,
+                        type=float,
+                        metavar=('MISMATCH','GAP_OPEN','GAP_EXTEND','SOFTCLIP'),
+                        default=None,
+                        help='the penalties used with --cigar_scores for each mismatch, indel open, indel extend \
+                              and softclipped base. Default = -6 -5 -3 -2')
+    parser.add_argument('--use_zs',
+                        action='store_true',
+                        help='Use the value of the ZS tag in place of XS for determining the mapping score of the next best \
+                              alignment.  Used with HISAT as the XS:A tag is conventionally used for strand in spliced mappers.')
+    parser.add_argument('--score_tags',
+                        nargs=2,
+                        metavar=('SCORE_TAG','OTHER_TAG'),
+                        default=None,
+                        help='the tags holding the score of the best alignment and of the next best alignment for \
+                              aligners that do not use AS and XS.  eg --score_tags ZS ZM')
+    pass
+
+def add_performance_arguments(parser): #pragma: no cover
+    """Add the arguments controlling read matching and parallel processing to an argparse parser"""
+    parser.add_argument('--unordered',
+                        action='store_true',
+                        help='the reads are not in the same order in both files (eg aligners run with multiple threads \
+                              without --reorder).  Reads are matched by name and unmatched reads are held in memory \
+                              until the read is found in the other file. Pairs of reads are kept together with --paired')
+    parser.add_argument('--join_memory',
+                        type=float,
+                        default=1024,
+                        help='the approximate memory in MB used for unmatched reads with --unordered before they are \
+                              spilled to temporary files. Default = 1024')
+    parser.add_argument('--spill_dir',
+                        default=None,
+                        help='the directory for temporary files used with --unordered. Default is the system temporary directory')
+    parser.add_argument('--threads',
+                        type=int,
+                        default=1,
+                        help='the number of processes used for classifying reads. Default = 1')
+    parser.add_argument('--batch_size',
+                        type=int,
+                        default=10000,
+                        help='the number of reads classified together when using --threads or --metrics. Default = 10000')
+    parser.add_argument('--vectorised',
+                        action='store_true',
+                        help='classify reads in batches using NumPy arrays. Requires NumPy to be installed')
+    parser.add_argument('--metrics',
+                        action='store_true',
+                        help='print the read throughput, bytes read from each input, the time spent parsing, '
+                             'extracting scores, classifying and writing reads and the running category counts '
+                             'to stderr every --metrics_interval seconds')
+    parser.add_argument('--metrics_json',
+                        type=argparse.FileType('w'),
+                        default=None,
+                        help='write the --metrics reports to a file as JSON lines')
+    parser.add_argument('--metrics_interval',
+                        type=float,
+                        default=10,
+                        help='the number of seconds between --metrics reports. Default = 10')
+    pass
+
+def add_format_arguments(parser): #pragma: no cover
+    """Add the arguments controlling the output format to an argparse parser"""
+    output_format = parser.add_mutually_exclusive_group()
+    output_format.add_argument('--bam_output',
+                        action='store_true',
+                        help='write all output files in BAM format instead of SAM format')
+    output_format.add_argument('--fastq_output',
+                        action='store_true',
+                        help='write all output files as FASTQ of the reads in their sequenced orientation \
+                              (reverse strand reads are reverse complemented) for aligning again. \
+                              Pairs are interleaved unless --split_fastq is given. \
+                              Output file names ending in .gz or .bgz are BGZF compressed on the --io_threads threads')
+    parser.add_argument('--split_fastq',
+                        action='store_true',
+                        help='with --fastq_output write the first and second reads of pairs to separate files, \
+                              named by adding _R1 and _R2 to each output name before the .fastq and .gz extensions')
+    parser.add_argument('--io_threads',
+                        type=int,
+                        default=1,
+                        help='the number of threads used for compressing BAM and FASTQ output and decompressing '
+                             'BAM and BGZF compressed SAM input. Default = 1')
+    parser.add_argument('--write_buffer',
+                        type=float,
+                        default=4,
+                        help='the size in MB of blocks of output written to each file on a background thread. '
+                             '0 writes output directly. Default = 4')
+    parser.add_argument('--write_queue',
+                        type=int,
+                        default=4,
+                        help='the number of blocks of each output file waiting to be written before '
+                             'classification waits for the file. Default = 4')
+    pass
+
+def add_processing_arguments(parser): #pragma: no cover
+    """Add the arguments controlling classification and output format to an argparse parser"""
+    add_classification_arguments(parser)
+    add_performance_arguments(parser)
+    add_format_arguments(parser)
+    pass
+
 def command_line_interface(*args,**kw): #pragma: no cover
     parser = argparse.ArgumentParser(prog = "xenomapper",
                     formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -584,12 +835,18 @@ def command_line_interface(*args,**kw): #pragma: no cover
                     Limited support is provided for aligners that do not produce AS and XS
                     score tags via the --cigar_score option.
                     
-                    All input files must be seekable
-                    (ie not a FIFO, process substitution or pipe)'
+                    Input files can be pipes, FIFOs or process substitutions
+                    (eg --primary_sam /dev/stdin) so output can be streamed
+                    directly from the aligners.  SAM files compressed with
+                    gzip or bgzip are detected and decompressed automatically.
                     """),
                     epilog = textwrap.dedent("""\
-                    To output bam files in a bash shell use process subtitution:
-                        xenomapper --primary_specific >(samtools view -bS - > outfilename.bam) 
+                    To output bam files use --bam_output:
+                        xenomapper --bam_output --primary_specific outfilename.bam
+                    
+                    To run both aligners and classify their output as it is produced:
+                        xenomapper pipeline --primary_command 'bowtie2 -x human -U reads.fq' \\
+                                            --secondary_command 'bowtie2 -x mouse -U reads.fq'
                     
                     This program is distributed in the hope that it will be useful,
                     but WITHOUT ANY WARRANTY; without even the implied warranty of
@@ -598,11 +855,11 @@ def command_line_interface(*args,**kw): #pragma: no cover
                     """),
                     )
     parser.add_argument('--primary_sam',
-                        type=argparse.FileType('rt'),
+                        type=argparse.FileType('rb'),
                         default=None,
                         help='a SAM format Bowtie2 mapping output file corresponding to the primary species of interest')
     parser.add_argument('--secondary_sam',
-                        type=argparse.FileType('rt'),
+                        type=argparse.FileType('rb'),
                         default=None,
                         help='a SAM format Bowtie2 mapping output file corresponding to the secondary or contaminating species')
     parser.add_argument('--primary_bam',
@@ -613,59 +870,60 @@ def command_line_interface(*args,**kw): #pragma: no cover
                         type=argparse.FileType('rb'),
                         default=None,
                         help='a BAM format Bowtie2 mapping output file corresponding to the secondary or contaminating species')
-    parser.add_argument('--primary_specific',
-                        type=argparse.FileType('wt'),
-                        default=sys.stdout,
-                        help='name for SAM format output file for reads mapping to a specific location in the primary species')
-    parser.add_argument('--secondary_specific',
-                        type=argparse.FileType('wt'),
+    add_output_arguments(parser)
+    add_processing_arguments(parser)
+    parser.add_argument('--estimate',
+                        action='store_true',
+                        help='estimate the proportion of reads in each category from a random sample '
+                             'of reads without writing output files')
+    parser.add_argument('--estimate_precision',
+                        type=float,
+                        default=0.01,
+                        help='stop sampling when the 95%% confidence interval of every category '
+                             'proportion is within this distance of the estimate. Default = 0.01')
+    parser.add_argument('--estimate_max_reads',
+                        type=int,
+                        default=1000000,
+                        help='the maximum number of reads sampled by --estimate. Default = 1000000')
+    parser.add_argument('--seed',
+                        type=int,
                         default=None,
-                        help='name for SAM format output file for reads mapping to a specific location in the secondary species')
-    parser.add_argument('--primary_multi',
-                        type=argparse.FileType('wt'),
+                        help='a seed for the random sampling of --estimate')
+    parser.add_argument('--checkpoint',
                         default=None,
-                        help='name for SAM format output file for reads multi mapping in the primary species')
-    parser.add_argument('--secondary_multi',
-                        type=argparse.FileType('wt'),
+                        help='a file recording the progress of the run so it can be resumed with --resume. \
+                              Requires uncompressed SAM input files and named output files')
+    parser.add_argument('--checkpoint_interval',
+                        type=int,
+                        default=1000000,
+                        help='the number of reads classified between checkpoints. Default = 1000000')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='continue an interrupted run from the --checkpoint file, appending to the output files. \
+                              All other options must be the same as the interrupted run. \
+                              If the checkpoint file does not exist the run starts from the beginning')
+    add_sweep_arguments(parser)
+    parser.add_argument('--score_table',
                         default=None,
-                        help='name for SAM format output file for reads multi mapping in the secondary species')
-    parser.add_argument('--unassigned',
-                        type=argparse.FileType('wt'),
+                        help='a file recording the scores of every read and its position in the input files, \
+                              so the reads can be classified again with different options by xenomapper reclassify \
+                              without reading the input files')
+    parser.add_argument('--manifest',
                         default=None,
-                        help='name for SAM format output file for unassigned (non-mapping) reads')
-    parser.add_argument('--unresolved',
-                        type=argparse.FileType('wt'),
-                        default=None,
-                        help='name for SAM format output file for unresolved (maps equally well in both species) reads')
-    parser.add_argument('--paired',
-                        action='store_true',
-                        help='the SAM files consist of paired reads with forward and reverse reads occuring once and interlaced')
-    parser.add_argument('--conservative',
-                        action='store_true',
-                        help='conservatively allocate paired end reads with discordant category allocations. \
-                              Only pairs that are both specific, or specific and multi will be allocated as specific. \
-                              Pairs that are discordant for species will be deemed unresolved.  Pairs where any read \
-                              is unassigned will be deemed unassigned.')
-    parser.add_argument('--min_score',
-                        type=float,
-                        default=float('-inf'),
-                        help='the minimum mapping score.  Reads with scores less than or equal to min_score will be considered unassigned. \
-                              Values should be chosen based on the mapping program and read length')
-    parser.add_argument('--cigar_scores',
-                        action='store_true',
-                        help='Use the cigar line and the NM tag to calculate a score. For aligners that do not support the AS tag. \
-                              No determination of multimapping state will be done.  Reads that are unique in one species and multimap \
-                              in the other species may be misassigned as no score can be calculated in the multimapping species. \
-                              Score is -6 * mismatches + -5 * indel open + -3 * indel extend + -2 * softclip. \
-                              Treatment of multimappers will vary with aligner.  If multimappers are assigned a cigar line they \
-                              will be treated as species specific, otherwise as unassigned.')
-    parser.add_argument('--use_zs',
-                        action='store_true',
-                        help='Use the value of the ZS tag in place of XS for determining the mapping score of the next best \
-                              alignment.  Used with HISAT as the XS:A tag is conventionally used for strand in spliced mappers.')
+                        help='a file recording the category of every read in input order, \
+                              so the reads of any category can be written later by xenomapper extract. \
+                              Requires --primary_sam and --secondary_sam')
+    parser.add_argument('--manifest_interval',
+                        type=int,
+                        default=10000,
+                        help='the number of reads between the input positions indexed in the --manifest. \
+                              Default = 10000')
+    add_profile_arguments(parser, 'xenomapper_profile.json')
     parser.add_argument('--version',
                         action='store_true',
                         help='print version information and exit')
+    #with --min_score_sweep reads are only written to outputs that are named
+    parser.set_defaults(primary_specific=None)
     args = parser.parse_args()
     if args.version:
         print(__version__)
@@ -675,32 +933,261 @@ def command_line_interface(*args,**kw): #pragma: no cover
         print('ERROR: You must provide --primary_sam and --secondary_sam\n or --primary_bam and --secondary_bam\n')
         parser.print_help()
         sys.exit(1)
+    if args.resume and not args.checkpoint:
+        print('ERROR: --resume requires --checkpoint\n')
+        sys.exit(1)
+    if args.checkpoint and (not args.primary_sam or args.unordered or args.threads > 1 or args.estimate):
+        print('ERROR: --checkpoint requires --primary_sam and --secondary_sam and cannot be used with '
+              '--unordered, --threads or --estimate\n')
+        sys.exit(1)
+    if args.min_score_sweep and (args.estimate or args.checkpoint):
+        print('ERROR: --min_score_sweep cannot be used with --estimate or --checkpoint\n')
+        sys.exit(1)
+    if args.primary_specific is None and not args.min_score_sweep:
+        args.primary_specific = '-'
+    if args.score_table and (args.unordered or args.estimate or args.checkpoint):
+        print('ERROR: --score_table cannot be used with --unordered, --estimate or --checkpoint\n')
+        sys.exit(1)
+    if args.manifest and (not args.primary_sam or args.unordered or args.estimate or args.checkpoint):
+        print('ERROR: --manifest requires --primary_sam and --secondary_sam and cannot be used with '
+              '--unordered, --estimate or --checkpoint\n')
+        sys.exit(1)
+    if args.split_fastq and not args.fastq_output:
+        print('ERROR: --split_fastq requires --fastq_output\n')
+        sys.exit(1)
+    if args.split_fastq and '-' in [getattr(args, category) for category in OUTPUT_CATEGORIES]:
+        print('ERROR: --split_fastq cannot be used with output to standard output. '
+              'Provide a file name for --primary_specific\n')
+        sys.exit(1)
+    if args.checkpoint and args.fastq_output:
+        print('ERROR: --checkpoint cannot be used with --fastq_output\n')
+        sys.exit(1)
+    if args.checkpoint and '-' in [getattr(args, category) for category in OUTPUT_CATEGORIES]:
+        print('ERROR: --checkpoint cannot be used with output to standard output. '
+              'Provide a file name for --primary_specific\n')
+        sys.exit(1)
     return args
     
 
-def main(): #pragma: no cover
-    args = command_line_interface()
-    
+def get_tag_profile(args):
+    """Return the TagProfile selected by the --cigar_scores, --cigar_penalties,
+    --use_zs and --score_tags options in an argparse namespace"""
     if args.cigar_scores:
-        tag_func = get_cigarbased_AS_tag
+        if args.cigar_penalties:
+            return CigarProfile(scorer=CigarScorer(*args.cigar_penalties))
+        return CIGAR
     elif args.use_zs:
-        tag_func = get_tag_with_ZS_as_XS
+        return HISAT
+    elif args.score_tags:
+        return TagProfile(*args.score_tags)
+    return BOWTIE2
+
+def get_main_function(args):
+    """Return the main loop function selected by the --paired,
+    --conservative and --pair_policy options in an argparse namespace"""
+    if args.paired:
+        if getattr(args, 'pair_policy', None):
+            return partial(policy_main_paired_end, policy=args.pair_policy)
+        if args.conservative:
+            return conservative_main_paired_end
+        return main_paired_end
+    return main_single_end
+
+def get_pair_policy(args):
+    """Return the PairPolicy selected by the --conservative and
+    --pair_policy options in an argparse namespace"""
+    if getattr(args, 'pair_policy', None):
+        return args.pair_policy
+    return CONSERVATIVE if args.conservative else LIBERAL
+
+def open_outputs(args, executor=None, output_sizes=None): #pragma: no cover
+    """Open the output file names in args ('-' for standard output) and
+    replace them with SamWriters, BamWriters or FastqWriters.
+    The files are kept in args.output_files keyed by category, and the
+    files of the second reads of --split_fastq output in args.mate_files.
+    If output_sizes is given the existing files are truncated to these sizes
+    and appended to, for resuming from a checkpoint.
+    If args.write_buffer is set the files are written by BackgroundWriters,
+    which are kept in args.background_writers"""
+    args.background_writers = []
+    args.output_files = {}
+    args.mate_files = {}
+    fastq_output = getattr(args, 'fastq_output', False)
+    split_fastq = getattr(args, 'split_fastq', False)
+    def buffered(outfile):
+        if args.write_buffer:
+            outfile = BackgroundWriter(outfile, buffer_size=int(args.write_buffer * 2**20),
+                                       max_pending=args.write_queue)
+            args.background_writers.append(outfile)
+        return outfile
+    for category in OUTPUT_CATEGORIES:
+        filename = getattr(args, category)
+        outfile = filename
+        mate_file = None
+        if outfile == '-':
+            if output_sizes is not None:
+                raise ValueError('Cannot resume writing {0} to standard output'.format(category))
+            if split_fastq:
+                raise ValueError('Cannot write split FASTQ {0} to standard output'.format(category))
+            outfile = sys.stdout.buffer
+        elif outfile and split_fastq:
+            names = split_fastq_names(outfile)
+            outfile = open(names[0], 'wb')
+            mate_file = args.mate_files[category] = open(names[1], 'wb')
+        elif outfile:
+            outfile = open(outfile, 'wb' if output_sizes is None else 'r+b')
+        if outfile:
+            args.output_files[category] = outfile
+            outfile = buffered(outfile)
+            if fastq_output:
+                setattr(args, category, FastqWriter(outfile, mate_fileobj=buffered(mate_file) if mate_file else None,
+                                                    compress=is_compressed_name(filename), executor=executor))
+            elif args.bam_output:
+                setattr(args, category, BamWriter(outfile, executor=executor))
+            else:
+                setattr(args, category, SamWriter(outfile))
+    if output_sizes is not None:
+        truncate_outputs(args.output_files, output_sizes)
+    pass
+
+def close_outputs(args): #pragma: no cover
+    """Close any writer objects (such as BamWriters) used for output
+    and the output files opened by open_outputs"""
+    for category in OUTPUT_CATEGORIES:
+        outfile = getattr(args, category)
+        if hasattr(outfile, 'write_read'):
+            outfile.close()
+    for outfile in args.background_writers:
+        outfile.close()
+    for outfile in list(args.output_files.values()) + list(getattr(args, 'mate_files', {}).values()):
+        if outfile is not sys.stdout.buffer:
+            outfile.close()
+    pass
+
+def get_checkpoint_settings(args): #pragma: no cover
+    """Return a dictionary of the options in args that must be the same
+    when resuming a run from a checkpoint"""
+    return {'paired':args.paired,
+            'conservative':args.conservative,
+            'pair_policy':list(args.pair_policy.table) if args.pair_policy else None,
+            'min_score':str(args.min_score),
+            'tag_func':repr(get_tag_profile(args)),
+            'cigar_penalties':args.cigar_penalties,
+            'bam_output':args.bam_output,
+            'outputs':{category:getattr(args, category) for category in OUTPUT_CATEGORIES},
+            'inputs':[args.primary_sam.name, args.secondary_sam.name],
+            }
+
+def run_estimate(args): #pragma: no cover
+    """Estimate the category proportions of the input files in args and
+    print them with their confidence intervals to stderr.
+    Plain SAM files that are seekable are randomly sampled, other inputs
+    (and files with fewer reads than would be sampled) are classified in
+    file order until the estimate is precise enough.
+    Returns:
+        category_counts - the category counts of the classified reads
+    """
+    tag_func = get_tag_profile(args)
+    def estimate(groups):
+        try:
+            return estimate_category_counts(groups, get_main_function(args),
+                                            precision=args.estimate_precision,
+                                            max_reads=args.estimate_max_reads,
+                                            min_score=args.min_score,
+                                            tag_func=tag_func)
+        except ValueError as error:
+            print('ERROR: {0}'.format(error), file=sys.stderr)
+            sys.exit(1)
+    sampler = None
+    if args.primary_sam:
+        sam1 = open_sam(args.primary_sam)
+        sam2 = open_sam(args.secondary_sam)
+        get_sam_header(sam1)
+        get_sam_header(sam2)
+        if sam1 is args.primary_sam and sam2 is args.secondary_sam and sam1.seekable() and sam2.seekable():
+            sampler = SamSampler(sam1, sam2, paired=args.paired, seed=args.seed)
+            category_counts, converged = estimate(sampler.bounded())
+            if sampler.exhausted:
+                #as many draws as reads in the file, so the whole file is classified instead
+                sam1.seek(sampler.start1)
+                sam2.seek(sampler.start2)
+        groups = sequential_groups(getRawReadPairs(sam1, sam2, skip_repeated_reads=not args.paired))
     else:
-        tag_func = get_tag
+        groups = sequential_groups(getBamReadPairs(BamReader(args.primary_bam), BamReader(args.secondary_bam),
+                                                   skip_repeated_reads=not args.paired))
+    complete = False
+    if not sampler or sampler.exhausted:
+        category_counts, converged = estimate(groups)
+        complete = next(groups, None) is None
+    output_estimate(category_counts, converged=converged or complete, sampled=sampler is not None and not sampler.exhausted,
+                    complete=complete)
+    return category_counts
+
+def run_xenomapper(args): #pragma: no cover
+    """Classify the reads of the input files in args, write the outputs
+    and print a summary of the category counts to stderr.
+    args is an argparse namespace with the options of command_line_interface
+    Returns:
+        category_counts - the category counts of the main loop function
+    """
+    if getattr(args, 'estimate', False):
+        return run_estimate(args)
+    executor = None
+    if args.io_threads > 1:
+        executor = ThreadPoolExecutor(max_workers=args.io_threads)
+    checkpoint_file = getattr(args, 'checkpoint', None)
+    checkpoint = None
+    resuming = False
+    if checkpoint_file:
+        checkpoint = Checkpoint(get_checkpoint_settings(args))
+        if args.resume and os.path.exists(checkpoint_file):
+            settings = checkpoint.settings
+            checkpoint = Checkpoint.load(checkpoint_file)
+            checkpoint.check_settings(settings)
+            resuming = True
+    open_outputs(args, executor=executor, output_sizes=checkpoint.output_sizes if resuming else None)
+    tag_func = get_tag_profile(args)
     
     skip_repeated = False if args.paired else True
     
+    if getattr(args, 'score_table', None) or getattr(args, 'manifest', None):
+        input_names = [f.name for f in ((args.primary_sam, args.secondary_sam) if args.primary_sam
+                                        else (args.primary_bam, args.secondary_bam))]
+    
+    metrics = None
+    if args.metrics or args.metrics_json:
+        metrics = Metrics(outfile=args.metrics_json or sys.stderr, json_lines=bool(args.metrics_json),
+                          interval=args.metrics_interval)
+        if args.primary_sam:
+            args.primary_sam = metrics.meter_input('primary', args.primary_sam)
+            args.secondary_sam = metrics.meter_input('secondary', args.secondary_sam)
+        else:
+            args.primary_bam = metrics.meter_input('primary', args.primary_bam)
+            args.secondary_bam = metrics.meter_input('secondary', args.secondary_bam)
+    
     if args.primary_sam:
-        process_headers(args.primary_sam,args.secondary_sam,
-                            primary_specific=args.primary_specific,
-                            secondary_specific=args.secondary_specific,
-                            primary_multi=args.primary_multi,
-                            secondary_multi=args.secondary_multi,
-                            unassigned=args.unassigned,
-                            unresolved=args.unresolved)
+        samfiles = [args.primary_sam, args.secondary_sam]
+        args.primary_sam = open_sam(args.primary_sam, executor=executor)
+        args.secondary_sam = open_sam(args.secondary_sam, executor=executor)
+        if checkpoint and ([args.primary_sam, args.secondary_sam] != samfiles or
+                           not all(f.seekable() for f in samfiles)):
+            raise ValueError('--checkpoint requires uncompressed SAM input files that are not pipes')
+        headers = {category:getattr(args, category) for category in OUTPUT_CATEGORIES}
+        if resuming:
+            #the headers are already in the output files
+            headers = {category:HeaderRestorer(writer) if writer else None for category, writer in headers.items()}
+        process_headers(args.primary_sam,args.secondary_sam, **headers)
+        if resuming:
+            for samfile, offset in zip(samfiles, checkpoint.input_offsets):
+                samfile.seek(offset)
                         
-        readpairs = getReadPairs(args.primary_sam, args.secondary_sam, skip_repeated_reads=skip_repeated)
+        if args.unordered:
+            records1, records2 = sam_lines(args.primary_sam), sam_lines(args.secondary_sam)
+        else:
+            readpairs = getRawReadPairs(args.primary_sam, args.secondary_sam, skip_repeated_reads=skip_repeated)
     else:
+        args.primary_bam = BamReader(args.primary_bam, executor=executor)
+        args.secondary_bam = BamReader(args.secondary_bam, executor=executor)
         process_headers(args.primary_bam,args.secondary_bam,
                             primary_specific=args.primary_specific,
                             secondary_specific=args.secondary_specific,
@@ -710,36 +1197,146 @@ def main(): #pragma: no cover
                             unresolved=args.unresolved,
                             bam=True)
                         
-        readpairs = getBamReadPairs(args.primary_bam, args.secondary_bam, skip_repeated_reads=skip_repeated)
-        
-    
-    if args.paired:
-        if args.conservative:
-            paired_function = conservative_main_paired_end
+        if args.unordered:
+            records1, records2 = iter(args.primary_bam), iter(args.secondary_bam)
         else:
-            paired_function = main_paired_end
-        category_counts = paired_function(readpairs,
-                        primary_specific=args.primary_specific,
-                        secondary_specific=args.secondary_specific,
-                        primary_multi=args.primary_multi,
-                        secondary_multi=args.secondary_multi,
-                        unassigned=args.unassigned,
-                        unresolved=args.unresolved,
+            readpairs = getBamReadPairs(args.primary_bam, args.secondary_bam, skip_repeated_reads=skip_repeated)
+    
+    score_table = None
+    if getattr(args, 'score_table', None):
+        settings = {'paired':args.paired,
+                    'tag_func':repr(tag_func),
+                    'min_score':str(args.min_score),
+                    'inputs':input_names}
+        #offsets are only recorded for uncompressed SAM files
+        uncompressed = args.primary_sam and [args.primary_sam, args.secondary_sam] == samfiles
+        score_table = ScoreTableWriter(open(args.score_table, 'wb'), get_score_function(tag_func), settings,
+                                       samfiles=samfiles if uncompressed else None)
+        readpairs = score_table.record(readpairs)
+    
+    manifest = None
+    if getattr(args, 'manifest', None):
+        settings = {'paired':args.paired,
+                    'tag_func':repr(tag_func),
+                    'min_score':str(args.min_score),
+                    'pair_policy':get_pair_policy(args).name,
+                    'inputs':input_names}
+        #the index is only recorded for uncompressed SAM files
+        manifest = ManifestWriter(open(args.manifest, 'wb'), settings,
+                                  samfiles=samfiles if [args.primary_sam, args.secondary_sam] == samfiles else None,
+                                  interval=args.manifest_interval)
+        readpairs = manifest.record(readpairs, get_score_function(tag_func), min_score=args.min_score,
+                                    paired=args.paired, policy=get_pair_policy(args))
+    
+    if args.unordered:
+        readpairs = ReadPairJoiner(records1, records2, paired=args.paired,
+                                   memory_limit=int(args.join_memory * 2**20),
+                                   spill_dir=args.spill_dir)
+    
+    main_function = get_main_function(args)
+    if args.vectorised and args.paired and args.pair_policy:
+        main_function = partial(vectorised_main, paired=True, policy=args.pair_policy)
+    elif args.vectorised:
+        main_function = {main_single_end:vectorised_main_single_end,
+                         main_paired_end:vectorised_main_paired_end,
+                         conservative_main_paired_end:vectorised_conservative_main_paired_end,
+                         }[main_function]
+    
+    outputs = dict(primary_specific=args.primary_specific,
+                   secondary_specific=args.secondary_specific,
+                   primary_multi=args.primary_multi,
+                   secondary_multi=args.secondary_multi,
+                   unassigned=args.unassigned,
+                   unresolved=args.unresolved)
+    
+    classified = readpairs
+    sweep = None
+    if getattr(args, 'min_score_sweep', None):
+        sweep = ThresholdSweep(args.min_score_sweep, paired=args.paired)
+        classified = sweep.record(readpairs, get_score_function(tag_func))
+    if metrics:
+        classified = metrics.timed_readpairs(classified)
+        outputs = metrics.timed_outputs(outputs)
+        if args.threads == 1: #scores are extracted in the worker processes with --threads
+            tag_func = metrics.timed_profile(tag_func)
+    
+    if args.threads > 1:
+        category_counts = parallel_main(main_function, classified,
+                        threads=args.threads,
+                        batch_size=args.batch_size,
+                        paired=args.paired,
+                        min_score=args.min_score,
+                        tag_func=tag_func,
+                        **outputs)
+    elif checkpoint:
+        category_counts = checkpointed_main(metrics.timed_main(main_function) if metrics else main_function,
+                        classified,
+                        samfiles=samfiles,
+                        writers=outputs,
+                        files=args.output_files,
+                        checkpoint=checkpoint,
+                        filename=checkpoint_file,
+                        interval=args.checkpoint_interval,
+                        paired=args.paired,
                         min_score=args.min_score,
                         tag_func=tag_func)
-        
+    elif metrics:
+        category_counts = metered_main(main_function, classified, metrics,
+                        batch_size=args.batch_size,
+                        paired=args.paired,
+                        min_score=args.min_score,
+                        tag_func=tag_func,
+                        **outputs)
     else:
-        category_counts = main_single_end(readpairs,
-                        primary_specific=args.primary_specific,
-                        secondary_specific=args.secondary_specific,
-                        primary_multi=args.primary_multi,
-                        secondary_multi=args.secondary_multi,
-                        unassigned=args.unassigned,
-                        unresolved=args.unresolved,
+        category_counts = main_function(classified,
                         min_score=args.min_score,
-                        tag_func=tag_func)
+                        tag_func=tag_func,
+                        **outputs)
     
+    close_outputs(args)
+    if score_table:
+        score_table.close()
+    if manifest:
+        manifest.close()
+    if metrics:
+        if args.threads > 1:
+            metrics.category_counts = Counter(category_counts)
+        metrics.report()
+        if args.metrics_json:
+            args.metrics_json.close()
+    if checkpoint_file:
+        #the run is complete so there is nothing to resume
+        os.remove(checkpoint_file)
+    if executor:
+        executor.shutdown()
     output_summary(category_counts=category_counts)
+    if sweep:
+        output_sweep(sweep, policy=get_pair_policy(args), outfile=args.sweep_output or sys.stderr,
+                     json_format=args.sweep_json)
+    if args.unordered:
+        output_join_summary(readpairs)
+    if args.cigar_scores and args.threads == 1:
+        output_cigar_cache_summary(getattr(tag_func, 'profile', tag_func).scorer)
+    return category_counts
+
+#Subcommands are run by the main function of these modules
+SUBCOMMANDS = {'pipeline':'xenomapper.pipeline',
+               'nway':'xenomapper.nway',
+               'shard':'xenomapper.shard',
+               'compare_profiles':'xenomapper.profiling',
+               'benchmark':'xenomapper.benchmark.harness',
+               'reclassify':'xenomapper.scoretable',
+               'extract':'xenomapper.manifest',
+               }
+
+def main(): #pragma: no cover
+    if sys.argv[1:2] and sys.argv[1] in SUBCOMMANDS:
+        return importlib.import_module(SUBCOMMANDS[sys.argv[1]]).main(sys.argv[2:])
+    args = command_line_interface()
+    if args.profile:
+        profile_call(run_xenomapper, args, program='xenomapper', report_file=args.profile, top=args.profile_top)
+    else:
+        run_xenomapper(args)
     pass
 
 